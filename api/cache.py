@@ -0,0 +1,193 @@
+"""
+Response cache for the Flask API.
+
+Responses are keyed by endpoint, normalized query parameters and the data
+version published by the scraping pipeline: once a crawl commits changes the
+version moves on and older entries are simply never hit again (they age out
+of the LRU, or expire in the shared backend).
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request, make_response
+
+from api.profiling import BYPASS_CACHE_ENVIRON_KEY
+
+try:
+    import redis
+except ImportError:  # Optional shared backend
+    redis = None
+
+logger = logging.getLogger('cache')
+
+
+def normalize_args(args):
+    """
+    Normalize query parameters so equivalent requests share a cache entry:
+    parameter order does not matter and empty values are ignored.
+    """
+    normalized = []
+    for key in sorted(args.keys()):
+        values = sorted(v.strip() for v in args.getlist(key) if v.strip())
+        if values:
+            normalized.append((key, values))
+    return normalized
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry expiry"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Shared cache backend so every API worker benefits from the same entries.
+    A (body, content type) entry is stored as the content type, a newline and
+    the body: never unpickled, so that writing to the Redis server does not
+    give code execution in the API workers.
+    """
+
+    def __init__(self, url, prefix='price_comparator:cache:'):
+        if redis is None:
+            raise RuntimeError("The redis package is required for the shared cache backend")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return None
+        content_type, separator, body = value.partition(b'\n')
+        try:
+            if not separator:
+                raise ValueError('no content type')
+            return body, content_type.decode('ascii')
+        except ValueError as e:
+            logger.warning(f"Ignoring invalid shared cache entry {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl):
+        body, content_type = value
+        self.client.set(self.prefix + key, content_type.encode('ascii') + b'\n' + body, ex=max(1, int(ttl)))
+
+
+class ResponseCache:
+    """
+    Two-level response cache: in-process LRU first, then the optional shared backend.
+    Only successful (200) responses are stored, unless marked Cache-Control: no-store.
+    """
+
+    def __init__(self, data_version, max_entries=1024, ttl=300, shared_url=None):
+        self.data_version = data_version
+        self.ttl = ttl
+        self.local = LRUCache(max_entries)
+        self.shared = None
+        self.hits = 0
+        self.misses = 0
+
+        if shared_url:
+            try:
+                self.shared = RedisBackend(shared_url)
+            except Exception as e:
+                logger.warning(f"Shared cache backend disabled: {e}")
+
+    def make_key(self, endpoint, args):
+        """Key = endpoint + normalized query parameters + data version"""
+        raw = json.dumps([endpoint, normalize_args(args), self.data_version.get()])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache read failed: {e}")
+            if value is not None:
+                self.local.set(key, value, self.ttl)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value, self.ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                logger.warning(f"Shared cache write failed: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self.local),
+            'shared_backend': self.shared is not None,
+            'data_version': self.data_version.get(),
+        }
+
+    def cached(self, view):
+        """Decorator caching the response of a GET view"""
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.environ.get(BYPASS_CACHE_ENVIRON_KEY):
+                # Profiled request: measure the real work
+                response = make_response(view(*args, **kwargs))
+                response.headers['X-Cache'] = 'BYPASS'
+                return response
+
+            key = self.make_key(request.path, request.args)
+            entry = self.get(key)
+
+            if entry is not None:
+                body, content_type = entry
+                response = make_response(body, 200)
+                response.headers['Content-Type'] = content_type
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+                self.set(key, (response.get_data(), response.headers['Content-Type']))
+            response.headers['X-Cache'] = 'MISS'
+            return response
+
+        return wrapper
@@ -0,0 +1,79 @@
+"""
+Count strategy of the list endpoints.
+
+Counts are often the slowest part of a /products call on broad filters:
+- unfiltered counts use the collection metadata (estimated_document_count)
+  instead of walking an index;
+- filtered counts stop at `cap` + 1 documents: beyond the cap the result is a
+  CappedCount (reported as e.g. "10000+");
+- results are cached per normalized query and data version, so paging
+  through a result set or switching its sort order counts once.
+"""
+
+import hashlib
+import json
+from datetime import datetime
+
+from api.cache import LRUCache
+from api.plans import CappedCount
+
+# Rolling windows ("added in the last 24 hours") are rebuilt from datetime.now()
+# on every request: dates in cache keys are rounded to this many seconds
+COUNT_CACHE_TIME_RESOLUTION = 60
+
+
+def _key_value(value):
+    if isinstance(value, datetime):
+        return int(value.timestamp() // COUNT_CACHE_TIME_RESOLUTION)
+    return str(value)
+
+
+class CountStrategy:
+    """
+    `cap`: largest exact count (None counts everything); cached entries expire
+    after `ttl` seconds at most, and when the data version changes.
+    """
+
+    def __init__(self, data_version, cap=10000, max_entries=4096, ttl=300):
+        self.data_version = data_version
+        self.cap = cap
+        self.ttl = ttl
+        self.cache = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, operation):
+        raw = json.dumps([operation.collection, operation.filter, self.cap, self.data_version.get()],
+                         default=_key_value, sort_keys=True)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def lookup(self, operation):
+        """(cache key, cached count or None)"""
+        key = self.key(operation)
+        value = self.cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return key, value
+
+    def count_options(self):
+        """Extra count_documents() options: stop counting just past the cap"""
+        return {'limit': self.cap + 1} if self.cap else {}
+
+    def store(self, key, count):
+        """Cap and cache a count returned by count_documents()"""
+        if self.cap and count > self.cap:
+            count = CappedCount(self.cap)
+        self.cache.set(key, count, self.ttl)
+        return count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            'entries': len(self.cache),
+            'cap': self.cap,
+        }
@@ -0,0 +1,235 @@
+"""
+Executors running the endpoint plans of api/plans.py against MongoDB.
+
+SyncExecutor uses pymongo (Flask server) and runs the operations of a batch
+one after the other. AsyncExecutor uses Motor (ASGI server) and runs them
+concurrently with asyncio.gather; Call operations (in-process helpers backed
+by pymongo, e.g. the facet catalog) run in a worker thread so they never
+block the event loop.
+
+Each request gets the time budget of its endpoint: every query is sent with
+maxTimeMS set to the time left, so a pathological filter is stopped by the
+server instead of pinning a worker. A count exceeding the budget is replaced
+by an ApproximateCount, reported by the response: the collection's estimated
+size when unfiltered, otherwise a lower bound, the documents matched within
+APPROXIMATE_COUNT_MS (at most APPROXIMATE_COUNT_LIMIT, 0 if that times out
+too). Any other query exceeding the budget fails with QueryTimeout (503).
+
+Counts go through the optional count strategy (api/counts.py): metadata
+counts when unfiltered, capped and cached counts otherwise.
+"""
+
+import asyncio
+import time
+
+from pymongo.errors import ExecutionTimeout, NetworkTimeout
+
+from api.plans import Aggregate, ApiError, ApproximateCount, Call, Count, Find
+
+TIMEOUT_ERRORS = (ExecutionTimeout, NetworkTimeout)
+
+# Lower bound of a filtered count that exceeded the budget
+APPROXIMATE_COUNT_LIMIT = 1000
+APPROXIMATE_COUNT_MS = 50
+
+
+class QueryTimeout(ApiError):
+    """A query exceeded the time budget of its endpoint"""
+
+    def __init__(self):
+        super().__init__('The query took too long, please narrow down the filters', 503)
+
+
+class QueryBudget:
+    """Deadline shared by the queries of one request"""
+
+    def __init__(self, budget_ms=None):
+        self.deadline = time.monotonic() + budget_ms / 1000 if budget_ms else None
+
+    def remaining_ms(self):
+        """Milliseconds left (0 once exhausted), None when unlimited"""
+        if self.deadline is None:
+            return None
+        return max(int((self.deadline - time.monotonic()) * 1000), 0)
+
+
+class BaseExecutor:
+    """
+    `budgets` maps an endpoint name to its time budget in milliseconds
+    (endpoints not listed are unlimited); `slow_query_log` is an optional
+    api.querylog.SlowQueryLog, `count_strategy` an optional
+    api.counts.CountStrategy and `metrics` an optional api.metrics.ApiMetrics.
+    """
+
+    def __init__(self, db, budgets=None, slow_query_log=None, count_strategy=None, metrics=None):
+        self.db = db
+        self.budgets = budgets or {}
+        self.slow_query_log = slow_query_log
+        self.count_strategy = count_strategy
+        self.metrics = metrics
+
+    def budget(self, endpoint):
+        return QueryBudget(self.budgets.get(endpoint))
+
+    def _record(self, endpoint, operation, started, timed_out=False):
+        seconds = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.observe_mongo(type(operation).__name__.lower(), operation.collection, seconds, timed_out)
+        if self.slow_query_log is not None:
+            self.slow_query_log.record(endpoint, operation, seconds * 1000, timed_out)
+
+    @staticmethod
+    def _cursor(collection, operation, max_time_ms):
+        cursor = collection.find(operation.filter, operation.projection)
+        if max_time_ms:
+            cursor = cursor.max_time_ms(max_time_ms)
+        if operation.sort:
+            cursor = cursor.sort(operation.sort)
+        if operation.skip:
+            cursor = cursor.skip(operation.skip)
+        if operation.limit:
+            cursor = cursor.limit(operation.limit)
+        return cursor
+
+    @staticmethod
+    def _lower_bound(count):
+        """Result of a capped fallback count: exact below the limit"""
+        return count if count < APPROXIMATE_COUNT_LIMIT else ApproximateCount(count)
+
+
+class SyncExecutor(BaseExecutor):
+    """Run plans with a pymongo database"""
+
+    def _count(self, collection, operation, options):
+        strategy = self.count_strategy
+        if strategy is None:
+            return collection.count_documents(operation.filter, **options)
+        if not operation.filter:
+            # Unfiltered: read the collection metadata instead of walking an index
+            return collection.estimated_document_count(**options)
+        key, count = strategy.lookup(operation)
+        if count is None:
+            count = strategy.store(
+                key, collection.count_documents(operation.filter, **options, **strategy.count_options()))
+        return count
+
+    def _query(self, operation, max_time_ms):
+        collection = self.db[operation.collection]
+        options = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+        if isinstance(operation, Count):
+            return self._count(collection, operation, options)
+        if isinstance(operation, Find):
+            return list(self._cursor(collection, operation, max_time_ms))
+        if isinstance(operation, Aggregate):
+            return list(collection.aggregate(operation.pipeline, **options))
+        raise TypeError(f"Unknown operation: {operation!r}")
+
+    def _approximate_count(self, operation):
+        collection = self.db[operation.collection]
+        if not operation.filter:
+            return ApproximateCount(collection.estimated_document_count())
+        try:
+            return self._lower_bound(collection.count_documents(
+                operation.filter, limit=APPROXIMATE_COUNT_LIMIT, maxTimeMS=APPROXIMATE_COUNT_MS))
+        except TIMEOUT_ERRORS:
+            return ApproximateCount(0)
+
+    def execute(self, operation, budget, endpoint=None):
+        if isinstance(operation, Call):
+            return operation.func(*operation.args)
+
+        started = time.perf_counter()
+        try:
+            max_time_ms = budget.remaining_ms()
+            if max_time_ms == 0:
+                raise ExecutionTimeout('Query budget exhausted')
+            result = self._query(operation, max_time_ms)
+        except TIMEOUT_ERRORS:
+            self._record(endpoint, operation, started, timed_out=True)
+            if isinstance(operation, Count):
+                return self._approximate_count(operation)
+            raise QueryTimeout()
+
+        self._record(endpoint, operation, started)
+        return result
+
+    def run(self, plan, endpoint=None):
+        """Drive a plan to completion and return its response data"""
+        budget = self.budget(endpoint)
+        try:
+            operations = next(plan)
+            while True:
+                results = [self.execute(operation, budget, endpoint) for operation in operations]
+                operations = plan.send(results)
+        except StopIteration as stop:
+            return stop.value
+
+
+class AsyncExecutor(BaseExecutor):
+    """Run plans with a Motor database, each batch of operations concurrently"""
+
+    async def _count(self, collection, operation, options):
+        strategy = self.count_strategy
+        if strategy is None:
+            return await collection.count_documents(operation.filter, **options)
+        if not operation.filter:
+            # Unfiltered: read the collection metadata instead of walking an index
+            return await collection.estimated_document_count(**options)
+        key, count = strategy.lookup(operation)
+        if count is None:
+            count = strategy.store(
+                key, await collection.count_documents(operation.filter, **options, **strategy.count_options()))
+        return count
+
+    async def _query(self, operation, max_time_ms):
+        collection = self.db[operation.collection]
+        options = {'maxTimeMS': max_time_ms} if max_time_ms else {}
+        if isinstance(operation, Count):
+            return await self._count(collection, operation, options)
+        if isinstance(operation, Find):
+            return await self._cursor(collection, operation, max_time_ms).to_list(length=None)
+        if isinstance(operation, Aggregate):
+            return await collection.aggregate(operation.pipeline, **options).to_list(length=None)
+        raise TypeError(f"Unknown operation: {operation!r}")
+
+    async def _approximate_count(self, operation):
+        collection = self.db[operation.collection]
+        if not operation.filter:
+            return ApproximateCount(await collection.estimated_document_count())
+        try:
+            return self._lower_bound(await collection.count_documents(
+                operation.filter, limit=APPROXIMATE_COUNT_LIMIT, maxTimeMS=APPROXIMATE_COUNT_MS))
+        except TIMEOUT_ERRORS:
+            return ApproximateCount(0)
+
+    async def execute(self, operation, budget, endpoint=None):
+        if isinstance(operation, Call):
+            return await asyncio.to_thread(operation.func, *operation.args)
+
+        started = time.perf_counter()
+        try:
+            max_time_ms = budget.remaining_ms()
+            if max_time_ms == 0:
+                raise ExecutionTimeout('Query budget exhausted')
+            result = await self._query(operation, max_time_ms)
+        except TIMEOUT_ERRORS:
+            self._record(endpoint, operation, started, timed_out=True)
+            if isinstance(operation, Count):
+                return await self._approximate_count(operation)
+            raise QueryTimeout()
+
+        self._record(endpoint, operation, started)
+        return result
+
+    async def run(self, plan, endpoint=None):
+        """Drive a plan to completion and return its response data"""
+        budget = self.budget(endpoint)
+        try:
+            operations = next(plan)
+            while True:
+                results = await asyncio.gather(
+                    *(self.execute(operation, budget, endpoint) for operation in operations)
+                )
+                operations = plan.send(list(results))
+        except StopIteration as stop:
+            return stop.value
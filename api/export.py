@@ -0,0 +1,112 @@
+"""
+Record encoding of the /export endpoint (NDJSON or CSV, optionally gzip),
+shared by the Flask and ASGI servers which only differ in how they iterate
+over the MongoDB cursor.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from bson import ObjectId
+
+EXPORT_BATCH_SIZE = 1000  # Documents fetched per cursor batch
+EXPORT_CHUNK_SIZE = 64 * 1024  # Bytes per streamed chunk
+
+
+def export_value(value):
+    """JSON default for exported documents"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def content_type_and_filename(export_format, compress):
+    content_type = 'text/csv; charset=utf-8' if export_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+    filename = f"products_{datetime.now().strftime('%Y_%m_%d_%H_%M_%S')}.{export_format}"
+    if compress:
+        content_type = 'application/gzip'
+        filename += '.gz'
+    return content_type, filename
+
+
+class ExportEncoder:
+    """
+    Encodes documents one by one and groups the output in chunks of about
+    `chunk_size` bytes, optionally gzip-compressed on the fly:
+
+        encoder = ExportEncoder('csv', columns, compress=True)
+        for product in cursor:
+            chunk = encoder.add(product)
+            if chunk:
+                send(chunk)
+        send(encoder.finish())
+    """
+
+    def __init__(self, export_format, columns, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+        self.export_format = export_format
+        self.columns = columns
+        self.chunk_size = chunk_size
+        self.compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31: gzip container
+        self.exported = 0
+        self._pending = []
+        self._pending_size = 0
+
+        if export_format == 'csv':
+            self._buffer = io.StringIO()
+            self._writer = csv.writer(self._buffer)
+            self._writer.writerow(columns)
+            self._append(self._take_buffer())
+
+    def _take_buffer(self):
+        value = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return value
+
+    def _encode(self, product):
+        if self.export_format != 'csv':
+            return json.dumps(product, default=export_value, ensure_ascii=False) + '\n'
+
+        row = []
+        for column in self.columns:
+            value = product.get(column)
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value, default=export_value, ensure_ascii=False)
+            elif isinstance(value, (datetime, ObjectId)):
+                value = export_value(value)
+            row.append('' if value is None else value)
+        self._writer.writerow(row)
+        return self._take_buffer()
+
+    def _append(self, record):
+        data = record.encode('utf-8')
+        if self.compressor:
+            data = self.compressor.compress(data)
+        if data:
+            self._pending.append(data)
+            self._pending_size += len(data)
+
+    def _flush(self):
+        chunk = b''.join(self._pending)
+        self._pending = []
+        self._pending_size = 0
+        return chunk
+
+    def add(self, product):
+        """Encode a document; returns a chunk to send once enough data is pending, else None"""
+        self._append(self._encode(product))
+        self.exported += 1
+        if self._pending_size >= self.chunk_size:
+            return self._flush()
+        return None
+
+    def finish(self):
+        """Remaining data (and the gzip trailer)"""
+        if self.compressor:
+            self._pending.append(self.compressor.flush())
+        return self._flush()
@@ -0,0 +1,137 @@
+"""
+HTTP-level optimizations for the API: strong ETags and response compression.
+
+ETags are derived from the data version published by the pipeline (plus the
+endpoint, normalized query parameters and a time bucket for the time-relative
+counters), so they can be checked before the view runs: a repeat poll with a
+matching If-None-Match gets `304 Not Modified` without touching MongoDB.
+Responses are compressed with brotli (when installed) or gzip, depending on
+the client's Accept-Encoding.
+"""
+
+import gzip
+import hashlib
+import json
+import time
+
+from flask import current_app, request
+
+from api.cache import normalize_args
+
+try:
+    import brotli
+except ImportError:  # Optional, gzip is used instead
+    brotli = None
+
+
+def accepted_encodings(header):
+    """Encodings accepted by the client (ignoring those with q=0)"""
+    encodings = set()
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def compute_etag(version, bucket_seconds, path, args):
+    """Strong ETag of a representation (before content coding)"""
+    bucket = int(time.time() // bucket_seconds)
+    raw = json.dumps([version, bucket, path, normalize_args(args)])
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def matching_etag(if_none_match, etag):
+    """
+    The tag of an If-None-Match header matching `etag` (each content coding has
+    its own strong ETag: "<etag>", "<etag>-gzip", "<etag>-br"), else None.
+    """
+    if not if_none_match:
+        return None
+    candidates = {tag.strip().removeprefix('W/').strip('"') for tag in if_none_match.split(',')}
+    matches = candidates & {etag, f"{etag}-gzip", f"{etag}-br"}
+    if matches:
+        return matches.pop()
+    if '*' in candidates:
+        return etag
+    return None
+
+
+def negotiate_encoding(accept_encoding):
+    """Preferred content coding for an Accept-Encoding header: br, gzip or None"""
+    encodings = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return None
+
+
+def compress_body(body, encoding, gzip_level=6, brotli_quality=4):
+    if encoding == 'br':
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+def encoded_etag(etag, encoding):
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+class HTTPOptimizations:
+    """
+    Registers before/after request hooks on the app:
+    - ETag + 304 handling for the endpoints listed in `etag_endpoints`
+    - brotli/gzip compression of responses larger than `min_size` bytes
+    """
+
+    def __init__(self, app, data_version, etag_endpoints, bucket_seconds=300,
+                 min_size=1024, gzip_level=6, brotli_quality=4):
+        self.data_version = data_version
+        self.etag_endpoints = set(etag_endpoints)
+        self.bucket_seconds = bucket_seconds
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        app.before_request(self.check_not_modified)
+        app.after_request(self.finalize_response)
+
+    def _uses_etag(self):
+        return request.method == 'GET' and request.endpoint in self.etag_endpoints
+
+    def check_not_modified(self):
+        if not self._uses_etag():
+            return None
+
+        etag = compute_etag(self.data_version.get(), self.bucket_seconds, request.path, request.args)
+        request.environ['price_comparator.etag'] = etag
+
+        matched = matching_etag(request.headers.get('If-None-Match', ''), etag)
+        if matched:
+            response = current_app.response_class(status=304)
+            response.set_etag(matched)
+            response.vary.add('Accept-Encoding')
+            return response
+        return None
+
+    def finalize_response(self, response):
+        etag = request.environ.get('price_comparator.etag')
+        cacheable = response.status_code == 200 and not response.is_streamed and not response.direct_passthrough
+
+        encoding = None
+        if cacheable and 'Content-Encoding' not in response.headers:
+            encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+            body = response.get_data()
+            if encoding and len(body) >= self.min_size:
+                response.set_data(compress_body(body, encoding, self.gzip_level, self.brotli_quality))
+                response.headers['Content-Encoding'] = encoding
+            else:
+                encoding = None
+            response.vary.add('Accept-Encoding')
+
+        if etag and cacheable and 'no-store' not in response.headers.get('Cache-Control', ''):
+            response.set_etag(encoded_etag(etag, encoding))
+
+        return response
@@ -0,0 +1,83 @@
+"""
+Metrics of the API, exposed in Prometheus text format by the /metrics endpoint:
+- request latency, count (by status) and response size per route
+- MongoDB operation latency and timeouts (recorded by the plan executors)
+- response cache and count cache hits/misses
+
+With several worker processes, each worker exposes its own metrics.
+"""
+
+import time
+
+from flask import request
+
+from price_comparator.metrics import SIZE_BUCKETS, Registry
+
+
+class ApiMetrics:
+    """
+    Metrics of one API process. `caches` maps a cache name to an object with
+    `hits`/`misses` attributes (ResponseCache, CountStrategy).
+    """
+
+    def __init__(self, caches=None, registry=None):
+        self.registry = registry or Registry()
+        self.request_duration = self.registry.histogram(
+            'api_request_duration_seconds', 'Time spent serving a request', ['route', 'method'])
+        self.requests = self.registry.counter(
+            'api_requests_total', 'Requests served', ['route', 'method', 'status'])
+        self.response_size = self.registry.histogram(
+            'api_response_size_bytes', 'Size of response bodies as sent (after compression)', ['route'],
+            buckets=SIZE_BUCKETS)
+        self.mongo_duration = self.registry.histogram(
+            'api_mongo_operation_duration_seconds', 'MongoDB operation latency', ['operation', 'collection'])
+        self.mongo_timeouts = self.registry.counter(
+            'api_mongo_operation_timeouts_total', 'MongoDB operations stopped by their time budget',
+            ['operation', 'collection'])
+
+        self.caches = dict(caches or {})
+        self.registry.add_collector(self._collect_caches)
+
+    def _collect_caches(self):
+        hits = [({'cache': name}, cache.hits) for name, cache in self.caches.items()]
+        misses = [({'cache': name}, cache.misses) for name, cache in self.caches.items()]
+        return [
+            ('api_cache_hits_total', 'counter', 'Cache lookups answered from the cache', hits),
+            ('api_cache_misses_total', 'counter', 'Cache lookups not found in the cache', misses),
+        ]
+
+    def observe_request(self, route, method, status, seconds, size=None):
+        self.request_duration.labels(route, method).observe(seconds)
+        self.requests.labels(route, method, str(status)).inc()
+        if size is not None:
+            self.response_size.labels(route).observe(size)
+
+    def observe_mongo(self, operation, collection, seconds, timed_out=False):
+        self.mongo_duration.labels(operation, collection).observe(seconds)
+        if timed_out:
+            self.mongo_timeouts.labels(operation, collection).inc()
+
+    def render(self):
+        return self.registry.render()
+
+    def init_flask(self, app):
+        """
+        Time every request of a Flask app. Register before the other hooks:
+        after_request functions run in reverse order, so the response size is
+        then measured after compression.
+        """
+        app.before_request(self._start_timer)
+        app.after_request(self._observe_flask_response)
+
+    @staticmethod
+    def _start_timer():
+        request.environ['price_comparator.started'] = time.perf_counter()
+
+    def _observe_flask_response(self, response):
+        started = request.environ.get('price_comparator.started')
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            size = None if response.is_streamed else response.calculate_content_length()
+            self.observe_request(route, request.method, response.status_code,
+                                 time.perf_counter() - started, size)
+        return response
@@ -0,0 +1,532 @@
+"""
+Endpoint logic shared by the Flask (app.py) and ASGI (asgi_app.py) servers.
+
+Each endpoint is written once as a "plan": a generator that yields batches of
+independent MongoDB operations (Count, Find, Aggregate, or a Call to one of
+the in-process helpers) and receives their results, in the same order, before
+building the response data. The executors in api/executors.py run a batch
+sequentially with pymongo, or concurrently with Motor, so the queries of a
+request (the page of products and its five counters...) overlap on the async
+server without duplicating the endpoint code.
+
+Plans raise ApiError for client errors (bad parameters, unknown product).
+The result of a Count is an int, a CappedCount when the query matches more
+documents than the count cap (api/counts.py), or an ApproximateCount when the
+exact count could not be computed within the endpoint's time budget (a lower
+bound for filtered counts, see api/executors.py). List
+responses report `counts_exact` and which counts are capped or approximate.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from price_comparator.facets import regex_filter
+from price_comparator.rollups import day_key
+from price_comparator.trigram import TRIGRAM_COLLECTION, TrigramIndex
+
+PRODUCTS_COLLECTION = 'products'
+
+# Fuzzy search (trigram index maintained by the scraping pipeline)
+FUZZY_SEARCH_LIMIT = 500  # Maximum number of candidates ranked per search
+FUZZY_MIN_SIMILARITY = 0.3  # Minimum share of the search trigrams a product must contain
+
+# Fields returned by the list endpoints unless `fields=` asks for others.
+# Description (raw HTML) and the unbounded Modifications history are only
+# returned on request or by the /product/<ref> detail endpoint.
+LIST_FIELDS = [
+    'Ref', 'Designation', 'Price', 'Brand', 'Company', 'Category', 'Subcategory',
+    'Stock', 'Url', 'ImageUrl', 'DateAjout', 'LastModified', 'LastPrice', 'LastChangePct'
+]
+PRODUCT_FIELDS = LIST_FIELDS + ['Description', 'Modifications']
+
+SORT_FIELD_MAP = {
+    'price': 'Price',
+    'dateajout': 'DateAjout',
+    'last_modification': 'LastModified',
+    'change_pct': 'LastChangePct'
+}
+
+# Operations a plan can yield
+Count = namedtuple('Count', ['collection', 'filter'])
+Find = namedtuple('Find', ['collection', 'filter', 'projection', 'sort', 'skip', 'limit'],
+                  defaults=[None, None, 0, 0])
+Aggregate = namedtuple('Aggregate', ['collection', 'pipeline'])
+Call = namedtuple('Call', ['func', 'args'], defaults=[()])
+
+
+class ApproximateCount(int):
+    """
+    Count estimated after the exact count exceeded the time budget: the
+    collection's estimated size when unfiltered, a lower bound otherwise
+    """
+
+
+class CappedCount(int):
+    """Count cap reached: the query matches at least this many documents"""
+
+
+class ApiError(Exception):
+    """Client error returned as {'error': message} with the given status"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def list_projection(args):
+    """
+    Build the projection of a list endpoint from the `fields` parameter:
+    - missing: lean default (LIST_FIELDS)
+    - "all": full documents
+    - comma-separated field names, e.g. fields=Ref,Designation,Price
+    """
+    fields_param = args.get('fields', '').strip()
+
+    if not fields_param:
+        fields = LIST_FIELDS
+    elif fields_param == 'all':
+        return None
+    else:
+        fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in PRODUCT_FIELDS]
+        if unknown:
+            raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+
+    # Ref is always returned (it identifies the product, and ranks fuzzy matches)
+    projection = {field: 1 for field in fields}
+    projection['Ref'] = 1
+    return projection
+
+
+def _date_range(date_min, date_max, error_message):
+    """{'$gte': start of date_min, '$lte': end of date_max} from ISO dates (either may be empty)"""
+    date_query = {}
+    try:
+        if date_min:
+            min_date = datetime.fromisoformat(date_min.replace('Z', '+00:00'))
+            date_query['$gte'] = min_date.replace(hour=0, minute=0, second=0, microsecond=0)
+        if date_max:
+            max_date = datetime.fromisoformat(date_max.replace('Z', '+00:00'))
+            date_query['$lte'] = max_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+    except ValueError:
+        raise ApiError(error_message)
+    return date_query
+
+
+def _modification_date_filter(date_min, date_max):
+    """
+    Filter of the products modified between two ISO dates (either may be empty).
+    The indexed LastModified bound selects the candidates; with a max bound, a
+    Modifications entry must also fall in the range, since the latest
+    modification of a product modified within the range may be after it.
+    """
+    date_query = _date_range(date_min, date_max, 'Invalid date format for modification dates')
+    if '$lte' not in date_query:
+        return {'LastModified': date_query}
+    return {
+        'LastModified': {'$gte': date_query['$gte']} if '$gte' in date_query else {'$ne': None},
+        'Modifications': {'$elemMatch': {'dateModification': date_query}},
+    }
+
+
+def _apply_field_filters(query, args):
+    """Brand/Stock/Company/Category/Subcategory regex filters and the price range"""
+    price_min = args.get('price_min', type=float)
+    price_max = args.get('price_max', type=float)
+
+    for param, field in [('brand', 'Brand'), ('stock', 'Stock'), ('company', 'Company'),
+                         ('category', 'Category'), ('subcategory', 'Subcategory')]:
+        value = args.get(param, '')
+        if value:
+            query[field] = regex_filter(value)
+
+    if price_min is not None or price_max is not None:
+        query['Price'] = {}
+        if price_min is not None:
+            query['Price']['$gte'] = price_min
+        if price_max is not None:
+            query['Price']['$lte'] = price_max
+
+
+def _regex_search(search_term):
+    """Ref and Designation use OR logic (search in both fields)"""
+    return [
+        {'Ref': {'$regex': search_term, '$options': 'i'}},
+        {'Designation': {'$regex': search_term, '$options': 'i'}}
+    ]
+
+
+def search_similarities(args):
+    """
+    Plan step of search_mode=fuzzy: rank the Ref/Designation search term
+    through the trigram index. Returns Ref -> similarity, or None when the
+    request does not use fuzzy search.
+    """
+    search_mode = args.get('search_mode', 'regex')
+    if search_mode not in ['regex', 'fuzzy']:
+        raise ApiError('Invalid search_mode, expected regex or fuzzy')
+
+    search_term = args.get('ref', '') or args.get('designation', '')
+    if search_mode != 'fuzzy' or not search_term:
+        return None
+
+    pipeline = TrigramIndex.search_pipeline(
+        search_term,
+        limit=FUZZY_SEARCH_LIMIT,
+        min_similarity=FUZZY_MIN_SIMILARITY
+    )
+    if pipeline is None:
+        return {}
+    matches, = yield [Aggregate(TRIGRAM_COLLECTION, pipeline)]
+    return {match['_id']: match['similarity'] for match in matches}
+
+
+def build_products_query(args, similarities=None):
+    """
+    MongoDB filter of /products (and /export) from query parameters.
+    `similarities` is the result of search_similarities() for fuzzy searches.
+    """
+    query = {}
+
+    # DateAjout and modification date filters (no default date range)
+    dateajout_min = args.get('dateajout_min', '')
+    dateajout_max = args.get('dateajout_max', '')
+    if dateajout_min or dateajout_max:
+        query['DateAjout'] = _date_range(dateajout_min, dateajout_max, 'Invalid date format for dateajout')
+
+    datemodification_min = args.get('datemodification_min', '')
+    datemodification_max = args.get('datemodification_max', '')
+    if datemodification_min or datemodification_max:
+        query.update(_modification_date_filter(datemodification_min, datemodification_max))
+
+    # Text filters (partial matches with case-insensitive regex, or fuzzy matches)
+    search_term = args.get('ref', '') or args.get('designation', '')
+    if similarities is not None:
+        query['Ref'] = {'$in': list(similarities)}
+    elif search_term:
+        query['$or'] = _regex_search(search_term)
+
+    _apply_field_filters(query, args)
+    return query
+
+
+def _pagination(args, default_sort='dateajout'):
+    sort_by = args.get('sort_by', default_sort)
+    order = args.get('order', 'asc')
+    page = args.get('page', 1, type=int)
+    products_per_page = args.get('products_per_page', 10, type=int)
+
+    sort_field = sort_by if sort_by in SORT_FIELD_MAP else 'dateajout'
+    sort_direction = 1 if order == 'asc' else -1
+    skip = (page - 1) * products_per_page
+    return sort_by, [(SORT_FIELD_MAP[sort_field], sort_direction)], page, products_per_page, skip
+
+
+def stock_status_counts(query):
+    """Count operations of the in stock / on order / out of stock split of `query`"""
+    return [
+        Count(PRODUCTS_COLLECTION, {**query, 'Stock': {'$regex': '^in stock$', '$options': 'i'}}),
+        Count(PRODUCTS_COLLECTION, {**query, 'Stock': {'$regex': '^on order$', '$options': 'i'}}),
+        Count(PRODUCTS_COLLECTION, {**query, 'Stock': {'$regex': '^out of stock$', '$options': 'i'}}),
+    ]
+
+
+def count_flags(counts):
+    """
+    Exactness fields of a response for a dict of count name -> result:
+    counts_exact, plus approximate_counts (names) and capped_counts
+    (name -> "10000+") when some counts are not exact.
+    """
+    approximate = [name for name, value in counts.items() if isinstance(value, ApproximateCount)]
+    capped = {name: f"{value}+" for name, value in counts.items() if isinstance(value, CappedCount)}
+    flags = {'counts_exact': not approximate and not capped}
+    if approximate:
+        flags['approximate_counts'] = approximate
+    if capped:
+        flags['capped_counts'] = capped
+    return flags
+
+
+# ==================== /filter ====================
+def filter_plan(args, facet_catalog):
+    """Facet values and counts, answered from the precomputed facet count table"""
+    (filters, facet_counts), = yield [Call(facet_catalog.facets, ({
+        'Brand': args.get('brand', ''),
+        'Stock': args.get('stock', ''),
+        'Category': args.get('category', ''),
+        'Subcategory': args.get('subcategory', ''),
+        'Company': args.get('company', '')
+    },))]
+    return {'filters': filters, 'counts': facet_counts}
+
+
+# ==================== /products ====================
+def products_plan(args):
+    """Filtered, sorted and paginated products with counters (no default date filter)"""
+    search_mode = args.get('search_mode', 'regex')
+    sort_by, sort, page, products_per_page, skip = _pagination(
+        args, 'relevance' if search_mode == 'fuzzy' else 'dateajout')
+    projection = list_projection(args)
+
+    similarities = yield from search_similarities(args)
+    query = build_products_query(args, similarities)
+
+    yesterday = datetime.now() - timedelta(days=1)
+    two_days_ago = datetime.now() - timedelta(days=2)
+    counts = [
+        Count(PRODUCTS_COLLECTION, query),
+        # New products (added in last 24 hours) and modified products (last 2 days) matching the query
+        Count(PRODUCTS_COLLECTION, {**query, 'DateAjout': {'$gte': yesterday}}),
+        Count(PRODUCTS_COLLECTION, {**query, 'LastModified': {'$gte': two_days_ago}}),
+        *stock_status_counts(query),
+    ]
+
+    if similarities is not None and sort_by == 'relevance':
+        # Order the (bounded) fuzzy matches by similarity, then load only the requested page
+        matching, *totals = yield [Find(PRODUCTS_COLLECTION, query, {'Ref': 1}), *counts]
+        matching_refs = sorted((p['Ref'] for p in matching), key=lambda r: similarities[r], reverse=True)
+        page_refs = matching_refs[skip:skip + products_per_page]
+        products, = yield [Find(PRODUCTS_COLLECTION, {'Ref': {'$in': page_refs}}, projection)]
+        products.sort(key=lambda p: similarities[p['Ref']], reverse=True)
+    else:
+        products, *totals = yield [
+            Find(PRODUCTS_COLLECTION, query, projection, sort, skip, products_per_page),
+            *counts
+        ]
+
+    # Expose the fuzzy match score (ObjectId/datetime are handled by the JSON provider)
+    if similarities is not None:
+        for product in products:
+            product['Similarity'] = round(similarities[product['Ref']], 3)
+
+    total_products, total_new_products, total_modified_products, in_stock, on_order, out_of_stock = totals
+    return {
+        'total_products': total_products,
+        'total_new_products': total_new_products,
+        'total_modified_products': total_modified_products,
+        'total_pages': (total_products + products_per_page - 1) // products_per_page,
+        'current_page': page,
+        'products_per_page': products_per_page,
+        'search_mode': search_mode,
+        'stock_status': {
+            'in_stock': in_stock,
+            'on_order': on_order,
+            'out_of_stock': out_of_stock
+        },
+        'products': products,
+        **count_flags({
+            'total_products': total_products,
+            'total_new_products': total_new_products,
+            'total_modified_products': total_modified_products,
+            'stock_status.in_stock': in_stock,
+            'stock_status.on_order': on_order,
+            'stock_status.out_of_stock': out_of_stock,
+        })
+    }
+
+
+def _recent_products_plan(args, query):
+    """Shared part of /products/new and /products/modified once the date filter is set"""
+    _, sort, page, products_per_page, skip = _pagination(args)
+    projection = list_projection(args)
+
+    search_term = args.get('ref', '') or args.get('designation', '')
+    if search_term:
+        query['$or'] = _regex_search(search_term)
+    _apply_field_filters(query, args)
+
+    products, total_products, in_stock, on_order, out_of_stock = yield [
+        Find(PRODUCTS_COLLECTION, query, projection, sort, skip, products_per_page),
+        Count(PRODUCTS_COLLECTION, query),
+        *stock_status_counts(query),
+    ]
+
+    return {
+        'total_products': total_products,
+        'total_pages': (total_products + products_per_page - 1) // products_per_page,
+        'current_page': page,
+        'products_per_page': products_per_page,
+        'stock_status': {
+            'in_stock': in_stock,
+            'on_order': on_order,
+            'out_of_stock': out_of_stock
+        },
+        'products': products,
+        **count_flags({
+            'total_products': total_products,
+            'stock_status.in_stock': in_stock,
+            'stock_status.on_order': on_order,
+            'stock_status.out_of_stock': out_of_stock,
+        })
+    }
+
+
+# ==================== /products/new ====================
+def products_new_plan(args):
+    """Products added within the last day (or since dateajout_min)"""
+    dateajout_min = args.get('dateajout_min', '')
+    if dateajout_min:
+        query = {'DateAjout': _date_range(dateajout_min, '', 'Invalid date format for dateajout_min')}
+    else:
+        # Default: last 24 hours
+        query = {'DateAjout': {'$gte': datetime.now() - timedelta(days=1)}}
+    return (yield from _recent_products_plan(args, query))
+
+
+# ==================== /products/modified ====================
+def products_modified_plan(args):
+    """Products modified within the last two days (or a custom date range)"""
+    modification_date_min = args.get('modification_date_min', '')
+    modification_date_max = args.get('modification_date_max', '')
+    if modification_date_min or modification_date_max:
+        query = _modification_date_filter(modification_date_min, modification_date_max)
+    else:
+        # Default: last 2 days
+        query = {'LastModified': {'$gte': datetime.now() - timedelta(days=2)}}
+    return (yield from _recent_products_plan(args, query))
+
+
+# ==================== /product/<ref> ====================
+def product_detail_plan(ref, args):
+    """Full document of a product with its modification history paginated, newest first"""
+    history_page = max(args.get('history_page', 1, type=int), 1)
+    history_per_page = max(args.get('history_per_page', 20, type=int), 1)
+    history_skip = (history_page - 1) * history_per_page
+
+    # Slice the history server-side so only the requested page is transferred
+    pipeline = [
+        {'$match': {'Ref': ref}},
+        {'$limit': 1},
+        {'$addFields': {'HistoryTotal': {'$size': {'$ifNull': ['$Modifications', []]}}}},
+        {
+            '$addFields': {
+                'Modifications': {
+                    '$slice': [
+                        {'$reverseArray': {'$ifNull': ['$Modifications', []]}},
+                        history_skip,
+                        history_per_page
+                    ]
+                }
+            }
+        }
+    ]
+    result, = yield [Aggregate(PRODUCTS_COLLECTION, pipeline)]
+
+    if not result:
+        raise ApiError(f'Product not found: {ref}', 404)
+
+    product = result[0]
+    history_total = product.pop('HistoryTotal')
+    modifications = product.pop('Modifications')
+
+    return {
+        'product': product,
+        'history': {
+            'total_modifications': history_total,
+            'total_pages': (history_total + history_per_page - 1) // history_per_page,
+            'current_page': history_page,
+            'modifications_per_page': history_per_page,
+            'modifications': modifications
+        }
+    }
+
+
+# ==================== /products/stats ====================
+def products_stats_plan(rollups):
+    """
+    Today's counters and the catalog totals come from the rollups maintained
+    by the pipeline, so they are updated by the same writes during a crawl.
+    """
+    today, catalog = yield [
+        Call(rollups.day_summary, (day_key(datetime.now()),)),
+        Call(rollups.catalog_summary),
+    ]
+    total_stock = catalog['stock']
+
+    return {
+        'total_products': catalog['products'],
+        'total_new_products': today['added'],
+        'total_modified_products': today['modified'],
+        'total_stock_status': {
+            'in_stock': total_stock['in_stock'],
+            'on_order': total_stock['on_order'],
+            'out_of_stock': total_stock['out_of_stock']
+        },
+        'new_products_stock_status': {
+            'in_stock': today['new_stock']['in_stock'],
+            'on_order': today['new_stock']['on_order'],
+            'out_of_stock': today['new_stock']['out_of_stock']
+        },
+        'modified_products_stock_status': {
+            'in_stock': today['modified_stock']['in_stock'],
+            'on_order': today['modified_stock']['on_order'],
+            'out_of_stock': today['modified_stock']['out_of_stock']
+        }
+    }
+
+
+# ==================== /stats ====================
+def stats_plan(args, rollups):
+    """Top modified products, category distribution, or per-day counters of the last 30 days"""
+    stats_type = args.get('type', '')
+
+    # Top 10 products with most modifications
+    if stats_type == 'top_modified_products':
+        pipeline = [
+            {
+                '$project': {
+                    'Ref': 1,
+                    'modifications_count': {'$size': {'$ifNull': ['$Modifications', []]}}
+                }
+            },
+            {'$sort': {'modifications_count': -1}},
+            {'$limit': 10}
+        ]
+        result, = yield [Aggregate(PRODUCTS_COLLECTION, pipeline)]
+
+    # Product distribution by category
+    elif stats_type == 'category_distribution':
+        pipeline = [
+            {
+                '$group': {
+                    '_id': '$Category',
+                    'count': {'$sum': 1}
+                }
+            },
+            {'$sort': {'count': -1}}
+        ]
+        result, = yield [Aggregate(PRODUCTS_COLLECTION, pipeline)]
+
+    # Modified products per day in the last 30 days (summed from the daily rollups)
+    elif stats_type == 'modified_per_day':
+        result, = yield [Call(rollups.daily_totals, ('modifications', 30))]
+
+    # New products added per day in the last 30 days (summed from the daily rollups)
+    elif stats_type == 'added_per_day':
+        result, = yield [Call(rollups.daily_totals, ('added', 30))]
+
+    else:
+        raise ApiError('Invalid stats type')
+
+    return {stats_type: result}
+
+
+# ==================== /export ====================
+def export_plan(args):
+    """
+    Validate an export request. Returns (query, projection, format, columns, compress);
+    the documents themselves are streamed by the server.
+    """
+    export_format = args.get('format', 'ndjson')
+    compress = args.get('compress', '') == 'gzip'
+
+    if export_format not in ['ndjson', 'csv']:
+        raise ApiError('Invalid format, expected ndjson or csv')
+
+    projection = list_projection(args)
+    similarities = yield from search_similarities(args)
+    query = build_products_query(args, similarities)
+
+    columns = ['_id'] + [f for f in (projection or PRODUCT_FIELDS) if f in PRODUCT_FIELDS]
+    return query, projection, export_format, columns, compress
@@ -0,0 +1,95 @@
+"""
+On-demand profiling of single API requests.
+
+A request carrying a valid profiling token, in the X-Profile header or the
+`profile` query parameter, is run under the sampling profiler of
+price_comparator/profiling.py (response cache bypassed) and its folded stacks
+are written to `<directory>/<path>-<time>.folded`; the response names the file
+in its X-Profile-File header. Tokens are signed per path with the server
+secret and expire after an hour:
+
+    python -m price_comparator.profiling "$PROFILING_SECRET" /products
+    curl -H "X-Profile: <token>" "http://localhost:5000/products?brand=HP"
+
+Requests with a missing or invalid token are served normally.
+"""
+
+import logging
+import os
+from urllib.parse import parse_qs
+
+from price_comparator.profiling import DEFAULT_INTERVAL, SamplingProfiler, profile_file_name, verify_profile_token
+
+logger = logging.getLogger(__name__)
+
+# WSGI environ flag read by ResponseCache.cached
+BYPASS_CACHE_ENVIRON_KEY = 'price_comparator.bypass_cache'
+
+
+class RequestProfiler:
+    """WSGI middleware profiling the requests that carry a valid token"""
+
+    def __init__(self, secret, directory, interval=DEFAULT_INTERVAL):
+        self.secret = secret
+        self.directory = directory
+        self.interval = interval
+        self.wsgi_app = None
+
+    def init_flask(self, app):
+        self.wsgi_app = app.wsgi_app
+        app.wsgi_app = self
+
+    @staticmethod
+    def _token(environ):
+        token = environ.get('HTTP_X_PROFILE')
+        if token:
+            return token
+        values = parse_qs(environ.get('QUERY_STRING', '')).get('profile')
+        return values[0] if values else None
+
+    def __call__(self, environ, start_response):
+        token = self._token(environ)
+        path = environ.get('PATH_INFO', '/')
+        if not token:
+            return self.wsgi_app(environ, start_response)
+        if not verify_profile_token(self.secret, path, token):
+            logger.warning(f"Invalid profiling token for {path}")
+            return self.wsgi_app(environ, start_response)
+
+        profiler = SamplingProfiler(self.interval)
+        file_name = profile_file_name(path)
+        label = f"{environ.get('REQUEST_METHOD', 'GET')} {path}"
+        environ[BYPASS_CACHE_ENVIRON_KEY] = True
+
+        def profiled_start_response(status, headers, exc_info=None):
+            headers.append(('X-Profile-File', file_name))
+            return start_response(status, headers, exc_info)
+
+        try:
+            with profiler.capture(label):
+                body = self.wsgi_app(environ, profiled_start_response)
+        except BaseException:
+            profiler.close()
+            raise
+        # Streamed bodies (/export) are produced while the server iterates them
+        return self._profiled_body(profiler, body, label, os.path.join(self.directory, file_name))
+
+    @staticmethod
+    def _profiled_body(profiler, body, label, path):
+        try:
+            chunks = iter(body)
+            while True:
+                with profiler.capture(label):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            profiler.close()
+            try:
+                profiler.write(path)
+                logger.info(f"Wrote profile of {label} ({profiler.samples} samples) to {path}")
+            except OSError as e:
+                logger.error(f"Could not write profile {path}: {e}")
@@ -0,0 +1,173 @@
+"""
+Slow-query log of the API.
+
+Every MongoDB operation of an endpoint plan slower than the threshold (or
+stopped by its time budget) is logged as one JSON line on the `slow_query`
+logger with the endpoint, the query shape (literal values replaced by their
+type, so similar requests group together), the duration and a summary of the
+winning plan from `explain` (e.g. "FETCH <- IXSCAN(Brand_1)" or "COLLSCAN").
+
+Explains use the queryPlanner verbosity (the query is planned, not run
+again), run in a background thread, and are cached per query shape.
+"""
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.plans import Aggregate, Count, Find
+
+logger = logging.getLogger('slow_query')
+
+MAX_PENDING_EXPLAINS = 100
+
+
+def query_shape(value):
+    """Query/pipeline with literal values replaced by their type name"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, (dict, list, tuple)) for item in value):
+            return [query_shape(item) for item in value]
+        return f"<list[{len(value)}]>"
+    return f"<{type(value).__name__}>"
+
+
+def describe_operation(operation):
+    """Operation name, collection and shape of a plan operation"""
+    if isinstance(operation, Count):
+        return {'operation': 'count', 'collection': operation.collection, 'shape': query_shape(operation.filter)}
+    if isinstance(operation, Find):
+        description = {'operation': 'find', 'collection': operation.collection, 'shape': query_shape(operation.filter)}
+        if operation.sort:
+            description['sort'] = dict(operation.sort)
+        if operation.skip:
+            description['skip'] = operation.skip
+        if operation.limit:
+            description['limit'] = operation.limit
+        return description
+    if isinstance(operation, Aggregate):
+        return {'operation': 'aggregate', 'collection': operation.collection,
+                'shape': query_shape(operation.pipeline)}
+    return {'operation': type(operation).__name__.lower()}
+
+
+def explain_command(operation):
+    """The command whose plan `explain` describes, or None for non-query operations"""
+    if isinstance(operation, Count):
+        return {'count': operation.collection, 'query': operation.filter}
+    if isinstance(operation, Find):
+        command = {'find': operation.collection, 'filter': operation.filter}
+        if operation.projection:
+            command['projection'] = operation.projection
+        if operation.sort:
+            command['sort'] = dict(operation.sort)
+        if operation.skip:
+            command['skip'] = operation.skip
+        if operation.limit:
+            command['limit'] = operation.limit
+        return command
+    if isinstance(operation, Aggregate):
+        return {'aggregate': operation.collection, 'pipeline': operation.pipeline, 'cursor': {}}
+    return None
+
+
+def _find_query_planner(explain):
+    """queryPlanner section of an explain result (nested under $cursor for aggregations)"""
+    if isinstance(explain, dict):
+        if 'queryPlanner' in explain:
+            return explain['queryPlanner']
+        for value in explain.values():
+            found = _find_query_planner(value)
+            if found:
+                return found
+    elif isinstance(explain, list):
+        for value in explain:
+            found = _find_query_planner(value)
+            if found:
+                return found
+    return None
+
+
+def plan_summary(explain):
+    """Winning plan stages, outermost first, e.g. "LIMIT <- FETCH <- IXSCAN(Brand_1)" """
+    query_planner = _find_query_planner(explain)
+    if not query_planner:
+        return None
+
+    node = query_planner.get('winningPlan') or {}
+    node = node.get('queryPlan', node)  # Slot-based execution engine layout
+    stages = []
+    while node:
+        label = node.get('stage', '?')
+        if node.get('indexName'):
+            label += f"({node['indexName']})"
+        stages.append(label)
+        node = node.get('inputStage') or (node.get('inputStages') or [None])[0]
+    return ' <- '.join(stages)
+
+
+class SlowQueryLog:
+    """
+    Logs plan operations slower than `threshold_ms`. `db` is a pymongo database
+    used for the explains (explained at most once per shape every `explain_interval` seconds).
+    """
+
+    def __init__(self, db, threshold_ms=500, explain=True, explain_interval=600):
+        self.db = db
+        self.threshold_ms = threshold_ms
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self._plans = {}  # shape key -> (plan summary, explained at)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='slow-query-explain')
+
+    def record(self, endpoint, operation, duration_ms, timed_out=False):
+        if duration_ms < self.threshold_ms and not timed_out:
+            return
+
+        entry = {
+            'endpoint': endpoint,
+            **describe_operation(operation),
+            'duration_ms': round(duration_ms, 1),
+            'timed_out': timed_out,
+        }
+        key = json.dumps(entry.get('shape'), sort_keys=True) + entry.get('collection', '')
+
+        with self._lock:
+            cached = self._plans.get(key)
+            fresh = cached is not None and time.monotonic() - cached[1] < self.explain_interval
+            explain = (self.explain and not fresh and explain_command(operation) is not None
+                       and self._pending < MAX_PENDING_EXPLAINS)
+            if explain:
+                self._pending += 1
+                # Reserve the shape so concurrent slow requests do not explain it again
+                self._plans[key] = (cached[0] if cached else None, time.monotonic())
+
+        if explain:
+            self._explainer.submit(self._explain_and_log, key, operation, entry)
+        else:
+            entry['plan'] = cached[0] if cached else None
+            self._log(entry)
+
+    def _explain_and_log(self, key, operation, entry):
+        try:
+            explain = self.db.command('explain', explain_command(operation), verbosity='queryPlanner')
+            summary = plan_summary(explain)
+            with self._lock:
+                self._plans[key] = (summary, time.monotonic())
+            entry['plan'] = summary
+        except Exception as e:
+            entry['plan'] = None
+            entry['explain_error'] = str(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+        self._log(entry)
+
+    @staticmethod
+    def _log(entry):
+        logger.warning(json.dumps(entry, default=str, sort_keys=True))
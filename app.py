@@ -1,26 +1,116 @@
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, jsonify, make_response, Response
 from pymongo import MongoClient
-from datetime import datetime, timedelta
 import logging
+import os
 import traceback
 
+from api import plans
+from api.cache import ResponseCache
+from api.counts import CountStrategy
+from api.executors import SyncExecutor
+from api.export import EXPORT_BATCH_SIZE, ExportEncoder, content_type_and_filename
+from api.http import HTTPOptimizations
+from api.metrics import ApiMetrics
+from api.plans import ApiError
+from api.profiling import RequestProfiler
+from api.querylog import SlowQueryLog
+from api.serialization import FastJSONProvider
+from price_comparator.dataversion import DataVersion
+from price_comparator.facets import FacetCatalog
+from price_comparator.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from price_comparator.rollups import RollupStore
+
 # Initialize Flask app
 app = Flask(__name__)
 
+# Fast JSON serialization (orjson when installed, ObjectId/datetime handled natively)
+app.json = FastJSONProvider(app)
+
 # MongoDB Configuration
 # TODO: Update with your MongoDB connection string
 MONGO_URI = "mongodb://localhost:27017/"
-DATABASE_NAME = "product_comparator"
+DATABASE_NAME = os.environ.get("PRICE_COMPARATOR_DB", "product_comparator")  # Overridden by benchmarks
 
-# Configure MongoDB client with 5-minute timeout
+# Configure MongoDB client. Queries are bounded by the per-endpoint budgets below;
+# the socket timeout is only a safety net above the largest budget.
 client = MongoClient(
     MONGO_URI,
-    serverSelectionTimeoutMS=300000,  # 5 minutes
-    socketTimeoutMS=300000  # 5 minutes
+    serverSelectionTimeoutMS=5000,  # 5 seconds
+    connectTimeoutMS=5000,  # 5 seconds
+    socketTimeoutMS=60000  # 1 minute
 )
 db = client[DATABASE_NAME]
 products_collection = db['products']
 
+# Time budget (maxTimeMS, shared by the queries of a request) per endpoint.
+# Counts exceeding it are estimated (the response says counts_exact: false),
+# other queries exceeding it answer 503 instead of pinning a worker.
+QUERY_BUDGETS_MS = {
+    '/filter': 2000,
+    '/products': 5000,
+    '/products/new': 3000,
+    '/products/modified': 3000,
+    '/product': 2000,
+    '/products/stats': 2000,
+    '/stats': 10000,
+    '/export': 5000,  # Validation and fuzzy ranking only, the stream itself is not bounded
+}
+
+# Queries slower than this are logged (logger "slow_query") with their shape and explain plan
+SLOW_QUERY_MS = 500
+slow_query_log = SlowQueryLog(db, threshold_ms=SLOW_QUERY_MS)
+
+# Response cache, invalidated by the data version the pipeline bumps after each crawl
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 300  # Upper bound for time-relative results (new today, last 24h...)
+CACHE_REDIS_URL = None  # e.g. "redis://localhost:6379/0" to share the cache between workers
+data_version = DataVersion(db)
+response_cache = ResponseCache(
+    data_version,
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL_SECONDS,
+    shared_url=CACHE_REDIS_URL
+)
+
+# Counts: metadata count when unfiltered, capped at COUNT_CAP ("10000+") and
+# cached per query and data version otherwise
+COUNT_CAP = 10000
+count_strategy = CountStrategy(data_version, cap=COUNT_CAP, ttl=CACHE_TTL_SECONDS)
+
+# Prometheus metrics (/metrics): request, MongoDB and cache metrics of this process.
+# Registered before the HTTP optimizations so response sizes are measured compressed.
+metrics = ApiMetrics(caches={'response': response_cache, 'count': count_strategy})
+metrics.init_flask(app)
+
+# Endpoint logic lives in api/plans.py (shared with the async server, asgi_app.py)
+executor = SyncExecutor(db, budgets=QUERY_BUDGETS_MS, slow_query_log=slow_query_log,
+                        count_strategy=count_strategy, metrics=metrics)
+
+# Facet count table precomputed by the pipeline after each crawl
+facet_catalog = FacetCatalog(db, data_version)
+
+# Per-day, per-Company counters maintained by the pipeline
+rollups = RollupStore(db)
+
+# Strong ETags (data version based, checked before hitting MongoDB) and brotli/gzip compression
+COMPRESSION_MIN_SIZE = 1024  # Bytes; smaller responses are sent uncompressed
+http_optimizations = HTTPOptimizations(
+    app,
+    data_version,
+    etag_endpoints=['filter_endpoint', 'products', 'products_new', 'products_modified',
+                    'product_detail', 'products_stats', 'stats'],
+    bucket_seconds=CACHE_TTL_SECONDS,
+    min_size=COMPRESSION_MIN_SIZE
+)
+
+# On-demand profiling: requests carrying a token signed with PROFILING_SECRET
+# (python -m price_comparator.profiling SECRET /path) are sampled and their
+# flamegraph-compatible profile written to PROFILE_DIR. Disabled without a secret.
+PROFILING_SECRET = os.environ.get('PROFILING_SECRET')
+PROFILE_DIR = 'profiles'
+if PROFILING_SECRET:
+    RequestProfiler(PROFILING_SECRET, PROFILE_DIR).init_flask(app)
+
 # Logging Configuration
 logging.basicConfig(
     level=logging.INFO,
@@ -30,76 +120,35 @@ connection_logger = logging.getLogger('connection')
 error_logger = logging.getLogger('error')
 
 
+def json_response(response_data):
+    response = make_response(jsonify(response_data), 200)
+    response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    if 'approximate_counts' in response_data:
+        # Degraded response (counts estimated after a timeout): neither cached nor given an ETag
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 # ==================== /filter Endpoint ====================
 @app.route('/filter', methods=['GET'])
+@response_cache.cached
 def filter_endpoint():
     """
     Retrieves filter data based on search parameters for product information
-    such as brand, stock, category, and subcategory.
+    such as brand, stock, category, subcategory and company, with product counts.
     """
     try:
         # Log incoming request
         connection_logger.info(f"Accessed /filter endpoint with params: {request.args}")
 
-        # Extract query parameters
-        brand_search = request.args.get('brand', '')
-        stock_search = request.args.get('stock', '')
-        category_search = request.args.get('category', '')
-        subcategory_search = request.args.get('subcategory', '')
-
-        # Build match stage for aggregation pipeline
-        match_stage = {}
-
-        if brand_search:
-            match_stage['Brand'] = {'$regex': brand_search, '$options': 'i'}
-        if stock_search:
-            match_stage['Stock'] = {'$regex': stock_search, '$options': 'i'}
-        if category_search:
-            match_stage['Category'] = {'$regex': category_search, '$options': 'i'}
-        if subcategory_search:
-            match_stage['Subcategory'] = {'$regex': subcategory_search, '$options': 'i'}
-
-        # Build aggregation pipeline
-        pipeline = []
-
-        if match_stage:
-            pipeline.append({'$match': match_stage})
-
-        pipeline.append({
-            '$group': {
-                '_id': None,
-                'brands': {'$addToSet': '$Brand'},
-                'stocks': {'$addToSet': '$Stock'},
-                'categories': {'$addToSet': '$Category'},
-                'subcategories': {'$addToSet': '$Subcategory'}
-            }
-        })
-
-        # Execute aggregation
-        result = list(products_collection.aggregate(pipeline))
-
-        # Format response
-        if result:
-            filters = {
-                'brands': sorted([b for b in result[0].get('brands', []) if b]),
-                'stocks': sorted([s for s in result[0].get('stocks', []) if s]),
-                'categories': sorted([c for c in result[0].get('categories', []) if c]),
-                'subcategories': sorted([sc for sc in result[0].get('subcategories', []) if sc])
-            }
-        else:
-            filters = {
-                'brands': [],
-                'stocks': [],
-                'categories': [],
-                'subcategories': []
-            }
+        # Answered from the precomputed facet count table instead of aggregating products
+        response_data = executor.run(plans.filter_plan(request.args, facet_catalog), '/filter')
 
         connection_logger.info("Successfully retrieved filter data")
+        return json_response(response_data)
 
-        response = make_response(jsonify({'filters': filters}), 200)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
-
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_logger.error(f"Error in /filter endpoint: {str(e)}")
         error_logger.error(traceback.format_exc())
@@ -108,6 +157,7 @@ def filter_endpoint():
 
 # ==================== /products Endpoint ====================
 @app.route('/products', methods=['GET'])
+@response_cache.cached
 def products():
     """
     Retrieves a list of products from the database with filtering, sorting, and pagination options.
@@ -116,166 +166,13 @@ def products():
     try:
         connection_logger.info(f"Accessed /products endpoint with params: {request.args}")
 
-        # Extract query parameters
-        ref = request.args.get('ref', '')
-        designation = request.args.get('designation', '')
-        price_min = request.args.get('price_min', type=float)
-        price_max = request.args.get('price_max', type=float)
-        brand = request.args.get('brand', '')
-        stock = request.args.get('stock', '')
-        company = request.args.get('company', '')
-        category = request.args.get('category', '')
-        subcategory = request.args.get('subcategory', '')
-        dateajout_min = request.args.get('dateajout_min', '')
-        dateajout_max = request.args.get('dateajout_max', '')
-        datemodification_min = request.args.get('datemodification_min', '')
-        datemodification_max = request.args.get('datemodification_max', '')
-        sort_by = request.args.get('sort_by', 'dateajout')
-        order = request.args.get('order', 'asc')
-        page = request.args.get('page', 1, type=int)
-        products_per_page = request.args.get('products_per_page', 10, type=int)
-
-        # Build query filter
-        query = {}
-
-        # DateAjout filter (no default date range)
-        if dateajout_min or dateajout_max:
-            date_query = {}
-            try:
-                if dateajout_min:
-                    min_date = datetime.fromisoformat(dateajout_min.replace('Z', '+00:00'))
-                    min_date = min_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                    date_query['$gte'] = min_date
-                if dateajout_max:
-                    max_date = datetime.fromisoformat(dateajout_max.replace('Z', '+00:00'))
-                    max_date = max_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                    date_query['$lte'] = max_date
-                query['DateAjout'] = date_query
-            except ValueError:
-                return jsonify({'error': 'Invalid date format for dateajout'}), 400
-
-        # Modification date filter (no default date range)
-        if datemodification_min or datemodification_max:
-            modification_query = {}
-            try:
-                if datemodification_min:
-                    min_date = datetime.fromisoformat(datemodification_min.replace('Z', '+00:00'))
-                    min_date = min_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                    modification_query['$gte'] = min_date
-                if datemodification_max:
-                    max_date = datetime.fromisoformat(datemodification_max.replace('Z', '+00:00'))
-                    max_date = max_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                    modification_query['$lte'] = max_date
-                query['Modifications.dateModification'] = modification_query
-            except ValueError:
-                return jsonify({'error': 'Invalid date format for modification dates'}), 400
-
-        # Text filters (partial matches with case-insensitive regex)
-        # Ref and Designation use OR logic (search in both fields)
-        if ref or designation:
-            search_term = ref or designation
-            query['$or'] = [
-                {'Ref': {'$regex': search_term, '$options': 'i'}},
-                {'Designation': {'$regex': search_term, '$options': 'i'}}
-            ]
-        if brand:
-            query['Brand'] = {'$regex': brand, '$options': 'i'}
-        if stock:
-            query['Stock'] = {'$regex': stock, '$options': 'i'}
-        if company:
-            query['Company'] = {'$regex': company, '$options': 'i'}
-        if category:
-            query['Category'] = {'$regex': category, '$options': 'i'}
-        if subcategory:
-            query['Subcategory'] = {'$regex': subcategory, '$options': 'i'}
-
-        # Price filters
-        if price_min is not None or price_max is not None:
-            query['Price'] = {}
-            if price_min is not None:
-                query['Price']['$gte'] = price_min
-            if price_max is not None:
-                query['Price']['$lte'] = price_max
-
-        # Sorting
-        sort_field = sort_by if sort_by in ['price', 'dateajout', 'last_modification'] else 'dateajout'
-        sort_field_map = {
-            'price': 'Price',
-            'dateajout': 'DateAjout',
-            'last_modification': 'Modifications.dateModification'
-        }
-        sort_direction = 1 if order == 'asc' else -1
-
-        # Calculate pagination
-        skip = (page - 1) * products_per_page
-
-        # Get total count
-        total_products = products_collection.count_documents(query)
-        total_pages = (total_products + products_per_page - 1) // products_per_page
-
-        # Fetch products
-        products = list(
-            products_collection.find(query)
-            .sort(sort_field_map[sort_field], sort_direction)
-            .skip(skip)
-            .limit(products_per_page)
-        )
+        response_data = executor.run(plans.products_plan(request.args), '/products')
 
-        # Convert ObjectId to string
-        for product in products:
-            product['_id'] = str(product['_id'])
-
-        # Get additional statistics based on current query
-        yesterday = datetime.now() - timedelta(days=1)
-        two_days_ago = datetime.now() - timedelta(days=2)
-
-        # Count new products (added in last 24 hours) that match the query
-        total_new_products = products_collection.count_documents({
-            **query,
-            'DateAjout': {'$gte': yesterday}
-        })
-
-        # Count modified products (modified in last 2 days) that match the query
-        total_modified_products = products_collection.count_documents({
-            **query,
-            'Modifications.dateModification': {'$gte': two_days_ago}
-        })
-
-        # Get stock status counts based on current query
-        total_in_stock = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^in stock$', '$options': 'i'}
-        })
-        total_on_order = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^on order$', '$options': 'i'}
-        })
-        total_out_of_stock = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^out of stock$', '$options': 'i'}
-        })
-
-        response_data = {
-            'total_products': total_products,
-            'total_new_products': total_new_products,
-            'total_modified_products': total_modified_products,
-            'total_pages': total_pages,
-            'current_page': page,
-            'products_per_page': products_per_page,
-            'stock_status': {
-                'in_stock': total_in_stock,
-                'on_order': total_on_order,
-                'out_of_stock': total_out_of_stock
-            },
-            'products': products
-        }
-
-        connection_logger.info(f"Successfully retrieved {len(products)} products")
-
-        response = make_response(jsonify(response_data), 200)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
+        connection_logger.info(f"Successfully retrieved {len(response_data['products'])} products")
+        return json_response(response_data)
 
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_logger.error(f"Error in /products endpoint: {str(e)}")
         error_logger.error(traceback.format_exc())
@@ -284,6 +181,7 @@ def products():
 
 # ==================== /products/new Endpoint ====================
 @app.route('/products/new', methods=['GET'])
+@response_cache.cached
 def products_new():
     """
     Retrieves a list of newly added products within the last day (or a custom date range).
@@ -291,126 +189,13 @@ def products_new():
     try:
         connection_logger.info(f"Accessed /products/new endpoint with params: {request.args}")
 
-        # Extract query parameters
-        ref = request.args.get('ref', '')
-        designation = request.args.get('designation', '')
-        price_min = request.args.get('price_min', type=float)
-        price_max = request.args.get('price_max', type=float)
-        brand = request.args.get('brand', '')
-        stock = request.args.get('stock', '')
-        company = request.args.get('company', '')
-        category = request.args.get('category', '')
-        subcategory = request.args.get('subcategory', '')
-        dateajout_min = request.args.get('dateajout_min', '')
-        sort_by = request.args.get('sort_by', 'dateajout')
-        order = request.args.get('order', 'asc')
-        page = request.args.get('page', 1, type=int)
-        products_per_page = request.args.get('products_per_page', 10, type=int)
-
-        # Build query filter
-        query = {}
-
-        # Date filter - default to last day if not specified
-        if dateajout_min:
-            try:
-                min_date = datetime.fromisoformat(dateajout_min.replace('Z', '+00:00'))
-                min_date = min_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                query['DateAjout'] = {'$gte': min_date}
-            except ValueError:
-                return jsonify({'error': 'Invalid date format for dateajout_min'}), 400
-        else:
-            # Default: last 24 hours
-            yesterday = datetime.now() - timedelta(days=1)
-            query['DateAjout'] = {'$gte': yesterday}
-
-        # Text filters
-        # Ref and Designation use OR logic (search in both fields)
-        if ref or designation:
-            search_term = ref or designation
-            query['$or'] = [
-                {'Ref': {'$regex': search_term, '$options': 'i'}},
-                {'Designation': {'$regex': search_term, '$options': 'i'}}
-            ]
-        if brand:
-            query['Brand'] = {'$regex': brand, '$options': 'i'}
-        if stock:
-            query['Stock'] = {'$regex': stock, '$options': 'i'}
-        if company:
-            query['Company'] = {'$regex': company, '$options': 'i'}
-        if category:
-            query['Category'] = {'$regex': category, '$options': 'i'}
-        if subcategory:
-            query['Subcategory'] = {'$regex': subcategory, '$options': 'i'}
-
-        # Price filters
-        if price_min is not None or price_max is not None:
-            query['Price'] = {}
-            if price_min is not None:
-                query['Price']['$gte'] = price_min
-            if price_max is not None:
-                query['Price']['$lte'] = price_max
-
-        # Sorting
-        sort_field = sort_by if sort_by in ['price', 'dateajout', 'last_modification'] else 'dateajout'
-        sort_field_map = {
-            'price': 'Price',
-            'dateajout': 'DateAjout',
-            'last_modification': 'Modifications.dateModification'
-        }
-        sort_direction = 1 if order == 'asc' else -1
-
-        # Calculate pagination
-        skip = (page - 1) * products_per_page
-
-        # Get total count
-        total_products = products_collection.count_documents(query)
-        total_pages = (total_products + products_per_page - 1) // products_per_page
-
-        # Fetch products
-        products = list(
-            products_collection.find(query)
-            .sort(sort_field_map[sort_field], sort_direction)
-            .skip(skip)
-            .limit(products_per_page)
-        )
+        response_data = executor.run(plans.products_new_plan(request.args), '/products/new')
 
-        # Convert ObjectId to string
-        for product in products:
-            product['_id'] = str(product['_id'])
-
-        # Get stock status counts for new products
-        in_stock_count = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^in stock$', '$options': 'i'}
-        })
-        on_order_count = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^on order$', '$options': 'i'}
-        })
-        out_of_stock_count = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^out of stock$', '$options': 'i'}
-        })
-
-        response_data = {
-            'total_products': total_products,
-            'total_pages': total_pages,
-            'current_page': page,
-            'products_per_page': products_per_page,
-            'stock_status': {
-                'in_stock': in_stock_count,
-                'on_order': on_order_count,
-                'out_of_stock': out_of_stock_count
-            },
-            'products': products
-        }
-
-        connection_logger.info(f"Successfully retrieved {len(products)} new products")
-
-        response = make_response(jsonify(response_data), 200)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
+        connection_logger.info(f"Successfully retrieved {len(response_data['products'])} new products")
+        return json_response(response_data)
 
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_logger.error(f"Error in /products/new endpoint: {str(e)}")
         error_logger.error(traceback.format_exc())
@@ -419,6 +204,7 @@ def products_new():
 
 # ==================== /products/modified Endpoint ====================
 @app.route('/products/modified', methods=['GET'])
+@response_cache.cached
 def products_modified():
     """
     Retrieves a list of products modified within the last two days (or a custom date range).
@@ -427,142 +213,46 @@ def products_modified():
     try:
         connection_logger.info(f"Accessed /products/modified endpoint with params: {request.args}")
 
-        # Extract query parameters
-        ref = request.args.get('ref', '')
-        designation = request.args.get('designation', '')
-        price_min = request.args.get('price_min', type=float)
-        price_max = request.args.get('price_max', type=float)
-        brand = request.args.get('brand', '')
-        stock = request.args.get('stock', '')
-        company = request.args.get('company', '')
-        category = request.args.get('category', '')
-        subcategory = request.args.get('subcategory', '')
-        modification_date_min = request.args.get('modification_date_min', '')
-        modification_date_max = request.args.get('modification_date_max', '')
-        sort_by = request.args.get('sort_by', 'dateajout')
-        order = request.args.get('order', 'asc')
-        page = request.args.get('page', 1, type=int)
-        products_per_page = request.args.get('products_per_page', 10, type=int)
-
-        # Build query filter
-        query = {}
-
-        # Modification date filter - default to last 2 days if not specified
-        modification_query = {}
-        if modification_date_min or modification_date_max:
-            try:
-                if modification_date_min:
-                    min_date = datetime.fromisoformat(modification_date_min.replace('Z', '+00:00'))
-                    min_date = min_date.replace(hour=0, minute=0, second=0, microsecond=0)
-                    modification_query['$gte'] = min_date
-                if modification_date_max:
-                    max_date = datetime.fromisoformat(modification_date_max.replace('Z', '+00:00'))
-                    max_date = max_date.replace(hour=23, minute=59, second=59, microsecond=999999)
-                    modification_query['$lte'] = max_date
-                query['Modifications.dateModification'] = modification_query
-            except ValueError:
-                return jsonify({'error': 'Invalid date format for modification dates'}), 400
-        else:
-            # Default: last 2 days
-            two_days_ago = datetime.now() - timedelta(days=2)
-            query['Modifications.dateModification'] = {'$gte': two_days_ago}
-
-        # Text filters
-        # Ref and Designation use OR logic (search in both fields)
-        if ref or designation:
-            search_term = ref or designation
-            query['$or'] = [
-                {'Ref': {'$regex': search_term, '$options': 'i'}},
-                {'Designation': {'$regex': search_term, '$options': 'i'}}
-            ]
-        if brand:
-            query['Brand'] = {'$regex': brand, '$options': 'i'}
-        if stock:
-            query['Stock'] = {'$regex': stock, '$options': 'i'}
-        if company:
-            query['Company'] = {'$regex': company, '$options': 'i'}
-        if category:
-            query['Category'] = {'$regex': category, '$options': 'i'}
-        if subcategory:
-            query['Subcategory'] = {'$regex': subcategory, '$options': 'i'}
-
-        # Price filters
-        if price_min is not None or price_max is not None:
-            query['Price'] = {}
-            if price_min is not None:
-                query['Price']['$gte'] = price_min
-            if price_max is not None:
-                query['Price']['$lte'] = price_max
-
-        # Sorting
-        sort_field = sort_by if sort_by in ['price', 'dateajout', 'last_modification'] else 'dateajout'
-        sort_field_map = {
-            'price': 'Price',
-            'dateajout': 'DateAjout',
-            'last_modification': 'Modifications.dateModification'
-        }
-        sort_direction = 1 if order == 'asc' else -1
-
-        # Calculate pagination
-        skip = (page - 1) * products_per_page
-
-        # Get total count
-        total_products = products_collection.count_documents(query)
-        total_pages = (total_products + products_per_page - 1) // products_per_page
-
-        # Fetch products
-        products = list(
-            products_collection.find(query)
-            .sort(sort_field_map[sort_field], sort_direction)
-            .skip(skip)
-            .limit(products_per_page)
-        )
+        response_data = executor.run(plans.products_modified_plan(request.args), '/products/modified')
 
-        # Convert ObjectId to string
-        for product in products:
-            product['_id'] = str(product['_id'])
-
-        # Get stock status counts for modified products
-        in_stock_count = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^in stock$', '$options': 'i'}
-        })
-        on_order_count = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^on order$', '$options': 'i'}
-        })
-        out_of_stock_count = products_collection.count_documents({
-            **query,
-            'Stock': {'$regex': '^out of stock$', '$options': 'i'}
-        })
-
-        response_data = {
-            'total_products': total_products,
-            'total_pages': total_pages,
-            'current_page': page,
-            'products_per_page': products_per_page,
-            'stock_status': {
-                'in_stock': in_stock_count,
-                'on_order': on_order_count,
-                'out_of_stock': out_of_stock_count
-            },
-            'products': products
-        }
-
-        connection_logger.info(f"Successfully retrieved {len(products)} modified products")
-
-        response = make_response(jsonify(response_data), 200)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
+        connection_logger.info(f"Successfully retrieved {len(response_data['products'])} modified products")
+        return json_response(response_data)
 
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_logger.error(f"Error in /products/modified endpoint: {str(e)}")
         error_logger.error(traceback.format_exc())
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 
+# ==================== /product/<ref> Endpoint ====================
+@app.route('/product/<path:ref>', methods=['GET'])
+@response_cache.cached
+def product_detail(ref):
+    """
+    Returns the full document of a single product (including Description)
+    with its modification history paginated, newest first.
+    """
+    try:
+        connection_logger.info(f"Accessed /product endpoint for ref {ref} with params: {request.args}")
+
+        response_data = executor.run(plans.product_detail_plan(ref, request.args), '/product')
+
+        connection_logger.info(f"Successfully retrieved product {ref}")
+        return json_response(response_data)
+
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        error_logger.error(f"Error in /product endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+
 # ==================== /products/stats Endpoint ====================
 @app.route('/products/stats', methods=['GET'])
+@response_cache.cached
 def products_stats():
     """
     Returns summary statistics about products:
@@ -577,101 +267,13 @@ def products_stats():
     try:
         connection_logger.info(f"Accessed /products/stats endpoint")
 
-        # Get total products count
-        total_products = products_collection.count_documents({})
-
-        # Get new products count (today - from midnight 00:00:00)
-        # This matches the behavior when filtering by today's date
-        today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-
-        # Count only products with valid DateAjout field (not null, not missing)
-        total_new_products = products_collection.count_documents({
-            'DateAjout': {'$type': 'date', '$gte': today_start}
-        })
-
-        # Get modified products count (today - from midnight 00:00:00)
-        # Use aggregation to properly count products with modifications today
-        pipeline = [
-            {'$match': {'Modifications': {'$exists': True, '$ne': []}}},
-            {'$unwind': '$Modifications'},
-            {'$match': {'Modifications.dateModification': {'$gte': today_start}}},
-            {'$group': {'_id': '$_id'}},
-            {'$count': 'total'}
-        ]
-
-        modified_result = list(products_collection.aggregate(pipeline))
-        total_modified_products = modified_result[0]['total'] if modified_result else 0
-
-        # Get stock status counts for all products
-        total_in_stock = products_collection.count_documents({
-            'Stock': {'$regex': '^in stock$', '$options': 'i'}
-        })
-        total_on_order = products_collection.count_documents({
-            'Stock': {'$regex': '^on order$', '$options': 'i'}
-        })
-        total_out_of_stock = products_collection.count_documents({
-            'Stock': {'$regex': '^out of stock$', '$options': 'i'}
-        })
-
-        # Get stock status counts for new products (today from midnight)
-        new_in_stock = products_collection.count_documents({
-            'DateAjout': {'$type': 'date', '$gte': today_start},
-            'Stock': {'$regex': '^in stock$', '$options': 'i'}
-        })
-        new_on_order = products_collection.count_documents({
-            'DateAjout': {'$type': 'date', '$gte': today_start},
-            'Stock': {'$regex': '^on order$', '$options': 'i'}
-        })
-        new_out_of_stock = products_collection.count_documents({
-            'DateAjout': {'$type': 'date', '$gte': today_start},
-            'Stock': {'$regex': '^out of stock$', '$options': 'i'}
-        })
-
-        # Get stock status counts for modified products (today from midnight)
-        # Use aggregation for accurate counting
-        def count_modified_by_stock(stock_regex):
-            pipeline = [
-                {'$match': {'Modifications': {'$exists': True, '$ne': []}}},
-                {'$unwind': '$Modifications'},
-                {'$match': {'Modifications.dateModification': {'$gte': today_start}}},
-                {'$group': {'_id': '$_id', 'Stock': {'$first': '$Stock'}}},
-                {'$match': {'Stock': {'$regex': stock_regex, '$options': 'i'}}},
-                {'$count': 'total'}
-            ]
-            result = list(products_collection.aggregate(pipeline))
-            return result[0]['total'] if result else 0
-
-        modified_in_stock = count_modified_by_stock('^in stock$')
-        modified_on_order = count_modified_by_stock('^on order$')
-        modified_out_of_stock = count_modified_by_stock('^out of stock$')
-
-        response_data = {
-            'total_products': total_products,
-            'total_new_products': total_new_products,
-            'total_modified_products': total_modified_products,
-            'total_stock_status': {
-                'in_stock': total_in_stock,
-                'on_order': total_on_order,
-                'out_of_stock': total_out_of_stock
-            },
-            'new_products_stock_status': {
-                'in_stock': new_in_stock,
-                'on_order': new_on_order,
-                'out_of_stock': new_out_of_stock
-            },
-            'modified_products_stock_status': {
-                'in_stock': modified_in_stock,
-                'on_order': modified_on_order,
-                'out_of_stock': modified_out_of_stock
-            }
-        }
+        response_data = executor.run(plans.products_stats_plan(rollups), '/products/stats')
 
         connection_logger.info(f"Successfully retrieved product stats")
+        return json_response(response_data)
 
-        response = make_response(jsonify(response_data), 200)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
-
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_logger.error(f"Error in /products/stats endpoint: {str(e)}")
         error_logger.error(traceback.format_exc())
@@ -680,6 +282,7 @@ def products_stats():
 
 # ==================== /stats Endpoint ====================
 @app.route('/stats', methods=['GET'])
+@response_cache.cached
 def stats():
     """
     Provides statistical data about products, including:
@@ -691,117 +294,109 @@ def stats():
     try:
         connection_logger.info(f"Accessed /stats endpoint with params: {request.args}")
 
-        stats_type = request.args.get('type', '')
-
-        if not stats_type:
-            return jsonify({'error': 'Invalid stats type'}), 400
-
-        # Top 10 products with most modifications
-        if stats_type == 'top_modified_products':
-            pipeline = [
-                {
-                    '$project': {
-                        'Ref': 1,
-                        'modifications_count': {'$size': {'$ifNull': ['$Modifications', []]}}
-                    }
-                },
-                {'$sort': {'modifications_count': -1}},
-                {'$limit': 10}
-            ]
-
-            result = list(products_collection.aggregate(pipeline))
-
-            # Convert ObjectId to string
-            for item in result:
-                item['_id'] = str(item['_id'])
-
-            response_data = {'top_modified_products': result}
-
-        # Product distribution by category
-        elif stats_type == 'category_distribution':
-            pipeline = [
-                {
-                    '$group': {
-                        '_id': '$Category',
-                        'count': {'$sum': 1}
-                    }
-                },
-                {'$sort': {'count': -1}}
-            ]
-
-            result = list(products_collection.aggregate(pipeline))
-            response_data = {'category_distribution': result}
-
-        # Modified products per day in the last 30 days
-        elif stats_type == 'modified_per_day':
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-
-            pipeline = [
-                {'$unwind': '$Modifications'},
-                {
-                    '$match': {
-                        'Modifications.dateModification': {'$gte': thirty_days_ago}
-                    }
-                },
-                {
-                    '$group': {
-                        '_id': {
-                            '$dateToString': {
-                                'format': '%Y-%m-%d',
-                                'date': '$Modifications.dateModification'
-                            }
-                        },
-                        'count': {'$sum': 1}
-                    }
-                },
-                {'$sort': {'_id': 1}}
-            ]
-
-            result = list(products_collection.aggregate(pipeline))
-            response_data = {'modified_per_day': result}
-
-        # New products added per day in the last 30 days
-        elif stats_type == 'added_per_day':
-            thirty_days_ago = datetime.now() - timedelta(days=30)
-
-            pipeline = [
-                {
-                    '$match': {
-                        'DateAjout': {'$gte': thirty_days_ago}
-                    }
-                },
-                {
-                    '$group': {
-                        '_id': {
-                            '$dateToString': {
-                                'format': '%Y-%m-%d',
-                                'date': '$DateAjout'
-                            }
-                        },
-                        'count': {'$sum': 1}
-                    }
-                },
-                {'$sort': {'_id': 1}}
-            ]
-
-            result = list(products_collection.aggregate(pipeline))
-            response_data = {'added_per_day': result}
-
-        else:
-            return jsonify({'error': 'Invalid stats type'}), 400
-
-        connection_logger.info(f"Successfully retrieved stats for type: {stats_type}")
-
-        response = make_response(jsonify(response_data), 200)
-        response.headers['Content-Type'] = 'application/json; charset=utf-8'
-        return response
+        response_data = executor.run(plans.stats_plan(request.args, rollups), '/stats')
 
+        connection_logger.info(f"Successfully retrieved stats for type: {request.args.get('type', '')}")
+        return json_response(response_data)
+
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         error_logger.error(f"Error in /stats endpoint: {str(e)}")
         error_logger.error(traceback.format_exc())
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
 
+# ==================== /export Endpoint ====================
+def _export_stream(query, projection, export_format, columns, compress):
+    """
+    Stream the export in chunks, optionally gzip-compressed on the fly. The cursor
+    is consumed batch by batch, so memory use does not depend on the number of
+    exported products.
+    """
+    cursor = products_collection.find(query, projection).batch_size(EXPORT_BATCH_SIZE)
+    encoder = ExportEncoder(export_format, columns, compress)
+
+    try:
+        for product in cursor:
+            chunk = encoder.add(product)
+            if chunk:
+                yield chunk
+        yield encoder.finish()
+
+        connection_logger.info(f"Successfully exported {encoder.exported} products")
+
+    except Exception as e:
+        # Headers are already sent: log the failure, the client sees a truncated stream
+        error_logger.error(f"Error while streaming /export after {encoder.exported} products: {str(e)}")
+        error_logger.error(traceback.format_exc())
+
+    finally:
+        cursor.close()
+
+
+@app.route('/export', methods=['GET'])
+def export_products():
+    """
+    Streams every product matching the /products filters as NDJSON (default) or CSV.
+    Parameters: format=ndjson|csv, compress=gzip, fields= (same as list endpoints).
+    """
+    try:
+        connection_logger.info(f"Accessed /export endpoint with params: {request.args}")
+
+        query, projection, export_format, columns, compress = executor.run(
+            plans.export_plan(request.args), '/export')
+        content_type, filename = content_type_and_filename(export_format, compress)
+
+        response = Response(
+            _export_stream(query, projection, export_format, columns, compress),
+            status=200,
+            content_type=content_type
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+    except ApiError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        error_logger.error(f"Error in /export endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+
+# ==================== /cache/stats Endpoint ====================
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    Reports response cache usage (hits, misses, hit ratio, entries, current data version)
+    and count cache usage.
+    """
+    try:
+        stats_data = response_cache.stats()
+        connection_logger.info(f"Response cache hit ratio: {stats_data['hit_ratio']}")
+        return jsonify({'cache': stats_data, 'counts': count_strategy.stats()}), 200
+
+    except Exception as e:
+        error_logger.error(f"Error in /cache/stats endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+
+# ==================== /metrics Endpoint ====================
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus metrics of this API process (text exposition format).
+    """
+    try:
+        return Response(metrics.render(), status=200, content_type=METRICS_CONTENT_TYPE)
+
+    except Exception as e:
+        error_logger.error(f"Error in /metrics endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return jsonify({'error': f'An error occurred: {str(e)}'}), 500
+
+
 # ==================== Run Application ====================
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,393 @@
+"""
+Asynchronous serving mode of the API (ASGI, Quart + Motor).
+
+Same routes, parameters and response formats as app.py (the endpoint logic is
+shared through api/plans.py), but each worker process serves many requests
+concurrently on an event loop, and the independent queries of a request (the
+page of products and its counters, the facet table and the rollups...) are
+sent to MongoDB at the same time instead of one after the other.
+
+Run with several worker processes through serve_async.py:
+    python serve_async.py --workers 4
+"""
+
+from quart import Quart, g, request, make_response, Response
+from quart.wrappers.response import DataBody
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+import asyncio
+import logging
+import os
+import time
+import traceback
+
+from api import plans
+from api.cache import ResponseCache
+from api.counts import CountStrategy
+from api.executors import AsyncExecutor
+from api.export import EXPORT_BATCH_SIZE, ExportEncoder, content_type_and_filename
+from api.http import compress_body, compute_etag, encoded_etag, matching_etag, negotiate_encoding
+from api.metrics import ApiMetrics
+from api.plans import ApiError
+from api.querylog import SlowQueryLog
+from api.serialization import dumps_bytes
+from price_comparator.dataversion import DataVersion
+from price_comparator.facets import FacetCatalog
+from price_comparator.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from price_comparator.rollups import RollupStore
+
+# Initialize Quart app
+app = Quart(__name__)
+
+# MongoDB Configuration
+# TODO: Update with your MongoDB connection string
+MONGO_URI = "mongodb://localhost:27017/"
+DATABASE_NAME = os.environ.get("PRICE_COMPARATOR_DB", "product_comparator")  # Overridden by benchmarks
+MONGO_MAX_POOL_SIZE = 100  # Connections per worker process, shared by its concurrent requests
+
+# Motor client for the request queries (bounded by the budgets below,
+# the socket timeout is only a safety net)
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    serverSelectionTimeoutMS=5000,  # 5 seconds
+    connectTimeoutMS=5000,  # 5 seconds
+    socketTimeoutMS=60000  # 1 minute
+)
+db = client[DATABASE_NAME]
+
+# pymongo client for the in-process helpers (data version, facet table, rollups)
+# and the slow-query explains, only used from worker threads
+sync_client = MongoClient(
+    MONGO_URI,
+    serverSelectionTimeoutMS=5000,  # 5 seconds
+    connectTimeoutMS=5000,  # 5 seconds
+    socketTimeoutMS=60000  # 1 minute
+)
+sync_db = sync_client[DATABASE_NAME]
+
+# Per-endpoint query time budgets and slow-query log (same as app.py)
+QUERY_BUDGETS_MS = {
+    '/filter': 2000,
+    '/products': 5000,
+    '/products/new': 3000,
+    '/products/modified': 3000,
+    '/product': 2000,
+    '/products/stats': 2000,
+    '/stats': 10000,
+    '/export': 5000,  # Validation and fuzzy ranking only, the stream itself is not bounded
+}
+SLOW_QUERY_MS = 500
+slow_query_log = SlowQueryLog(sync_db, threshold_ms=SLOW_QUERY_MS)
+
+# Response cache, invalidated by the data version the pipeline bumps after each crawl
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 300  # Upper bound for time-relative results (new today, last 24h...)
+CACHE_REDIS_URL = None  # e.g. "redis://localhost:6379/0" to share the cache between workers
+data_version = DataVersion(sync_db)
+response_cache = ResponseCache(
+    data_version,
+    max_entries=CACHE_MAX_ENTRIES,
+    ttl=CACHE_TTL_SECONDS,
+    shared_url=CACHE_REDIS_URL
+)
+
+# Counts: metadata count when unfiltered, capped and cached otherwise (same as app.py)
+COUNT_CAP = 10000
+count_strategy = CountStrategy(data_version, cap=COUNT_CAP, ttl=CACHE_TTL_SECONDS)
+
+# Prometheus metrics (/metrics) of this worker process
+metrics = ApiMetrics(caches={'response': response_cache, 'count': count_strategy})
+
+executor = AsyncExecutor(db, budgets=QUERY_BUDGETS_MS, slow_query_log=slow_query_log,
+                         count_strategy=count_strategy, metrics=metrics)
+
+# Facet count table precomputed by the pipeline after each crawl
+facet_catalog = FacetCatalog(sync_db, data_version)
+
+# Per-day, per-Company counters maintained by the pipeline
+rollups = RollupStore(sync_db)
+
+# Strong ETags and brotli/gzip compression (same rules as app.py)
+COMPRESSION_MIN_SIZE = 1024  # Bytes; smaller responses are sent uncompressed
+CACHED_ENDPOINTS = {'filter_endpoint', 'products', 'products_new', 'products_modified',
+                    'product_detail', 'products_stats', 'stats'}
+
+# Logging Configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+connection_logger = logging.getLogger('connection')
+error_logger = logging.getLogger('error')
+
+
+async def current_data_version():
+    # DataVersion.get() reads MongoDB when its local copy expires: keep it off the event loop
+    return await asyncio.to_thread(data_version.get)
+
+
+def json_response(response_data, status=200):
+    response = Response(dumps_bytes(response_data) + b'\n', status=status,
+                        content_type='application/json; charset=utf-8')
+    if 'approximate_counts' in response_data:
+        # Degraded response (counts estimated after a timeout): neither cached nor given an ETag
+        response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+def error_response(message, status):
+    return json_response({'error': message}, status)
+
+
+# ==================== Metrics hooks ====================
+# Registered first: the timer starts before the other hooks and, after_request
+# hooks running in reverse order, the size is measured after compression
+@app.before_request
+async def start_timer():
+    g.started = time.perf_counter()
+
+
+@app.after_request
+async def observe_response(response):
+    started = g.get('started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        size = response.headers.get('Content-Length')
+        metrics.observe_request(route, request.method, response.status_code,
+                                time.perf_counter() - started, int(size) if size else None)
+    return response
+
+
+# ==================== Cache, ETag and compression hooks ====================
+@app.before_request
+async def check_cache():
+    """304 for a matching If-None-Match, then the response cache, before running the view"""
+    if request.method != 'GET' or request.endpoint not in CACHED_ENDPOINTS:
+        return None
+
+    version = await current_data_version()
+    g.etag = etag = compute_etag(version, CACHE_TTL_SECONDS, request.path, request.args)
+
+    matched = matching_etag(request.headers.get('If-None-Match', ''), etag)
+    if matched:
+        response = Response(b'', status=304)
+        response.set_etag(matched)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    g.cache_key = key = response_cache.make_key(request.path, request.args)
+    entry = response_cache.get(key)
+    if entry is not None:
+        body, content_type = entry
+        response = Response(body, status=200, content_type=content_type)
+        response.headers['X-Cache'] = 'HIT'
+        return response
+    return None
+
+
+@app.after_request
+async def finalize_response(response):
+    etag = g.get('etag')
+    cache_key = g.get('cache_key')
+    # Streamed responses (/export) are sent as they are
+    cacheable = response.status_code == 200 and isinstance(response.response, DataBody)
+    if not cacheable:
+        return response
+    if 'no-store' in response.headers.get('Cache-Control', ''):
+        etag = cache_key = None
+
+    body = await response.get_data()
+    if cache_key and 'X-Cache' not in response.headers:
+        response_cache.set(cache_key, (body, response.headers['Content-Type']))
+        response.headers['X-Cache'] = 'MISS'
+
+    encoding = None
+    if 'Content-Encoding' not in response.headers:
+        encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+        if encoding and len(body) >= COMPRESSION_MIN_SIZE:
+            response.set_data(compress_body(body, encoding))
+            response.headers['Content-Encoding'] = encoding
+        else:
+            encoding = None
+        response.vary.add('Accept-Encoding')
+
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+async def run_endpoint(name, plan, success_message):
+    """Run an endpoint plan and shape the response like the Flask views do"""
+    try:
+        response_data = await executor.run(plan, name)
+        connection_logger.info(success_message(response_data))
+        return json_response(response_data)
+
+    except ApiError as e:
+        return error_response(e.message, e.status)
+    except Exception as e:
+        error_logger.error(f"Error in {name} endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return error_response(f'An error occurred: {str(e)}', 500)
+
+
+# ==================== /filter Endpoint ====================
+@app.route('/filter', methods=['GET'])
+async def filter_endpoint():
+    """Facet values and counts (see app.py)"""
+    connection_logger.info(f"Accessed /filter endpoint with params: {request.args}")
+    return await run_endpoint(
+        '/filter',
+        plans.filter_plan(request.args, facet_catalog),
+        lambda data: "Successfully retrieved filter data"
+    )
+
+
+# ==================== /products Endpoint ====================
+@app.route('/products', methods=['GET'])
+async def products():
+    """Filtered, sorted and paginated products (see app.py)"""
+    connection_logger.info(f"Accessed /products endpoint with params: {request.args}")
+    return await run_endpoint(
+        '/products',
+        plans.products_plan(request.args),
+        lambda data: f"Successfully retrieved {len(data['products'])} products"
+    )
+
+
+# ==================== /products/new Endpoint ====================
+@app.route('/products/new', methods=['GET'])
+async def products_new():
+    """Newly added products (see app.py)"""
+    connection_logger.info(f"Accessed /products/new endpoint with params: {request.args}")
+    return await run_endpoint(
+        '/products/new',
+        plans.products_new_plan(request.args),
+        lambda data: f"Successfully retrieved {len(data['products'])} new products"
+    )
+
+
+# ==================== /products/modified Endpoint ====================
+@app.route('/products/modified', methods=['GET'])
+async def products_modified():
+    """Recently modified products (see app.py)"""
+    connection_logger.info(f"Accessed /products/modified endpoint with params: {request.args}")
+    return await run_endpoint(
+        '/products/modified',
+        plans.products_modified_plan(request.args),
+        lambda data: f"Successfully retrieved {len(data['products'])} modified products"
+    )
+
+
+# ==================== /product/<ref> Endpoint ====================
+@app.route('/product/<path:ref>', methods=['GET'])
+async def product_detail(ref):
+    """Full product document with paginated history (see app.py)"""
+    connection_logger.info(f"Accessed /product endpoint for ref {ref} with params: {request.args}")
+    return await run_endpoint(
+        '/product',
+        plans.product_detail_plan(ref, request.args),
+        lambda data: f"Successfully retrieved product {ref}"
+    )
+
+
+# ==================== /products/stats Endpoint ====================
+@app.route('/products/stats', methods=['GET'])
+async def products_stats():
+    """Catalog and today's counters (see app.py)"""
+    connection_logger.info(f"Accessed /products/stats endpoint")
+    return await run_endpoint(
+        '/products/stats',
+        plans.products_stats_plan(rollups),
+        lambda data: "Successfully retrieved product stats"
+    )
+
+
+# ==================== /stats Endpoint ====================
+@app.route('/stats', methods=['GET'])
+async def stats():
+    """Statistics by type (see app.py)"""
+    connection_logger.info(f"Accessed /stats endpoint with params: {request.args}")
+    stats_type = request.args.get('type', '')
+    return await run_endpoint(
+        '/stats',
+        plans.stats_plan(request.args, rollups),
+        lambda data: f"Successfully retrieved stats for type: {stats_type}"
+    )
+
+
+# ==================== /export Endpoint ====================
+async def _export_stream(query, projection, export_format, columns, compress):
+    """Stream the export chunk by chunk from a Motor cursor"""
+    cursor = db[plans.PRODUCTS_COLLECTION].find(query, projection).batch_size(EXPORT_BATCH_SIZE)
+    encoder = ExportEncoder(export_format, columns, compress)
+
+    try:
+        async for product in cursor:
+            chunk = encoder.add(product)
+            if chunk:
+                yield chunk
+        yield encoder.finish()
+
+        connection_logger.info(f"Successfully exported {encoder.exported} products")
+
+    except Exception as e:
+        # Headers are already sent: log the failure, the client sees a truncated stream
+        error_logger.error(f"Error while streaming /export after {encoder.exported} products: {str(e)}")
+        error_logger.error(traceback.format_exc())
+
+    finally:
+        await cursor.close()
+
+
+@app.route('/export', methods=['GET'])
+async def export_products():
+    """Streams the products matching the /products filters as NDJSON or CSV (see app.py)"""
+    try:
+        connection_logger.info(f"Accessed /export endpoint with params: {request.args}")
+
+        query, projection, export_format, columns, compress = await executor.run(
+            plans.export_plan(request.args), '/export')
+        content_type, filename = content_type_and_filename(export_format, compress)
+
+        response = await make_response(_export_stream(query, projection, export_format, columns, compress))
+        response.headers['Content-Type'] = content_type
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.timeout = None  # Large exports outlast the default response timeout
+        return response
+
+    except ApiError as e:
+        return error_response(e.message, e.status)
+    except Exception as e:
+        error_logger.error(f"Error in /export endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return error_response(f'An error occurred: {str(e)}', 500)
+
+
+# ==================== /cache/stats Endpoint ====================
+@app.route('/cache/stats', methods=['GET'])
+async def cache_stats():
+    """Reports response cache usage (see app.py)"""
+    try:
+        stats_data = await asyncio.to_thread(response_cache.stats)
+        connection_logger.info(f"Response cache hit ratio: {stats_data['hit_ratio']}")
+        return json_response({'cache': stats_data, 'counts': count_strategy.stats()})
+
+    except Exception as e:
+        error_logger.error(f"Error in /cache/stats endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return error_response(f'An error occurred: {str(e)}', 500)
+
+
+# ==================== /metrics Endpoint ====================
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    """Prometheus metrics of this worker process"""
+    try:
+        return Response(metrics.render(), status=200, content_type=METRICS_CONTENT_TYPE)
+
+    except Exception as e:
+        error_logger.error(f"Error in /metrics endpoint: {str(e)}")
+        error_logger.error(traceback.format_exc())
+        return error_response(f'An error occurred: {str(e)}', 500)
@@ -0,0 +1,421 @@
+"""
+API load benchmark: latency percentiles and throughput per endpoint.
+
+`seed` fills a dedicated database with a synthetic catalog (products with a
+realistic Modifications history, plus the trigram index, daily rollups and
+facet catalog the API reads). `run` replays a weighted mix of /products,
+/filter, /products/stats and /stats queries against a running API at a fixed
+concurrency, reports p50/p95/p99 latency and throughput per query, and
+compares them with a stored baseline.
+
+Usage:
+    python benchmarks/api_load.py seed --products 100000
+    PRICE_COMPARATOR_DB=product_comparator_bench python serve_async.py --workers 4
+    python benchmarks/api_load.py run --concurrency 16 --duration 30 --save baseline.json
+    ... change the API, restart it ...
+    python benchmarks/api_load.py run --concurrency 16 --duration 30 --baseline baseline.json
+
+Responses are not served from the API response cache (a unique parameter is
+added to each request) unless --allow-cache is given. The load generator uses
+threads: at very high request rates, run several instances.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import requests
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from price_comparator.dataversion import bump_data_version  # noqa: E402
+from price_comparator.facets import rebuild_facet_catalog  # noqa: E402
+from price_comparator.pipelines import ProductPipeline, last_modification_fields  # noqa: E402
+from price_comparator.rollups import RollupStore  # noqa: E402
+from price_comparator.trigram import TrigramIndex  # noqa: E402
+
+BENCH_DATABASE = "product_comparator_bench"
+PRODUCTION_DATABASE = ProductPipeline.DATABASE_NAME
+SEED_BATCH_SIZE = 5000
+
+COMPANIES = ['Tunisianet', 'MyTek']
+CATALOG = {
+    'Informatique': ['Ordinateur Portable', 'Ordinateur de Bureau', 'Ecran', 'Imprimante', 'Stockage'],
+    'Téléphonie': ['Smartphone', 'Tablette', 'Montre Connectée', 'Accessoires Téléphonie'],
+    'Electroménager': ['Réfrigérateur', 'Machine à Laver', 'Climatiseur', 'Four'],
+    'Image & Son': ['Téléviseur', 'Casque', 'Enceinte'],
+    'Gaming': ['Console', 'Manette', 'Chaise Gaming'],
+}
+BRANDS = ['LENOVO', 'HP', 'DELL', 'ASUS', 'ACER', 'SAMSUNG', 'APPLE', 'XIAOMI', 'LG', 'SONY',
+          'MSI', 'HUAWEI', 'CANON', 'EPSON', 'CONDOR', 'BEKO', 'TCL', 'LOGITECH']
+STOCKS = ['In Stock', 'Out of Stock', 'On Order']
+STOCK_WEIGHTS = [70, 20, 10]
+MODEL_WORDS = ['Pro', 'Plus', 'Max', 'Ultra', 'Lite', 'Air', 'Slim', 'Gaming', 'Smart', 'Neo',
+               'i3', 'i5', 'i7', 'Ryzen 5', 'Ryzen 7', '8Go', '16Go', '256Go', '512Go SSD', '1To']
+
+
+# ==================== Synthetic catalog ====================
+
+def make_modifications(rng, price, stock, date_ajout, now):
+    """Price/stock history after `date_ajout`; returns (modifications, final price, final stock)"""
+    # Most products never change, a few change often
+    count = min(int(rng.expovariate(0.6)), 30) if rng.random() < 0.6 else 0
+    span = (now - date_ajout).total_seconds()
+    dates = sorted(date_ajout + timedelta(seconds=rng.uniform(0, span)) for _ in range(count))
+
+    modifications = []
+    for date in dates:
+        new_price = price
+        new_stock = stock
+        if rng.random() < 0.8:
+            new_price = round(max(price * (1 + rng.uniform(-0.15, 0.12)), 1), 3)
+        if new_price == price or rng.random() < 0.3:
+            new_stock = rng.choices(STOCKS, STOCK_WEIGHTS)[0]
+        modifications.append({
+            'dateModification': date,
+            'oldPrice': price,
+            'newPrice': new_price,
+            'oldStock': stock,
+            'newStock': new_stock,
+        })
+        price, stock = new_price, new_stock
+    return modifications, price, stock
+
+
+def make_product(index, rng, now, history_days):
+    category = rng.choice(list(CATALOG))
+    subcategory = rng.choice(CATALOG[category])
+    brand = rng.choice(BRANDS)
+    company = rng.choice(COMPANIES)
+    model = ' '.join(rng.sample(MODEL_WORDS, 3))
+    designation = f"{subcategory} {brand.title()} {rng.randint(100, 9999)} {model}"
+
+    date_ajout = now - timedelta(seconds=rng.uniform(0, history_days * 86400))
+    initial_price = round(rng.lognormvariate(6, 1.1), 3)
+    initial_stock = rng.choices(STOCKS, STOCK_WEIGHTS)[0]
+    modifications, price, stock = make_modifications(rng, initial_price, initial_stock, date_ajout, now)
+
+    product = {
+        'Ref': f"BENCH{index:07d}",
+        'Designation': designation,
+        'Description': f"{designation}. " + ' '.join(rng.choices(MODEL_WORDS, k=40)),
+        'Price': price,
+        'Brand': brand,
+        'Company': company,
+        'Category': category,
+        'Subcategory': subcategory,
+        'Stock': stock,
+        'Url': f"https://www.{company.lower()}.com.tn/{index}-{brand.lower()}.html",
+        'ImageUrl': f"https://www.{company.lower()}.com.tn/{index}-home/{brand.lower()}.jpg",
+        'DateAjout': date_ajout,
+        'Modifications': modifications,
+    }
+    product.update(last_modification_fields(modifications[-1] if modifications else None))
+    return product
+
+
+def seed(args):
+    if args.db == PRODUCTION_DATABASE and not args.force:
+        sys.exit(f"Refusing to overwrite {args.db} (use --force)")
+
+    client = MongoClient(args.mongo_uri)
+    client.drop_database(args.db)
+    db = client[args.db]
+    started = time.perf_counter()
+
+    # Same indexes as a crawled database
+    bench_pipeline = type('BenchPipeline', (ProductPipeline,), {
+        'MONGO_URI': args.mongo_uri,
+        'DATABASE_NAME': args.db,
+    })
+    bench_pipeline().close()
+
+    rng = random.Random(args.seed)
+    now = datetime.now()
+    products = db['products']
+    batch = []
+    for index in range(args.products):
+        batch.append(make_product(index, rng, now, args.history_days))
+        if len(batch) >= SEED_BATCH_SIZE:
+            products.insert_many(batch, ordered=False)
+            batch = []
+            print(f"\rInserted {index + 1}/{args.products} products", end='', flush=True)
+    if batch:
+        products.insert_many(batch, ordered=False)
+    print(f"\rInserted {args.products} products in {time.perf_counter() - started:.1f}s")
+
+    # Derived collections maintained by the pipeline
+    TrigramIndex(db).rebuild(products)
+    RollupStore(db).rebuild(products)
+    rebuild_facet_catalog(db)
+    bump_data_version(db)
+    print(f"Seeded {args.db} in {time.perf_counter() - started:.1f}s")
+
+
+# ==================== Query mix ====================
+
+def products_page(rng):
+    return {'page': rng.randint(1, 20)}
+
+
+def products_brand(rng):
+    return {'brand': rng.choice(BRANDS), 'sort_by': rng.choice(['price', 'dateajout']),
+            'order': rng.choice(['asc', 'desc'])}
+
+
+def products_category_price(rng):
+    category = rng.choice(list(CATALOG))
+    low = rng.choice([50, 200, 500, 1000])
+    return {'category': category, 'subcategory': rng.choice(CATALOG[category]),
+            'price_min': low, 'price_max': low * rng.choice([2, 5]), 'stock': 'In Stock'}
+
+
+def products_search(rng):
+    return {'designation': rng.choice(BRANDS).title(), 'products_per_page': 20}
+
+
+def products_fuzzy(rng):
+    # Misspelled product names
+    word = rng.choice([s for subcategories in CATALOG.values() for s in subcategories])
+    position = rng.randrange(len(word))
+    return {'designation': word[:position] + word[position + 1:], 'search_mode': 'fuzzy'}
+
+
+def products_deep_page(rng):
+    return {'page': rng.randint(200, 1000), 'sort_by': 'price'}
+
+
+def filter_brand(rng):
+    return {'brand': rng.choice(BRANDS)}
+
+
+def filter_category(rng):
+    return {'category': rng.choice(list(CATALOG)), 'company': rng.choice(COMPANIES)}
+
+
+def no_params(rng):
+    return {}
+
+
+def stats_type(rng):
+    return {'type': rng.choice(['top_modified_products', 'category_distribution',
+                                'modified_per_day', 'added_per_day'])}
+
+
+# name -> (path, weight, parameters)
+QUERY_MIX = {
+    'products': ('/products', 20, products_page),
+    'products_brand': ('/products', 15, products_brand),
+    'products_category_price': ('/products', 15, products_category_price),
+    'products_search': ('/products', 10, products_search),
+    'products_fuzzy': ('/products', 5, products_fuzzy),
+    'products_deep_page': ('/products', 5, products_deep_page),
+    'filter_brand': ('/filter', 10, filter_brand),
+    'filter_category': ('/filter', 5, filter_category),
+    'products_stats': ('/products/stats', 10, no_params),
+    'stats': ('/stats', 5, stats_type),
+}
+
+
+# ==================== Load generation ====================
+
+def percentile(sorted_values, percent):
+    """Linear interpolation between the closest ranks"""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(latencies, errors, duration):
+    values = sorted(latencies)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput': round(len(values) / duration, 2),
+        'mean_ms': round(sum(values) / len(values), 2) if values else None,
+        'p50_ms': round(percentile(values, 50), 2) if values else None,
+        'p95_ms': round(percentile(values, 95), 2) if values else None,
+        'p99_ms': round(percentile(values, 99), 2) if values else None,
+    }
+
+
+class LoadRunner:
+    """`concurrency` threads sending requests back to back, each with its own connection"""
+
+    def __init__(self, url, concurrency, seed, allow_cache, timeout):
+        self.url = url.rstrip('/')
+        self.concurrency = concurrency
+        self.seed = seed
+        self.allow_cache = allow_cache
+        self.timeout = timeout
+        self.names = list(QUERY_MIX)
+        self.weights = [QUERY_MIX[name][1] for name in self.names]
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+        self.recording = False
+        self.counter = 0
+
+    def worker(self, worker_id, deadline):
+        rng = random.Random(f"{self.seed}-{worker_id}")
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            name = rng.choices(self.names, self.weights)[0]
+            path, _, make_params = QUERY_MIX[name]
+            params = make_params(rng)
+            if not self.allow_cache:
+                params['_bench'] = f"{worker_id}-{rng.getrandbits(48)}"
+
+            started = time.perf_counter()
+            try:
+                response = session.get(self.url + path, params=params, timeout=self.timeout)
+                response.content
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            if self.recording:
+                with self.lock:
+                    if ok:
+                        self.latencies[name].append(elapsed_ms)
+                    else:
+                        self.errors[name] += 1
+        session.close()
+
+    def run(self, duration, warmup):
+        deadline = time.monotonic() + warmup + duration
+        threads = [threading.Thread(target=self.worker, args=(i, deadline), daemon=True)
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+
+        time.sleep(warmup)
+        self.recording = True
+        started = time.monotonic()
+        for thread in threads:
+            thread.join()
+        measured = time.monotonic() - started
+
+        endpoints = {
+            name: summarize(self.latencies[name], self.errors[name], measured)
+            for name in self.names if self.latencies[name] or self.errors[name]
+        }
+        every_latency = [value for values in self.latencies.values() for value in values]
+        return {
+            'meta': {
+                'url': self.url,
+                'concurrency': self.concurrency,
+                'duration_s': round(measured, 2),
+                'allow_cache': self.allow_cache,
+                'date': datetime.now().isoformat(timespec='seconds'),
+            },
+            'endpoints': endpoints,
+            'total': summarize(every_latency, sum(self.errors.values()), measured),
+        }
+
+
+# ==================== Report ====================
+
+def print_results(results):
+    meta = results['meta']
+    print(f"{meta['url']}: {meta['concurrency']} concurrent clients for {meta['duration_s']}s")
+    print(f"{'query':<26}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    rows = list(results['endpoints'].items()) + [('TOTAL', results['total'])]
+    for name, row in rows:
+        print(f"{name:<26}{row['requests']:>9}{row['errors']:>8}{row['throughput']:>9}"
+              f"{row['p50_ms'] or '-':>9}{row['p95_ms'] or '-':>9}{row['p99_ms'] or '-':>9}")
+
+
+def change(current, previous):
+    if current is None or not previous:
+        return None
+    return (current - previous) / previous * 100
+
+
+def compare(results, baseline, threshold):
+    """Print the changes against a baseline; returns the names of the regressed queries"""
+    print()
+    print(f"Compared with the baseline of {baseline['meta']['date']} (regression threshold {threshold}%)")
+    print(f"{'query':<26}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    regressions = []
+    current_rows = dict(results['endpoints'], TOTAL=results['total'])
+    baseline_rows = dict(baseline['endpoints'], TOTAL=baseline['total'])
+    for name, row in current_rows.items():
+        previous = baseline_rows.get(name)
+        if previous is None:
+            continue
+        deltas = [change(row['throughput'], previous['throughput'])] + [
+            change(row[field], previous[field]) for field in ('p50_ms', 'p95_ms', 'p99_ms')
+        ]
+        cells = ''.join(f"{delta:>+9.1f}%" if delta is not None else f"{'-':>10}" for delta in deltas)
+        throughput_delta, _, p95_delta, _ = deltas
+        regressed = ((p95_delta is not None and p95_delta > threshold) or
+                     (throughput_delta is not None and throughput_delta < -threshold))
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<26}{cells}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def run(args):
+    runner = LoadRunner(args.url, args.concurrency, args.seed, args.allow_cache, args.timeout)
+    results = runner.run(args.duration, args.warmup)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='Create a synthetic catalog')
+    seed_parser.add_argument('--products', type=int, default=10000)
+    seed_parser.add_argument('--history-days', type=int, default=365, help='Age of the oldest product')
+    seed_parser.add_argument('--mongo-uri', default=ProductPipeline.MONGO_URI)
+    seed_parser.add_argument('--db', default=BENCH_DATABASE)
+    seed_parser.add_argument('--seed', type=int, default=42)
+    seed_parser.add_argument('--force', action='store_true', help=f"Allow seeding {PRODUCTION_DATABASE}")
+
+    run_parser = commands.add_parser('run', help='Replay the query mix against a running API')
+    run_parser.add_argument('--url', default='http://localhost:5000')
+    run_parser.add_argument('--concurrency', type=int, default=8)
+    run_parser.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    run_parser.add_argument('--warmup', type=float, default=5, help='Seconds of load before measuring')
+    run_parser.add_argument('--timeout', type=float, default=30, help='Request timeout in seconds')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('--allow-cache', action='store_true', help='Let the API serve cached responses')
+    run_parser.add_argument('--save', help='Write the results to this JSON file')
+    run_parser.add_argument('--baseline', help='Compare with results saved by a previous run')
+    run_parser.add_argument('--threshold', type=float, default=10,
+                            help='p95 increase or throughput drop (percent) reported as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'seed':
+        seed(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Item memory benchmark: bytes per scraped item for the former dict-backed
+TunisianetItem (scrapy.Item with 13 fields, name/link duplicating
+productname/Url) and the slotted ProductItem with interned strings.
+
+Items are built from synthetic product data whose strings are fresh objects
+for every item, like the strings extracted from the HTML of each page.
+Reported per item:
+- memory: heap growth measured with tracemalloc while holding N items
+- pickled: size in a disk queue (request meta of the product detail requests)
+
+Usage:
+    python benchmarks/item_memory.py --items 100000
+"""
+
+import argparse
+import gc
+import json
+import os
+import pickle
+import random
+import sys
+import tracemalloc
+
+from scrapy.item import Field, Item
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline_ingest import make_item  # noqa: E402
+from price_comparator.items import ProductItem  # noqa: E402
+
+CATEGORY_URLS = [f"https://www.tunisianet.com.tn/{index}-category" for index in range(300)]
+
+
+class LegacyItem(Item):
+    """TunisianetItem before ProductItem"""
+
+    name = Field()
+    link = Field()
+    Url = Field()
+    category = Field()
+    subcategory = Field()
+    productname = Field()
+    reference = Field()
+    price = Field()
+    availability = Field()
+    brand = Field()
+    imageUrl = Field()
+    description = Field()
+    category_url = Field()
+
+
+def fresh(value):
+    """A new string object equal to `value`, as returned by a selector"""
+    return value.encode('utf-8').decode('utf-8')
+
+
+def scraped_values(count, seed):
+    """Field values of `count` products, in the form the spiders extract them"""
+    rng = random.Random(seed)
+    for index in range(count):
+        data = make_item(index, rng)
+        yield {
+            'Url': fresh(data['Url']),
+            'productname': fresh(data['productname']),
+            'reference': fresh(data['reference']),
+            'price': float(data['price'].split()[0]),
+            'availability': fresh(data['availability']),
+            'brand': fresh(data['brand']),
+            'category': fresh(data['category']),
+            'subcategory': fresh(data['subcategory']),
+            'description': fresh(data['description']),
+            'imageUrl': fresh(data['imageUrl']),
+            'category_url': fresh(rng.choice(CATEGORY_URLS)),
+        }
+
+
+def legacy_item(values):
+    item = LegacyItem()
+    for field, value in values.items():
+        item[field] = value
+    item['link'] = values['Url']
+    item['name'] = fresh(values['productname'])  # stripped again by the spider: a new string
+    return item
+
+
+def product_item(values):
+    item = ProductItem()
+    for field, value in values.items():
+        setattr(item, field, value)
+    return item
+
+
+def measure(build, count, seed):
+    # Intern the shared constants of the generator before measuring
+    list(scraped_values(1, seed))
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # Scraped strings are freed unless an item keeps them
+    items = [build(item_values) for item_values in scraped_values(count, seed)]
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    pickled = sum(len(pickle.dumps(item, protocol=4)) for item in items[:1000]) / min(count, 1000)
+    return {'memory_bytes_per_item': round(memory / count, 1), 'pickled_bytes_per_item': round(pickled, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = {
+        'legacy': measure(legacy_item, args.items, args.seed),
+        'product_item': measure(product_item, args.items, args.seed),
+    }
+    legacy, compact = results['legacy'], results['product_item']
+    results['saving_pct'] = round(100 * (1 - compact['memory_bytes_per_item'] / legacy['memory_bytes_per_item']), 1)
+
+    print(f"{args.items} items")
+    print(f"{'item type':<14}{'bytes/item':>12}{'pickled':>10}")
+    for name in ('legacy', 'product_item'):
+        print(f"{name:<14}{results[name]['memory_bytes_per_item']:>12}{results[name]['pickled_bytes_per_item']:>10}")
+    print(f"Memory saving: {results['saving_pct']}% per item")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
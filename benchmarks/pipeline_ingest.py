@@ -0,0 +1,211 @@
+"""
+Pipeline ingest benchmark: items/s, MongoDB operations per item and memory
+growth of ProductPipeline for each write mode.
+
+Each write mode starts from an empty database (a dedicated one, dropped
+afterwards) and ingests N synthetic items in four phases:
+- new:       first crawl, every product is inserted
+- unchanged: the same items again
+- changed:   the same products with a new price
+- daily:     a typical daily crawl, 2% new / 88% unchanged / 10% changed
+MongoDB operations are counted with a pymongo command listener; memory growth
+is the resident set size increase over the phase.
+
+Usage:
+    python benchmarks/pipeline_ingest.py --items 100000 --modes single bulk:100 bulk:500 bulk:2000
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import time
+from collections import Counter
+
+from pymongo import MongoClient, monitoring
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_load import BRANDS, CATALOG, MODEL_WORDS  # noqa: E402
+from price_comparator.pipelines import ProductPipeline  # noqa: E402
+
+BENCH_DATABASE = "product_comparator_bench_ingest"
+AVAILABILITIES = ['En stock', 'Rupture de stock', 'Sur commande']
+AVAILABILITY_WEIGHTS = [70, 20, 10]
+# Connection handshakes and monitoring, not pipeline work
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'buildInfo'}
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Count the commands sent to MongoDB, by command name"""
+
+    def __init__(self):
+        self.commands = Counter()
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+class Spider:
+    name = 'tunisianet'
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is not available)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def make_item(index, rng):
+    category = rng.choice(list(CATALOG))
+    subcategory = rng.choice(CATALOG[category])
+    brand = rng.choice(BRANDS)
+    name = f"{subcategory} {brand.title()} {rng.randint(100, 9999)} {' '.join(rng.sample(MODEL_WORDS, 3))}"
+    return {
+        'reference': f"ING{index:08d}",
+        'productname': name,
+        'price': f"{rng.lognormvariate(6, 1.1):.3f} DT",
+        'availability': rng.choices(AVAILABILITIES, AVAILABILITY_WEIGHTS)[0],
+        'brand': brand,
+        'category': category,
+        'subcategory': subcategory,
+        'description': f"{name}. " + ' '.join(rng.choices(MODEL_WORDS, k=40)),
+        'Url': f"https://www.tunisianet.com.tn/{index}-{brand.lower()}.html",
+        'imageUrl': f"https://www.tunisianet.com.tn/{index}-home/{brand.lower()}.jpg",
+    }
+
+
+def change_price(item, rng):
+    price = float(item['price'].split()[0])
+    return dict(item, price=f"{price * rng.uniform(0.85, 1.1):.3f} DT")
+
+
+def phases(count, seed):
+    """(phase name, items) in ingest order"""
+    rng = random.Random(seed)
+    catalog = [make_item(index, rng) for index in range(count)]
+    yield 'new', catalog
+    yield 'unchanged', catalog
+
+    catalog = [change_price(item, rng) for item in catalog]
+    yield 'changed', catalog
+
+    daily = []
+    next_index = count
+    for index, item in enumerate(catalog):
+        draw = rng.random()
+        if draw < 0.02:
+            daily.append(make_item(next_index, rng))
+            next_index += 1
+        elif draw < 0.12:
+            catalog[index] = change_price(item, rng)
+            daily.append(catalog[index])
+        else:
+            daily.append(item)
+    yield 'daily', daily
+
+
+def parse_mode(mode):
+    """"single" or "bulk:<batch size>" -> (write mode, batch size)"""
+    name, _, batch_size = mode.partition(':')
+    if name not in ('single', 'bulk'):
+        raise argparse.ArgumentTypeError(f"Unknown write mode: {mode}")
+    return name, int(batch_size or ProductPipeline.BATCH_SIZE)
+
+
+def bench_mode(args, mode, counter):
+    write_mode, batch_size = mode
+    client = MongoClient(args.mongo_uri)
+    client.drop_database(args.db)
+
+    pipeline_class = type('BenchPipeline', (ProductPipeline,), {
+        'MONGO_URI': args.mongo_uri,
+        'DATABASE_NAME': args.db,
+        'WRITE_MODE': write_mode,
+        'BATCH_SIZE': batch_size,
+    })
+    pipeline = pipeline_class()
+    spider = Spider()
+    pipeline.open_spider(spider)
+
+    results = []
+    for phase, items in phases(args.items, args.seed):
+        counter.commands.clear()
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        for item in items:
+            # The pipeline completes the product dicts it receives: give it a copy like a fresh item
+            pipeline.process_item(dict(item), spider)
+        pipeline.flush()
+        elapsed = time.perf_counter() - started
+
+        operations = sum(counter.commands.values())
+        results.append({
+            'mode': write_mode if write_mode == 'single' else f"bulk:{batch_size}",
+            'phase': phase,
+            'items': len(items),
+            'items_per_second': round(len(items) / elapsed, 1),
+            'ops_per_item': round(operations / len(items), 3),
+            'rss_growth_mb': round((rss_bytes() - rss_before) / 2 ** 20, 1),
+            'commands': dict(counter.commands),
+        })
+
+    pipeline.close_spider(spider)
+    if not args.keep:
+        client.drop_database(args.db)
+    client.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--modes', nargs='+', type=parse_mode, default=[('single', 0), ('bulk', 500)],
+                        help='"single" and/or "bulk:<batch size>"')
+    parser.add_argument('--mongo-uri', default=ProductPipeline.MONGO_URI)
+    parser.add_argument('--db', default=BENCH_DATABASE)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help='Keep the database of the last mode')
+    parser.add_argument('--log-level', default='WARNING', help='Pipeline log level (INFO logs every product)')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.db == ProductPipeline.DATABASE_NAME:
+        sys.exit(f"Refusing to use {args.db}")
+    logging.basicConfig(level=args.log_level)
+
+    counter = CommandCounter()
+    monitoring.register(counter)
+
+    print(f"Ingesting {args.items} items per phase")
+    print(f"{'mode':<12}{'phase':<11}{'items/s':>10}{'ops/item':>10}{'RSS +MB':>9}  commands")
+    results = []
+    for mode in args.modes:
+        for row in bench_mode(args, mode, counter):
+            results.append(row)
+            commands = ', '.join(f"{name}={count}" for name, count in sorted(row['commands'].items()))
+            print(f"{row['mode']:<12}{row['phase']:<11}{row['items_per_second']:>10}"
+                  f"{row['ops_per_item']:>10}{row['rss_growth_mb']:>9}  {commands}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.save}")
+
+
+if __name__ == '__main__':
+    main()
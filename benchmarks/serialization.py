@@ -0,0 +1,118 @@
+"""
+Serialization benchmark for a /products?products_per_page=100 response.
+
+Compares the previous path (converting `_id`s in a Python loop, then Flask's
+default jsonify) with FastJSONProvider, and reports the payload size with
+gzip/brotli compression. No MongoDB needed: documents are synthetic.
+
+Usage:
+    python benchmarks/serialization.py [--products 100] [--repeat 2000]
+"""
+
+import argparse
+import copy
+import gzip
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.serialization import FastJSONProvider, backend_name  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def make_products(count):
+    """Products shaped like the lean list projection of /products"""
+    now = datetime.now()
+    products = []
+    for i in range(count):
+        products.append({
+            '_id': ObjectId(),
+            'Ref': f"REF{i:06d}",
+            'Designation': f"Ordinateur Portable Lenovo IdeaPad {i} i5 11è Gén 8Go 512Go SSD",
+            'Price': round(random.uniform(10, 5000), 3),
+            'Brand': random.choice(['LENOVO', 'HP', 'DELL', 'ASUS']),
+            'Company': random.choice(['Tunisianet', 'MyTek']),
+            'Category': 'Informatique',
+            'Subcategory': 'Ordinateur Portable',
+            'Stock': random.choice(['In Stock', 'Out of Stock', 'On Order']),
+            'Url': f"https://www.tunisianet.com.tn/pc-portable-tunisie/{i}-lenovo.html",
+            'ImageUrl': f"https://www.tunisianet.com.tn/{i}-home/lenovo.jpg",
+            'DateAjout': now - timedelta(days=random.randint(0, 30)),
+            'LastModified': now - timedelta(hours=random.randint(0, 72)),
+            'LastPrice': round(random.uniform(10, 5000), 3),
+            'LastChangePct': round(random.uniform(-20, 20), 2),
+        })
+    return products
+
+
+def response_data(products):
+    return {
+        'total_products': 12345,
+        'total_new_products': 12,
+        'total_modified_products': 40,
+        'total_pages': 124,
+        'current_page': 1,
+        'products_per_page': len(products),
+        'stock_status': {'in_stock': 9000, 'on_order': 1000, 'out_of_stock': 2345},
+        'products': products,
+    }
+
+
+def bench(label, app, build, repeat):
+    with app.test_request_context():
+        body = build().get_data()  # Warm up
+        start = time.perf_counter()
+        for _ in range(repeat):
+            build()
+        elapsed = time.perf_counter() - start
+
+    per_call = elapsed / repeat * 1e6
+    print(f"{label:<28} {per_call:9.1f} us/response   {len(body):>8} bytes")
+    return per_call, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    products = make_products(args.products)
+
+    default_app = Flask('default')
+    fast_app = Flask('fast')
+    fast_app.json = FastJSONProvider(fast_app)
+
+    def build_default():
+        # Previous code path: stringify ObjectIds, then jsonify
+        docs = copy.copy(products)
+        docs = [dict(p, _id=str(p['_id'])) for p in docs]
+        return jsonify(response_data(docs))
+
+    def build_fast():
+        return jsonify(response_data(products))
+
+    print(f"Serializing a {args.products}-product /products response, {args.repeat} times")
+    baseline, body = bench('jsonify (default)', default_app, build_default, args.repeat)
+    fast, fast_body = bench(f"FastJSONProvider ({backend_name()})", fast_app, build_fast, args.repeat)
+    print(f"Speedup: {baseline / fast:.1f}x")
+
+    print()
+    print(f"gzip:   {len(gzip.compress(fast_body, compresslevel=6)):>8} bytes")
+    if brotli is not None:
+        print(f"brotli: {len(brotli.compress(fast_body, quality=4)):>8} bytes")
+
+
+if __name__ == '__main__':
+    main()
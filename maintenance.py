@@ -0,0 +1,128 @@
+from pymongo import MongoClient, UpdateOne
+import logging
+
+from price_comparator.dataversion import bump_data_version
+from price_comparator.facets import rebuild_facet_catalog
+from price_comparator.pipelines import last_modification_fields
+from price_comparator.rollups import RollupStore
+from price_comparator.trigram import TrigramIndex
+
+# MongoDB Configuration
+MONGO_URI = "mongodb://localhost:27017/"
+DATABASE_NAME = "product_comparator"
+
+client = MongoClient(MONGO_URI)
+db = client[DATABASE_NAME]
+products_collection = db['products']
+
+# Logging Configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def rebuild_trigram_index():
+    """
+    Rebuild the trigram index used by the fuzzy search of /products.
+    The scraping pipeline keeps it up to date; this is needed once for
+    products inserted before the index existed or modified outside the pipeline.
+    """
+    logger.info("Rebuilding trigram search index...")
+    total = TrigramIndex(db).rebuild(products_collection)
+    logger.info(f"Trigram index rebuilt for {total} products")
+
+
+def backfill_last_modification_fields(batch_size=1000):
+    """
+    Fill LastModified, LastPrice and LastChangePct from the Modifications array
+    of every product. The pipeline maintains them for new writes; this covers
+    products stored before these fields existed (or edited by datamanipulation.py).
+    """
+    logger.info("Backfilling LastModified / LastPrice / LastChangePct...")
+
+    products_collection.create_index("LastModified")
+    products_collection.create_index("LastChangePct")
+
+    operations = []
+    total = 0
+    cursor = products_collection.find({}, {'_id': 1, 'Modifications': {'$slice': -1}})
+
+    for product in cursor:
+        modifications = product.get('Modifications') or []
+        latest = modifications[-1] if modifications else None
+        operations.append(UpdateOne(
+            {'_id': product['_id']},
+            {'$set': last_modification_fields(latest)}
+        ))
+
+        if len(operations) >= batch_size:
+            products_collection.bulk_write(operations, ordered=False)
+            total += len(operations)
+            operations = []
+
+    if operations:
+        products_collection.bulk_write(operations, ordered=False)
+        total += len(operations)
+
+    logger.info(f"Backfilled last modification fields for {total} products")
+
+
+def rebuild_facets():
+    """
+    Rebuild the facet count table served by /filter and bump the data version
+    so running API instances reload it. The pipeline does this after each crawl.
+    """
+    logger.info("Rebuilding facet catalog...")
+    combinations = rebuild_facet_catalog(db)
+    version = bump_data_version(db)
+    logger.info(f"Facet catalog rebuilt with {combinations} combinations (data version {version})")
+
+
+def rebuild_daily_rollups():
+    """
+    Recompute the per-day, per-Company counters read by /stats and /products/stats
+    from DateAjout and the Modifications history, and the catalog totals of
+    /products/stats. The pipeline keeps them up to date; rebuild after importing
+    data or running datamanipulation.py.
+    """
+    logger.info("Rebuilding daily rollups...")
+    documents = RollupStore(db).rebuild(products_collection)
+    version = bump_data_version(db)
+    logger.info(f"Rebuilt {documents} rollup documents (data version {version})")
+
+
+if __name__ == '__main__':
+    print("=" * 60)
+    print("Product Database Maintenance Tool")
+    print("=" * 60)
+    print()
+    print("Search Index Options:")
+    print("1. Rebuild trigram search index")
+    print()
+    print("Materialized Field Options:")
+    print("2. Backfill LastModified / LastPrice / LastChangePct")
+    print("3. Rebuild facet catalog (/filter)")
+    print("4. Rebuild daily rollups (/stats, /products/stats)")
+    print()
+
+    choice = input("Enter your choice (1-4): ").strip()
+
+    if choice == '1':
+        rebuild_trigram_index()
+
+    elif choice == '2':
+        backfill_last_modification_fields()
+
+    elif choice == '3':
+        rebuild_facets()
+
+    elif choice == '4':
+        rebuild_daily_rollups()
+
+    else:
+        print("Invalid choice!")
+
+    print()
+    print("Done!")
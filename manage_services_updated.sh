@@ -31,10 +31,10 @@ show_menu() {
     echo -e "${BLUE}3.${NC} Restart all services"
     echo -e "${BLUE}4.${NC} Check status of all services"
     echo -e "${BLUE}5.${NC} View Flask API logs"
-    echo -e "${BLUE}6.${NC} View scraper logs"
+    echo -e "${BLUE}6.${NC} View recrawl scheduler logs"
     echo -e "${BLUE}7.${NC} Run TunisiaNet scraper now"
     echo -e "${BLUE}8.${NC} Run MyTek scraper now"
-    echo -e "${BLUE}9.${NC} View cron schedule"
+    echo -e "${BLUE}9.${NC} View recrawl schedule"
     echo -e "${BLUE}10.${NC} Test MongoDB connection"
     echo -e "${BLUE}11.${NC} Test Flask API endpoints"
     echo -e "${BLUE}0.${NC} Exit"
@@ -46,11 +46,13 @@ start_services() {
     sudo systemctl start $MONGO_SERVICE
     sleep 2
     sudo systemctl start price-comparator-api.service
+    sudo systemctl start price-comparator-recrawl.service
     echo -e "${GREEN}✓ All services started${NC}"
 }
 
 stop_services() {
     echo -e "\n${YELLOW}Stopping all services...${NC}"
+    sudo systemctl stop price-comparator-recrawl.service
     sudo systemctl stop price-comparator-api.service
     sudo systemctl stop $MONGO_SERVICE
     echo -e "${GREEN}✓ All services stopped${NC}"
@@ -61,6 +63,7 @@ restart_services() {
     sudo systemctl restart $MONGO_SERVICE
     sleep 2
     sudo systemctl restart price-comparator-api.service
+    sudo systemctl restart price-comparator-recrawl.service
     echo -e "${GREEN}✓ All services restarted${NC}"
 }
 
@@ -70,6 +73,9 @@ check_status() {
 
     echo -e "\n${YELLOW}=== Flask API Status ===${NC}"
     sudo systemctl status price-comparator-api.service --no-pager | head -n 10
+
+    echo -e "\n${YELLOW}=== Recrawl Scheduler Status ===${NC}"
+    sudo systemctl status price-comparator-recrawl.service --no-pager | head -n 10
 }
 
 view_api_logs() {
@@ -78,32 +84,27 @@ view_api_logs() {
 }
 
 view_scraper_logs() {
-    echo -e "\n${YELLOW}Viewing scraper logs (Ctrl+C to exit)...${NC}"
-    if [ -f "$SCRIPT_DIR/scraper.log" ]; then
-        tail -f "$SCRIPT_DIR/scraper.log"
-    else
-        echo -e "${RED}No scraper logs found${NC}"
-    fi
+    echo -e "\n${YELLOW}Viewing recrawl scheduler logs (Ctrl+C to exit)...${NC}"
+    echo "Logs of each scheduled crawl: $SCRIPT_DIR/price_comparator/recrawl_runs/"
+    sudo journalctl -u price-comparator-recrawl.service -f
 }
 
 run_tunisianet() {
     echo -e "\n${YELLOW}Running TunisiaNet scraper...${NC}"
-    "$SCRIPT_DIR/run_tunisianet_scraper.sh"
+    "$SCRIPT_DIR/run_all_scrapers.sh" tunisianet
     echo -e "${GREEN}✓ Scraper finished${NC}"
 }
 
 run_mytek() {
     echo -e "\n${YELLOW}Running MyTek scraper...${NC}"
-    cd "$SCRIPT_DIR/price_comparator"
-    source venv/bin/activate
-    scrapy crawl mytek
-    deactivate
+    "$SCRIPT_DIR/run_all_scrapers.sh" mytek
     echo -e "${GREEN}✓ Scraper finished${NC}"
 }
 
-view_cron() {
-    echo -e "\n${YELLOW}Current cron schedule:${NC}"
-    crontab -l | grep -E "(run_tunisianet|run_mytek|scraper)" || echo "No scraper cron jobs found"
+view_schedule() {
+    echo -e "\n${YELLOW}Current recrawl schedule:${NC}"
+    cd "$SCRIPT_DIR/price_comparator"
+    PYTHONPATH="$SCRIPT_DIR" venv/bin/python -m price_comparator.recrawl --status
 }
 
 test_mongodb() {
@@ -179,7 +180,7 @@ while true; do
         6) view_scraper_logs ;;
         7) run_tunisianet ;;
         8) run_mytek ;;
-        9) view_cron ;;
+        9) view_schedule ;;
         10) test_mongodb ;;
         11) test_api ;;
         0) echo -e "${GREEN}Goodbye!${NC}"; exit 0 ;;
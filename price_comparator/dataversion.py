@@ -0,0 +1,53 @@
+"""
+Data version counter shared by the scraping pipeline and the Flask API.
+
+The pipeline increments it whenever a crawl commits changes to the products
+collection; the API uses it to invalidate anything derived from the data
+(response cache entries, ETags...).
+"""
+
+import time
+from datetime import datetime
+
+from pymongo import ReturnDocument
+
+META_COLLECTION = "meta"
+DATA_VERSION_ID = "data_version"
+
+
+def bump_data_version(db):
+    """Increment the data version and return the new value"""
+    document = db[META_COLLECTION].find_one_and_update(
+        {'_id': DATA_VERSION_ID},
+        {'$inc': {'version': 1}, '$set': {'updatedAt': datetime.now()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return document['version']
+
+
+def read_data_version(db):
+    """Read the current data version (0 if the pipeline never bumped it)"""
+    document = db[META_COLLECTION].find_one({'_id': DATA_VERSION_ID})
+    return document['version'] if document else 0
+
+
+class DataVersion:
+    """
+    Cached reader of the data version.
+    Mongo is queried at most once every `ttl` seconds, so checking the
+    version on every API request stays cheap.
+    """
+
+    def __init__(self, db, ttl=5.0):
+        self.db = db
+        self.ttl = ttl
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= self.ttl:
+            self._version = read_data_version(self.db)
+            self._checked_at = now
+        return self._version
@@ -0,0 +1,194 @@
+"""
+Request duplicates filters.
+
+CompactRFPDupeFilter is Scrapy's RFPDupeFilter with a compact state: the
+fingerprints seen during a job are appended to <JOBDIR>/requests.seen.bin as
+raw 20-byte digests instead of 40 hex characters and a newline, and kept in
+memory as bytes, which also halves the size of the in-memory set.
+
+BloomDupeFilter keeps the fingerprints in a scalable Bloom filter instead of a
+set: a few bytes per request (DUPEFILTER_BLOOM_ERROR_RATE sets the share of new
+requests wrongly taken for duplicates), saved to <JOBDIR>/requests.bloom when
+the spider closes. It is not written before: a crawl that crashes loses the
+fingerprints along with Scrapy's request queue, which is also only saved on
+close (CrawlState then discards both and resumes at category granularity).
+"""
+
+import math
+import os
+import struct
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+
+SEEN_FILE = "requests.seen.bin"
+BLOOM_FILE = "requests.bloom"
+PRODUCTS_SEEN_FILE = "products.seen"  # Refs scraped by the crawl, see DuplicateProductPipeline
+FINGERPRINT_SIZE = 20  # SHA1 digest of Scrapy's request fingerprinter
+
+BLOOM_MAGIC = b"SBF1"
+BLOOM_HEADER = struct.Struct("<4sQdI")  # magic, initial capacity, error rate, filters
+BLOOM_FILTER_HEADER = struct.Struct("<QdQIQ")  # capacity, error rate, bits, hashes, keys
+
+
+class CompactRFPDupeFilter(RFPDupeFilter):
+    """Request fingerprint duplicates filter with a binary append-only JOBDIR file"""
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        if path:
+            self.file = open(os.path.join(path, SEEN_FILE), 'a+b')
+            self.file.seek(0)
+            data = self.file.read()
+            # An interrupted write can leave a partial fingerprint at the end
+            complete = len(data) - len(data) % FINGERPRINT_SIZE
+            if complete != len(data):
+                self.file.truncate(complete)
+            self.fingerprints.update(data[i:i + FINGERPRINT_SIZE] for i in range(0, complete, FINGERPRINT_SIZE))
+
+    def request_fingerprint(self, request):
+        return self.fingerprinter.fingerprint(request)
+
+    def request_seen(self, request):
+        fingerprint = self.request_fingerprint(request)
+        if fingerprint in self.fingerprints:
+            return True
+        self.fingerprints.add(fingerprint)
+        if self.file:
+            self.file.write(fingerprint)
+        return False
+
+
+class BloomFilter:
+    """Bloom filter of digests, sized for `capacity` keys at `error_rate` false positives"""
+
+    def __init__(self, capacity, error_rate, num_bits=None, num_hashes=None, count=0, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = num_bits or math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = num_hashes or math.ceil(-math.log2(error_rate))
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing on the digest bytes: the key is already a uniform hash
+        h1 = int.from_bytes(key[:8], 'little')
+        h2 = int.from_bytes(key[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """
+    Scalable Bloom filter (Almeida et al.): when a filter is full, a new one
+    GROWTH times larger with a TIGHTENING times lower error rate is added, so
+    the overall false positive rate stays below `error_rate` whatever the
+    number of keys. Keys are digests of at least 16 bytes.
+    """
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, capacity, error_rate):
+        self.initial_capacity = capacity
+        self.error_rate = error_rate
+        self.filters = []
+
+    def __contains__(self, key):
+        return any(key in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, key):
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            index = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * self.GROWTH ** index,
+                self.error_rate * (1 - self.TIGHTENING) * self.TIGHTENING ** index,
+            ))
+        self.filters[-1].add(key)
+
+    @property
+    def size_bytes(self):
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+    def save(self, path):
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.initial_capacity, self.error_rate, len(self.filters)))
+            for bloom in self.filters:
+                f.write(BLOOM_FILTER_HEADER.pack(
+                    bloom.capacity, bloom.error_rate, bloom.num_bits, bloom.num_hashes, bloom.count))
+                f.write(bloom.bits)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            magic, capacity, error_rate, filter_count = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+            if magic != BLOOM_MAGIC:
+                raise ValueError(f"{path} is not a Bloom filter file")
+            scalable = cls(capacity, error_rate)
+            for _ in range(filter_count):
+                capacity, error_rate, num_bits, num_hashes, count = BLOOM_FILTER_HEADER.unpack(
+                    f.read(BLOOM_FILTER_HEADER.size))
+                bits = bytearray(f.read((num_bits + 7) // 8))
+                scalable.filters.append(BloomFilter(capacity, error_rate, num_bits, num_hashes, count, bits))
+        return scalable
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """Request fingerprint duplicates filter backed by a scalable Bloom filter, saved on close only"""
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None, capacity=100000, error_rate=1e-6):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.stats = None
+        self.path = os.path.join(path, BLOOM_FILE) if path else None
+        if self.path and os.path.exists(self.path):
+            self.bloom = ScalableBloomFilter.load(self.path)
+        else:
+            self.bloom = ScalableBloomFilter(capacity, error_rate)
+
+    @classmethod
+    def from_settings(cls, settings, *, fingerprinter=None):
+        return cls(
+            job_dir(settings),
+            settings.getbool('DUPEFILTER_DEBUG'),
+            fingerprinter=fingerprinter,
+            capacity=settings.getint('DUPEFILTER_BLOOM_CAPACITY', 100000),
+            error_rate=settings.getfloat('DUPEFILTER_BLOOM_ERROR_RATE', 1e-6),
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter = cls.from_settings(crawler.settings, fingerprinter=crawler.request_fingerprinter)
+        dupefilter.stats = crawler.stats
+        return dupefilter
+
+    def request_fingerprint(self, request):
+        return self.fingerprinter.fingerprint(request)
+
+    def request_seen(self, request):
+        fingerprint = self.request_fingerprint(request)
+        if fingerprint in self.bloom:
+            return True
+        self.bloom.add(fingerprint)
+        return False
+
+    def close(self, reason):
+        if self.stats is not None:
+            self.stats.set_value('dupefilter/bloom_keys', len(self.bloom))
+            self.stats.set_value('dupefilter/bloom_filters', len(self.bloom.filters))
+            self.stats.set_value('dupefilter/bloom_bytes', self.bloom.size_bytes)
+        if self.path:
+            self.bloom.save(self.path)
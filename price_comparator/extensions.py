@@ -0,0 +1,363 @@
+"""
+Scrapy extensions of the price comparator project.
+
+MetricsTextfile exports crawl metrics for the node_exporter textfile
+collector: every METRICS_TEXTFILE_INTERVAL seconds (and when the spider
+closes) it rewrites <METRICS_TEXTFILE_DIR>/price_comparator_<spider>.prom with
+- items scraped / requests / responses totals and their per-second rates
+- scheduler queue depth and requests in the downloader
+- pipeline write latency (histogram observed by ProductPipeline)
+
+Enabled by setting METRICS_TEXTFILE_DIR, e.g.
+    scrapy crawl tunisianet -s METRICS_TEXTFILE_DIR=/var/lib/node_exporter/textfile_collector
+
+CrawlProfiler samples PROFILE_PERCENT percent of the spider callbacks
+(ProfilingSpiderMiddleware) and pipeline calls (ProductPipeline) with the
+sampling profiler, and writes their folded stacks to PROFILE_DIR when the
+spider closes, e.g.
+    scrapy crawl tunisianet -s PROFILE_PERCENT=5
+
+CrawlState makes crawls with a JOBDIR resumable after a crash, and logs the
+categories completed by the spider so that a restarted crawl skips them, e.g.
+    scrapy crawl tunisianet -s JOBDIR=crawl_state/tunisianet
+"""
+
+import logging
+import os
+import random
+import shutil
+import time
+import types
+import weakref
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from price_comparator import signals as price_comparator_signals
+from price_comparator.dupefilters import BLOOM_FILE, PRODUCTS_SEEN_FILE, SEEN_FILE
+from price_comparator.metrics import Registry, write_textfile
+from price_comparator.profiling import DEFAULT_INTERVAL, SamplingProfiler, profile_file_name
+
+logger = logging.getLogger(__name__)
+
+# Metrics observed directly by the crawl components (labelled by spider)
+crawl_metrics = Registry()
+pipeline_write_seconds = crawl_metrics.histogram(
+    'scrapy_pipeline_write_seconds', 'Time spent by the pipeline writing an item (a batch in bulk write mode) to MongoDB', ['spider'])
+
+# Crawler stats exported as counters: metric name -> (stats key, description)
+STATS_COUNTERS = {
+    'scrapy_items_scraped_total': ('item_scraped_count', 'Items scraped'),
+    'scrapy_items_dropped_total': ('item_dropped_count', 'Items dropped'),
+    'scrapy_requests_total': ('downloader/request_count', 'Requests sent by the downloader'),
+    'scrapy_responses_total': ('downloader/response_count', 'Responses received by the downloader'),
+    'scrapy_errors_total': ('log_count/ERROR', 'Errors logged'),
+    'scrapy_retries_total': ('retry/count', 'Requests retried'),
+    'scrapy_hedged_requests_total': ('hedge/issued', 'Hedges sent for slow downloads'),
+    'scrapy_hedges_won_total': ('hedge/won', 'Hedges completed before their slow download'),
+}
+
+
+class MetricsTextfile:
+    """Periodically write the crawl metrics of a spider to a .prom file"""
+
+    def __init__(self, crawler, directory, interval):
+        self.crawler = crawler
+        self.directory = directory
+        self.interval = interval
+        self.spider = None
+        self.task = None
+        self.last_time = None
+        self.last_items = 0
+        self.last_requests = 0
+
+        self.registry = Registry()
+        self.items_per_second = self.registry.gauge(
+            'scrapy_items_per_second', 'Items scraped per second over the last interval', ['spider'])
+        self.requests_per_second = self.registry.gauge(
+            'scrapy_requests_per_second', 'Requests sent per second over the last interval', ['spider'])
+        self.queue_depth = self.registry.gauge(
+            'scrapy_scheduler_queue_depth', 'Requests waiting in the scheduler', ['spider'])
+        self.downloader_active = self.registry.gauge(
+            'scrapy_downloader_active_requests', 'Requests being downloaded', ['spider'])
+        self.running = self.registry.gauge(
+            'scrapy_spider_running', '1 while the spider runs, 0 once closed', ['spider'])
+        self.updated = self.registry.gauge(
+            'scrapy_metrics_updated_timestamp_seconds', 'Time of the last metrics update', ['spider'])
+        self.registry.add_collector(self._stats_counters)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('METRICS_TEXTFILE_DIR')
+        if not directory:
+            raise NotConfigured
+        extension = cls(crawler, directory, crawler.settings.getfloat('METRICS_TEXTFILE_INTERVAL', 15))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.last_time = time.monotonic()
+        self.task = task.LoopingCall(self.write, spider)
+        self.task.start(self.interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        if self.task and self.task.running:
+            self.task.stop()
+        self.write(spider, running=False)
+
+    def _queue_sizes(self):
+        """(scheduler queue depth, requests in the downloader), None when unavailable"""
+        engine = self.crawler.engine
+        try:
+            queued = len(engine.slot.scheduler)
+        except (AttributeError, TypeError):
+            queued = None
+        try:
+            active = len(engine.downloader.active)
+        except (AttributeError, TypeError):
+            active = None
+        return queued, active
+
+    def _stats_counters(self):
+        stats = self.crawler.stats
+        return [
+            (name, 'counter', description, [({'spider': self.spider.name}, stats.get_value(key, 0))])
+            for name, (key, description) in STATS_COUNTERS.items()
+        ]
+
+    def write(self, spider, running=True):
+        try:
+            now = time.monotonic()
+            elapsed = now - self.last_time
+            items = self.crawler.stats.get_value('item_scraped_count', 0)
+            requests = self.crawler.stats.get_value('downloader/request_count', 0)
+
+            if elapsed > 0:
+                self.items_per_second.labels(spider.name).set(round((items - self.last_items) / elapsed, 3))
+                self.requests_per_second.labels(spider.name).set(round((requests - self.last_requests) / elapsed, 3))
+            self.last_time, self.last_items, self.last_requests = now, items, requests
+
+            queued, active = self._queue_sizes()
+            if queued is not None:
+                self.queue_depth.labels(spider.name).set(queued)
+            if active is not None:
+                self.downloader_active.labels(spider.name).set(active)
+            self.running.labels(spider.name).set(1 if running else 0)
+            self.updated.labels(spider.name).set(round(time.time(), 3))
+
+            text = self.registry.render() + crawl_metrics.render(label_filter={'spider': spider.name})
+            write_textfile(os.path.join(self.directory, f"price_comparator_{spider.name}.prom"), text)
+
+        except Exception as e:
+            # Metrics must never break the crawl
+            logger.warning(f"Could not write crawl metrics: {e}")
+
+
+class CrawlProfiler:
+    """Profiler shared by the components of a crawler, see crawl_profiler()"""
+
+    def __init__(self, crawler, directory, percent, interval=DEFAULT_INTERVAL):
+        self.directory = directory
+        self.percent = percent
+        self.profiler = SamplingProfiler(interval)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def sampled(self):
+        """Whether the next callback or pipeline call should be profiled"""
+        return random.random() * 100 < self.percent
+
+    def capture(self, label):
+        return self.profiler.capture(label)
+
+    def profile_iterable(self, result, label):
+        """
+        Iterate the output of a callback under the profiler. A generator
+        callback runs step by step as its output is consumed: only these steps
+        are sampled, not what Scrapy does with each request or item.
+        """
+        iterator = iter(result)
+        while True:
+            with self.capture(label):
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+            yield value
+
+    async def profile_async_iterable(self, result, label):
+        """
+        Iterate the output of an asynchronous callback under the profiler. Only
+        the steps it runs are sampled: not the other callbacks the event loop
+        runs while it awaits, e.g. a parse in the parse pool.
+        """
+        iterator = result.__aiter__()
+        while True:
+            try:
+                value = await self._profiled_await(iterator.__anext__(), label)
+            except StopAsyncIteration:
+                return
+            yield value
+
+    @types.coroutine
+    def _profiled_await(self, awaitable, label):
+        """Await `awaitable`, each of its steps up to a suspension point under the profiler"""
+        steps = awaitable.__await__()
+        value, error = None, None
+        while True:
+            with self.capture(label):
+                try:
+                    awaited = steps.send(value) if error is None else steps.throw(error)
+                except StopIteration as stop:
+                    return stop.value
+            try:
+                value, error = (yield awaited), None
+            except BaseException as e:
+                value, error = None, e
+
+    def spider_closed(self, spider, reason):
+        self.profiler.close()
+        if not self.profiler.samples:
+            logger.info("No profile samples collected")
+            return
+        path = os.path.join(self.directory, profile_file_name(spider.name))
+        try:
+            self.profiler.write(path)
+            logger.info(f"Wrote profile ({self.profiler.samples} samples) to {path}")
+        except OSError as e:
+            logger.error(f"Could not write profile {path}: {e}")
+
+
+_crawl_profilers = weakref.WeakKeyDictionary()
+
+
+def crawl_profiler(crawler):
+    """The CrawlProfiler of a crawler, None unless PROFILE_PERCENT is set"""
+    if crawler not in _crawl_profilers:
+        percent = crawler.settings.getfloat('PROFILE_PERCENT', 0)
+        _crawl_profilers[crawler] = CrawlProfiler(
+            crawler,
+            crawler.settings.get('PROFILE_DIR', 'profiles'),
+            percent,
+            crawler.settings.getfloat('PROFILE_INTERVAL', DEFAULT_INTERVAL),
+        ) if percent > 0 else None
+    return _crawl_profilers[crawler]
+
+
+class CrawlState:
+    """
+    Resumable crawls: keeps the crawl state of JOBDIR consistent across runs.
+
+    Scrapy saves the pending requests of JOBDIR (requests.queue) only when the
+    spider closes, as does BloomDupeFilter with the seen fingerprints; a crawl
+    that dies without closing leaves a queue that lost its pending requests
+    and seen fingerprints that would filter them forever. So after a crash the
+    crawl only resumes at category granularity: a crawl.running marker
+    detects it, the queue and fingerprints are discarded, and the restarted
+    crawl skips the categories completed before the crash, read from the
+    completed_categories log. A category is completed once its last listing
+    page and the product pages it listed were handled (category_completed
+    signal of the spider); the pages of the other categories are crawled
+    again. The queue itself is only reused after a graceful shutdown.
+
+    When the spider closes as "finished" the state is removed, so the next
+    run starts a new crawl; any other reason (shutdown, closespider...) keeps
+    it for the next run to resume.
+    """
+
+    RUNNING_MARKER = "crawl.running"
+    COMPLETED_CATEGORIES_FILE = "completed_categories"
+    QUEUE_DIR = "requests.queue"
+    SEEN_FILES = ("requests.seen", SEEN_FILE, BLOOM_FILE, PRODUCTS_SEEN_FILE)
+
+    def __init__(self, crawler, directory, flush_interval):
+        self.crawler = crawler
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.marker_path = os.path.join(directory, self.RUNNING_MARKER)
+        self.log_path = os.path.join(directory, self.COMPLETED_CATEGORIES_FILE)
+
+        os.makedirs(directory, exist_ok=True)
+        self.crashed = os.path.exists(self.marker_path)
+        if self.crashed:
+            logger.warning(f"The previous crawl of {directory} did not close, "
+                           f"discarding its request queue and seen fingerprints")
+            self._remove(self.QUEUE_DIR, *self.SEEN_FILES)
+        self.resumed = os.path.exists(os.path.join(directory, self.QUEUE_DIR))
+
+        self.completed = self._load_completed()
+        with open(self.marker_path, 'w', encoding='utf-8') as f:
+            f.write(f"{os.getpid()}\n")
+        self.log = open(self.log_path, 'a', encoding='utf-8')
+        self.last_flush = time.monotonic()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('JOBDIR')
+        if not directory:
+            raise NotConfigured
+        extension = cls(crawler, directory, crawler.settings.getfloat('CRAWL_STATE_FLUSH_INTERVAL', 5))
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.category_completed, signal=price_comparator_signals.category_completed)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def _remove(self, *names):
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def _load_completed(self):
+        """
+        Read the completed categories log, compacting it (duplicates, partial
+        last line of a crash) when needed
+        """
+        if not os.path.exists(self.log_path):
+            return set()
+        with open(self.log_path, encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        # The last element is empty for a complete file, a partial line otherwise
+        entries = [line for line in lines[:-1] if line]
+        completed = list(dict.fromkeys(entries))
+        if len(completed) != len(lines) - 1:
+            temporary_path = f"{self.log_path}.tmp"
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                f.writelines(f"{category_url}\n" for category_url in completed)
+            os.replace(temporary_path, self.log_path)
+        return set(completed)
+
+    def spider_opened(self, spider):
+        spider.completed_categories = self.completed
+        spider.resumed_crawl = self.resumed
+        stats = self.crawler.stats
+        stats.set_value('crawl_state/resumed', self.resumed, spider=spider)
+        stats.set_value('crawl_state/recovered_crash', self.crashed, spider=spider)
+        stats.set_value('crawl_state/skipped_categories', len(self.completed), spider=spider)
+        if self.completed or self.resumed:
+            logger.info(f"Resuming the crawl of {self.directory}: {len(self.completed)} categories already completed")
+
+    def category_completed(self, spider, category_url):
+        if category_url in self.completed:
+            return
+        self.completed.add(category_url)
+        self.log.write(f"{category_url}\n")
+        self.crawler.stats.inc_value('crawl_state/completed_categories', spider=spider)
+        # Appends are buffered, flushed at most every flush_interval seconds
+        now = time.monotonic()
+        if now - self.last_flush >= self.flush_interval:
+            self.log.flush()
+            self.last_flush = now
+
+    def spider_closed(self, spider, reason):
+        self.log.close()
+        if reason == 'finished':
+            self._remove(self.QUEUE_DIR, *self.SEEN_FILES, self.COMPLETED_CATEGORIES_FILE, self.RUNNING_MARKER)
+            logger.info(f"Crawl finished, cleared the crawl state of {self.directory}")
+        else:
+            self._remove(self.RUNNING_MARKER)
+            logger.info(f"Crawl closed ({reason}), the next run resumes from {self.directory}")
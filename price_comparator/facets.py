@@ -0,0 +1,126 @@
+"""
+Precomputed facet catalog for the /filter endpoint.
+
+After each crawl the pipeline stores a count table in `facet_catalog`: one row
+per distinct (Brand, Stock, Category, Subcategory, Company) combination with
+the number of products having it. The table is a few thousand rows at most:
+the API keeps it in memory for unfiltered facet requests, and answers
+cross-filtered ones by querying the table instead of aggregating over the
+products collection. Filters are sent to MongoDB as the same case-insensitive
+$regex as the /products filters, so that the facet counts use the same regex
+engine (PCRE) as the lists they describe.
+"""
+
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+FACET_COLLECTION = "facet_catalog"
+
+# Response key -> product field
+FACET_DIMENSIONS = {
+    'brands': 'Brand',
+    'stocks': 'Stock',
+    'categories': 'Category',
+    'subcategories': 'Subcategory',
+    'companies': 'Company',
+}
+
+
+def regex_filter(pattern):
+    """Case-insensitive partial match of a user pattern, as in the /products filters"""
+    return {'$regex': pattern, '$options': 'i'}
+
+
+def compute_facet_rows(products_collection, query=None):
+    """Group products (matching `query`) by every facet dimension and count them"""
+    pipeline = [{'$match': query}] if query else []
+    pipeline += [
+        {
+            '$group': {
+                '_id': {field: f'${field}' for field in FACET_DIMENSIONS.values()},
+                'count': {'$sum': 1}
+            }
+        }
+    ]
+
+    rows = []
+    for group in products_collection.aggregate(pipeline, allowDiskUse=True):
+        row = {field: group['_id'].get(field) for field in FACET_DIMENSIONS.values()}
+        row['count'] = group['count']
+        rows.append(row)
+    return rows
+
+
+def rebuild_facet_catalog(db, products_collection_name='products'):
+    """
+    Recompute the facet count table and swap it in atomically
+    (built in a temporary collection then renamed over the catalog).
+    """
+    rows = compute_facet_rows(db[products_collection_name])
+
+    temporary = db[f"{FACET_COLLECTION}_tmp"]
+    temporary.drop()
+    if rows:
+        temporary.insert_many(rows)
+        temporary.rename(FACET_COLLECTION, dropTarget=True)
+    else:
+        db[FACET_COLLECTION].drop()
+
+    logger.info(f"Rebuilt facet catalog: {len(rows)} combinations")
+    return len(rows)
+
+
+class FacetCatalog:
+    """
+    In-memory copy of the facet count table, reloaded when the data version changes.
+    """
+
+    def __init__(self, db, data_version, products_collection_name='products'):
+        self.db = db
+        self.data_version = data_version
+        self.products_collection_name = products_collection_name
+        self._rows = []
+        self._version = None
+        self._lock = threading.Lock()
+
+    def rows(self):
+        version = self.data_version.get()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    rows = list(self.db[FACET_COLLECTION].find({}, {'_id': 0}))
+                    if not rows:
+                        # Catalog not built yet: compute the table once from the products
+                        rows = compute_facet_rows(self.db[self.products_collection_name])
+                    self._rows = rows
+                    self._version = version
+        return self._rows
+
+    def facets(self, filters):
+        """
+        Facet values and counts of the products matching `filters`,
+        a dict of product field -> case-insensitive regex (same semantics as the API filters).
+        Returns (values, counts): sorted values per dimension and value -> product count.
+        """
+        query = {field: regex_filter(pattern) for field, pattern in filters.items() if pattern}
+        if not query:
+            rows = self.rows()
+        else:
+            rows = list(self.db[FACET_COLLECTION].find(query, {'_id': 0}))
+            if not rows and self.db[FACET_COLLECTION].estimated_document_count() == 0:
+                # Catalog not built yet: query the products
+                rows = compute_facet_rows(self.db[self.products_collection_name], query)
+
+        counters = {name: Counter() for name in FACET_DIMENSIONS}
+        for row in rows:
+            for name, field in FACET_DIMENSIONS.items():
+                value = row.get(field)
+                if value:
+                    counters[name][value] += row['count']
+
+        values = {name: sorted(counter) for name, counter in counters.items()}
+        counts = {name: dict(counter) for name, counter in counters.items()}
+        return values, counts
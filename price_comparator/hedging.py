@@ -0,0 +1,164 @@
+"""
+Hedged downloads for the slow tail of the requests.
+
+A few pages hang until DOWNLOAD_TIMEOUT and stretch the end of every crawl.
+HedgingDownloadHandler wraps Scrapy's HTTP/1.1 download handler and keeps the
+latencies of the last HEDGE_WINDOW downloads of each domain. When a download
+takes longer than the HEDGE_PERCENTILE latency of its domain, a duplicate
+(hedge) is sent; the first one to complete is kept and the other cancelled.
+Hedges are limited to HEDGE_MAX_RATIO of the downloads, so that a slow
+server does not get twice the load, and are only sent for GET/HEAD requests
+once HEDGE_MIN_SAMPLES latencies are known for the domain. Requests with the
+dont_hedge meta key are never hedged.
+
+Hedging sits in the download handler rather than a downloader middleware:
+both attempts share the request and the middlewares (stats, cookies,
+retries) see a single response. Failed downloads are retried with
+exponential backoff by BackoffRetryMiddleware (price_comparator/middlewares.py).
+
+Stats: hedge/issued, hedge/won (the hedge completed first, its primary was
+cancelled), hedge/lost, hedge/budget_exhausted (hedge delay reached without
+budget left), and the p50/p95/p99 download latency of each domain
+(latency/<domain>/p95_ms...). 0 as HEDGE_PERCENTILE disables hedging.
+"""
+
+import logging
+import math
+import time
+from collections import defaultdict, deque
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+
+logger = logging.getLogger(__name__)
+
+HEDGED_METHODS = frozenset({'GET', 'HEAD'})
+
+
+class LatencyTracker:
+    """Latencies of the last `window` downloads of each domain"""
+
+    def __init__(self, window):
+        self.latencies = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, domain, seconds):
+        self.latencies[domain].append(seconds)
+
+    def samples(self, domain):
+        return len(self.latencies[domain])
+
+    def percentile(self, domain, percent):
+        """Nearest-rank percentile of the recent latencies of `domain`, None without samples"""
+        latencies = sorted(self.latencies[domain])
+        if not latencies:
+            return None
+        return latencies[max(math.ceil(percent / 100 * len(latencies)) - 1, 0)]
+
+
+class HedgingDownloadHandler:
+    """HTTP(S) download handler sending a hedge for the downloads slower than the latency percentile"""
+
+    lazy = False
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        self.handler = HTTP11DownloadHandler.from_crawler(crawler)
+        self.stats = crawler.stats
+        self.percent = settings.getfloat('HEDGE_PERCENTILE', 95)
+        self.min_samples = settings.getint('HEDGE_MIN_SAMPLES', 20)
+        self.min_delay = settings.getfloat('HEDGE_MIN_DELAY', 0.5)
+        self.max_ratio = settings.getfloat('HEDGE_MAX_RATIO', 0.05)
+        self.tracker = LatencyTracker(settings.getint('HEDGE_WINDOW', 200))
+        self.downloads = 0
+        self.hedges = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def hedge_delay(self, request, domain):
+        """Seconds after which a hedge of `request` is sent, None if it must not be hedged"""
+        if (not self.percent or request.method not in HEDGED_METHODS or request.meta.get('dont_hedge')
+                or self.tracker.samples(domain) < self.min_samples):
+            return None
+        return max(self.tracker.percentile(domain, self.percent), self.min_delay)
+
+    def download_request(self, request, spider):
+        domain = urlparse_cached(request).hostname or ''
+        self.downloads += 1
+        started = time.monotonic()
+        delay = self.hedge_delay(request, domain)
+        primary = self.handler.download_request(request, spider)
+        if delay is None:
+            return primary.addCallback(self._record, domain, started)
+        return self._race(request, spider, domain, primary, started, delay)
+
+    def _record(self, response, domain, started):
+        self.tracker.record(domain, time.monotonic() - started)
+        return response
+
+    def _race(self, request, spider, domain, primary, started, delay):
+        """Deferred fired by the first of the primary download and its hedge to complete"""
+        attempts = {'primary': primary}
+        failures = []
+
+        def cancel_all(_=None):
+            if timer.active():
+                timer.cancel()
+            for attempt in list(attempts.values()):
+                attempt.cancel()
+
+        result = defer.Deferred(canceller=cancel_all)
+
+        def completed(outcome, name):
+            attempts.pop(name, None)
+            if result.called:
+                return None  # The other attempt won, this one was cancelled
+            if isinstance(outcome, Failure) and attempts:
+                failures.append(outcome)
+                return None  # Wait for the other attempt
+            elapsed = time.monotonic() - started
+            if name == 'hedge':
+                self.stats.inc_value('hedge/won', spider=spider)
+            elif 'hedge' in attempts:
+                self.stats.inc_value('hedge/lost', spider=spider)
+            # Latency of the primary, at least the time it ran when it lost
+            self.tracker.record(domain, elapsed)
+            if timer.active():
+                timer.cancel()
+            losers = list(attempts.values())
+            if isinstance(outcome, Failure):
+                result.errback(failures[0] if failures else outcome)
+            else:
+                result.callback(outcome)
+            # Cancelled once the result is set: their errbacks are ignored
+            for loser in losers:
+                loser.cancel()
+            return None
+
+        def send_hedge():
+            if self.hedges >= self.max_ratio * self.downloads:
+                self.stats.inc_value('hedge/budget_exhausted', spider=spider)
+                return
+            self.hedges += 1
+            self.stats.inc_value('hedge/issued', spider=spider)
+            logger.debug(f"Hedging {request.url} after {delay:.2f}s")
+            hedge = self.handler.download_request(request, spider)
+            attempts['hedge'] = hedge
+            hedge.addBoth(completed, 'hedge')
+
+        timer = reactor.callLater(delay, send_hedge)
+        primary.addBoth(completed, 'primary')
+        return result
+
+    def close(self):
+        for domain in list(self.tracker.latencies):
+            for percent in (50, 95, 99):
+                latency = self.tracker.percentile(domain, percent)
+                self.stats.set_value(f'latency/{domain}/p{percent}_ms', round(latency * 1000, 1))
+        if self.hedges:
+            logger.info(f"Hedged {self.hedges} of {self.downloads} downloads, "
+                        f"{self.stats.get_value('hedge/won', 0)} hedges won")
+        return self.handler.close()
@@ -3,9 +3,10 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
+import sys
+from dataclasses import dataclass
+
 import scrapy
-from datetime import datetime
-from scrapy.item import Item, Field
 
 
 class PriceComparatorItem(scrapy.Item):
@@ -14,40 +15,54 @@ class PriceComparatorItem(scrapy.Item):
     pass
 
 
-class TunisianetItem(Item):
-
-
-    name = Field()
-    link = Field()
-    Url = Field()
-    category = Field()
-    subcategory = Field()  # Added subcategory
-    productname = Field()
-    reference = Field()
-    price = Field()
-    availability = Field()
-    brand = Field()
-    imageUrl = Field()
-    description = Field()  # Added short description
-    
-    
-class MytekItem(Item):
-
-
-    name = Field()
-    link = Field()
-    Url = Field()
-    category = Field()
-    subcategory = Field()  # Added subcategory
-    productname = Field()
-    reference = Field()
-    price = Field()
-    availability = Field()
-    brand = Field()
-    imageUrl = Field()
-    description = Field()  # Added short description
-    
-    
-    
-    
-        
\ No newline at end of file
+# Fields holding a few distinct values repeated across the catalog, stored interned
+INTERNED_FIELDS = frozenset({'brand', 'category', 'subcategory', 'availability', 'category_url'})
+
+
+@dataclass(slots=True)
+class ProductItem:
+    """
+    Product scraped by any store spider.
+
+    A slotted dataclass instead of a dict-backed scrapy.Item: the fields are
+    stored inline in the object, and the strings repeated across products
+    (INTERNED_FIELDS) are interned, so the hundreds of thousands of items kept
+    in request meta and the scheduler queues take much less memory (see
+    benchmarks/item_memory.py). ItemAdapter, the feed exporters and
+    ProductPipeline handle dataclass items natively.
+    """
+
+    Url: str = ''
+    productname: str = ''
+    reference: str = ''
+    price: float = 0.0
+    availability: str = 'Unknown'
+    brand: str = 'Unknown'
+    category: str = 'Uncategorized'
+    subcategory: str = ''
+    description: str = ''
+    imageUrl: str = ''
+    category_url: str = ''  # Listing the product was found on (recrawl unit)
+
+    def __setattr__(self, name, value):
+        if name in INTERNED_FIELDS and type(value) is str:
+            value = sys.intern(value)
+        object.__setattr__(self, name, value)
+
+    def __reduce__(self):
+        # Positional values: no field names in the pickles of the disk queues (request meta)
+        return self.__class__, tuple(getattr(self, field) for field in self.__slots__)
+
+    # Former TunisianetItem/MytekItem fields, duplicates of productname and Url
+    @property
+    def name(self):
+        return self.productname
+
+    @property
+    def link(self):
+        return self.Url
+
+
+# Backward compatible names of the store items
+TunisianetItem = ProductItem
+MytekItem = ProductItem
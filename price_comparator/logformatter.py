@@ -0,0 +1,22 @@
+"""
+Log formatter of the price comparator project (LOG_FORMATTER setting).
+
+Products listed in several categories are dropped by DuplicateProductPipeline
+on every listing but the first: these expected drops are logged at DEBUG
+instead of a WARNING with the whole item (counted in dedup/duplicate_items).
+"""
+
+import logging
+
+from scrapy.logformatter import LogFormatter
+
+from price_comparator.pipelines import DuplicateProduct
+
+
+class PriceComparatorLogFormatter(LogFormatter):
+
+    def dropped(self, item, exception, response, spider):
+        entry = super().dropped(item, exception, response, spider)
+        if isinstance(exception, DuplicateProduct):
+            entry['level'] = logging.DEBUG
+        return entry
@@ -3,11 +3,26 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import logging
+import os
+import random
+import time
+from collections import defaultdict
+
+from scrapy import Request, signals
+from scrapy.downloadermiddlewares.retry import RetryMiddleware
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.defer import maybe_deferred_to_future
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from price_comparator.extensions import crawl_profiler
+from price_comparator.revalidation import PageRecord, PageStore, body_hash
+from price_comparator.signals import category_listed, products_unchanged
+
+logger = logging.getLogger(__name__)
+
 
 class PriceComparatorSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -56,6 +71,273 @@ class PriceComparatorSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
+class ProfilingSpiderMiddleware:
+    """
+    Profile PROFILE_PERCENT percent of the spider callbacks (see
+    price_comparator.extensions.CrawlProfiler). Placed closest to the spider
+    so that only the callback itself is sampled.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        profiler = crawl_profiler(crawler)
+        if profiler is None:
+            raise NotConfigured
+        return cls(profiler)
+
+    def process_spider_output(self, response, result, spider):
+        if not self.profiler.sampled():
+            return result
+        callback = response.request.callback or spider.parse
+        return self.profiler.profile_iterable(result, f"{spider.name}.{callback.__name__}")
+
+    async def process_spider_output_async(self, response, result, spider):
+        if not self.profiler.sampled():
+            async for r in result:
+                yield r
+            return
+        callback = response.request.callback or spider.parse
+        async for r in self.profiler.profile_async_iterable(result, f"{spider.name}.{callback.__name__}"):
+            yield r
+
+
+class BackpressureSpiderMiddleware:
+    """
+    Pause the callbacks yielding requests while the BoundedScheduler is full
+    (SCHEDULER_MAX_PENDING queued plus in-flight requests), so that listing
+    pages do not fan out into more detail requests than memory can hold.
+    Placed close to the engine so that filtered requests are not counted.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getint('SCHEDULER_MAX_PENDING'):
+            raise NotConfigured
+        return cls(crawler)
+
+    async def process_spider_output(self, response, result, spider):
+        async for r in result:
+            if isinstance(r, Request):
+                scheduler = self.crawler.engine.slot.scheduler
+                waiter = scheduler.wait_for_capacity() if hasattr(scheduler, 'wait_for_capacity') else None
+                if waiter is not None:
+                    await maybe_deferred_to_future(waiter)
+            yield r
+
+
+class RevalidationSpiderMiddleware:
+    """
+    Conditional requests, and no parsing of the pages unchanged since the
+    previous crawl (see price_comparator.revalidation): their recorded
+    requests are followed again and products_unchanged is sent with the
+    references of their products, and category_listed for the last listing
+    page of a category (no recorded request with its category_url meta).
+    A parsed page is only recorded once all its products were scraped
+    (item_scraped), so that a product whose detail page failed is requested
+    again by the next crawl instead of being taken for unchanged; the pages
+    still waiting for products when the spider closes are not recorded.
+    Placed closest to the spider after ProfilingSpiderMiddleware, so that the
+    recorded requests carry no depth or referer, and the replayed ones go
+    through the other middlewares.
+    """
+
+    def __init__(self, crawler, directory):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.directory = directory
+        self.store = None
+        self.scraped_refs = set()
+        self.waiting_pages = {}  # Fingerprint -> (record, references not scraped yet)
+        self.waiting_refs = defaultdict(set)  # Reference -> fingerprints of the pages waiting for it
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        directory = crawler.settings.get('REVALIDATION_DIR')
+        if not directory:
+            raise NotConfigured
+        return cls(crawler, directory)
+
+    def page_store(self, spider):
+        if self.store is None:
+            self.store = PageStore(os.path.join(self.directory, spider.name))
+            logger.info(f"Revalidating the {len(self.store)} pages recorded in {self.store.path}")
+        return self.store
+
+    def item_scraped(self, item, spider):
+        ref = ItemAdapter(item).get('reference')
+        if not ref:
+            return
+        self.scraped_refs.add(ref)
+        for fingerprint in self.waiting_refs.pop(ref, ()):
+            waiting = self.waiting_pages.get(fingerprint)
+            if waiting is None:
+                continue
+            record, missing = waiting
+            missing.discard(ref)
+            if not missing:
+                del self.waiting_pages[fingerprint]
+                self.record(fingerprint, record, spider)
+
+    def record(self, fingerprint, record, spider):
+        self.stats.inc_value('revalidation/changed', spider=spider)
+        self.page_store(spider).put(fingerprint, record)
+
+    def spider_closed(self, spider):
+        if self.waiting_pages:
+            self.stats.set_value('revalidation/incomplete', len(self.waiting_pages), spider=spider)
+            logger.info(f"Not recording {len(self.waiting_pages)} pages with products that were not scraped")
+            self.waiting_pages.clear()
+            self.waiting_refs.clear()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+    def revalidated(self, request):
+        # The output of a page receiving an item (product detail) also depends on the item
+        return request.method == 'GET' and 'item' not in request.meta and not request.meta.get('dont_revalidate')
+
+    def conditional(self, request, spider):
+        """`request` with the validators of the response recorded for it, if any"""
+        if not self.revalidated(request):
+            return request
+        record = self.page_store(spider).get(self.crawler.request_fingerprinter.fingerprint(request))
+        if record is None or not (record.etag or record.last_modified):
+            return request
+        if record.etag:
+            request.headers[b'If-None-Match'] = record.etag
+        if record.last_modified:
+            request.headers[b'If-Modified-Since'] = record.last_modified
+        # Let the 304 responses through HttpErrorMiddleware
+        allowed = request.meta.get('handle_httpstatus_list') or getattr(spider, 'handle_httpstatus_list', [])
+        request.meta['handle_httpstatus_list'] = [*allowed, 304]
+        self.stats.inc_value('revalidation/conditional_requests', spider=spider)
+        return request
+
+    def process_start_requests(self, start_requests, spider):
+        for request in start_requests:
+            yield self.conditional(request, spider)
+
+    async def process_spider_output(self, response, result, spider):
+        request = response.request
+        if not self.revalidated(request) or response.status not in (200, 304):
+            async for r in result:
+                yield self.conditional(r, spider) if isinstance(r, Request) else r
+            return
+
+        store = self.page_store(spider)
+        fingerprint = self.crawler.request_fingerprinter.fingerprint(request)
+        record = store.get(fingerprint)
+        page_hash = body_hash(response.body) if response.status == 200 else None
+
+        if record is not None and (response.status == 304 or record.body_hash == page_hash):
+            # Unchanged page: the callback is not run
+            self.stats.inc_value('revalidation/not_modified' if response.status == 304 else 'revalidation/unchanged_body',
+                                 spider=spider)
+            if record.refs:
+                self.stats.inc_value('revalidation/products_unchanged', len(record.refs), spider=spider)
+                self.crawler.signals.send_catch_log(products_unchanged, spider=spider, refs=list(record.refs))
+            replayed_requests = store.replay_requests(record, spider)
+            for replayed in replayed_requests:
+                yield self.conditional(replayed, spider)
+            category_url = request.meta.get('category_url')
+            if category_url and not any(r.meta.get('category_url') == category_url for r in replayed_requests):
+                # Last listing page of the category, as the callback would have signalled
+                self.crawler.signals.send_catch_log(category_listed, spider=spider, category_url=category_url)
+            return
+
+        refs = []
+        followed = []
+        recordable = page_hash is not None
+        async for r in result:
+            if isinstance(r, Request):
+                item = r.meta.get('item')
+                if item is not None:
+                    # Product detail request: nothing to follow when the page is unchanged
+                    refs.append(ItemAdapter(item).get('reference'))
+                elif recordable:
+                    try:
+                        followed.append(store.record_request(r, spider))
+                    except ValueError as e:
+                        # Callback that is not a spider method
+                        logger.debug(f"Not recording {response.url}: {e}")
+                        recordable = False
+                r = self.conditional(r, spider)
+            elif is_item(r):
+                refs.append(ItemAdapter(r).get('reference'))
+            yield r
+
+        # Recorded once the callback completed and its products were scraped,
+        # a failed page is parsed again next time
+        if recordable:
+            record = PageRecord(
+                response.headers.get(b'ETag'),
+                response.headers.get(b'Last-Modified'),
+                page_hash,
+                tuple(ref for ref in refs if ref),
+                followed,
+            )
+            missing = set(record.refs) - self.scraped_refs
+            if not missing:
+                self.record(fingerprint, record, spider)
+                return
+            self.waiting_pages[fingerprint] = (record, missing)
+            for ref in missing:
+                self.waiting_refs[ref].add(fingerprint)
+
+
+class BackoffRetryMiddleware(RetryMiddleware):
+    """
+    RetryMiddleware waiting before each retry instead of rescheduling it at
+    once: exponential backoff with full jitter (a random delay up to
+    RETRY_BACKOFF_BASE * 2 ** (retries - 1) seconds, at most RETRY_BACKOFF_MAX),
+    or the Retry-After of the response when the server sends one, so that
+    the retries of a struggling server are spread out. The retry request is
+    rescheduled at once with a not_before meta (epoch seconds) that
+    BoundedScheduler honours, so that it does not hold a downloader slot
+    during the delay. Stats: retry/backoff_count and retry/backoff_seconds.
+    """
+
+    def __init__(self, settings, stats):
+        super().__init__(settings)
+        self.stats = stats
+        self.base = settings.getfloat('RETRY_BACKOFF_BASE', 1.0)
+        self.max_delay = settings.getfloat('RETRY_BACKOFF_MAX', 30.0)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler.stats)
+
+    def process_response(self, request, response, spider):
+        result = super().process_response(request, response, spider)
+        return self.backoff(result, spider, response.headers.get(b'Retry-After'))
+
+    def process_exception(self, request, exception, spider):
+        return self.backoff(super().process_exception(request, exception, spider), spider)
+
+    def backoff(self, result, spider, retry_after=None):
+        """`result`, not to be downloaded before the backoff delay when it is a retry request"""
+        if not isinstance(result, Request):
+            return result
+        delay = random.uniform(0, min(self.max_delay, self.base * 2 ** (result.meta.get('retry_times', 1) - 1)))
+        if retry_after:
+            try:
+                delay = min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass  # HTTP-date form: jittered backoff
+        self.stats.inc_value('retry/backoff_count', spider=spider)
+        self.stats.inc_value('retry/backoff_seconds', round(delay, 3), spider=spider)
+        result.meta['not_before'] = time.time() + delay
+        return result
+
+
 class PriceComparatorDownloaderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
     # scrapy acts as if the downloader middleware does not modify the
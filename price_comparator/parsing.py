@@ -0,0 +1,218 @@
+"""
+HTML extraction in a pool of worker processes.
+
+At high concurrency the reactor thread spends most of its time in lxml/parsel
+parsing listing pages (about 600 KB each on Tunisianet), and downloads starve.
+With PARSE_POOL_WORKERS set, the heavy parse callbacks send the raw body to a
+pool of worker processes running the extraction functions of this module,
+which return plain tuples; the reactor only builds the items and requests.
+Pages smaller than PARSE_POOL_MIN_BYTES are parsed inline, where the
+round-trip to a worker would cost more than the parsing.
+
+The extraction functions only depend on parsel, so that workers import little.
+Pool usage is reported in the crawl stats when the spider closes:
+parse_pool/tasks, parse_pool/inline, parse_pool/queue_wait_avg_ms,
+parse_pool/queue_wait_max_ms, parse_pool/busy_seconds,
+parse_pool/utilization_pct (busy time over workers x time the pools ran) and
+parse_pool/restarts. A pool broken by a dead worker (e.g. killed for lack of
+memory) is replaced, up to MAX_RESTARTS times, then pages are parsed inline;
+busy time and pool time add up over the successive pools.
+
+    scrapy crawl tunisianet -s PARSE_POOL_WORKERS=4
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from parsel import Selector
+
+logger = logging.getLogger(__name__)
+
+# Fields of a product of a listing page, in the order of the tuples returned by the extraction functions
+LISTING_FIELDS = ('Url', 'productname', 'reference', 'description', 'price', 'brand', 'availability', 'imageUrl')
+
+
+def _parse_price(price_text):
+    """Price of a listing ("1 234,567 DT"), None when it cannot be parsed"""
+    price_cleaned = price_text.replace("DT", "").replace("\xa0", "").replace(" ", "").replace(",", ".").strip()
+    try:
+        return float(price_cleaned)
+    except ValueError:
+        return None
+
+
+def tunisianet_listing(body, encoding):
+    """
+    Products of a Tunisianet category page.
+    Returns (product tuples (LISTING_FIELDS), next page URL or None, warnings).
+    """
+    selector = Selector(text=body.decode(encoding, errors='replace'))
+    products = []
+    warnings = []
+
+    for article in selector.css("article.product-miniature.js-product-miniature"):
+        try:
+            url = article.css("h2.product-title a::attr(href)").get()
+            if not url:
+                continue  # Skip if no URL
+
+            productname = article.css("h2.product-title a::text").get()
+            reference = article.css("span.product-reference::text").get()
+            description = article.css('div[itemprop="description"]').get()
+
+            price = 0.0
+            price_text = article.css("span.price::text").get()
+            if price_text:
+                price = _parse_price(price_text)
+                if price is None:
+                    warnings.append(f"Could not parse price: {price_text}")
+                    price = 0.0
+
+            brand = article.css("img.manufacturer-logo::attr(alt)").get()
+            # Try multiple selectors for stock availability
+            availability = (
+                article.css("div#stock_availability span::text").get()
+                or article.css("span.in-stock::text").get()
+                or article.css("span.out-of-stock::text").get()
+            )
+            image_url = (
+                article.css("img.center-block.img-responsive::attr(data-full-size-image-url)").get()
+                or article.css("img.center-block.img-responsive::attr(src)").get()
+            )
+
+            products.append((
+                url.strip(),
+                productname.strip() if productname else "",
+                reference.replace("[", "").replace("]", "").strip() if reference else "",
+                description.strip() if description else "",
+                price,
+                brand.strip() if brand else "Unknown",
+                availability.strip() if availability else "Unknown",
+                image_url.strip() if image_url else "",
+            ))
+        except Exception as e:
+            warnings.append(f"Error parsing product in article: {e}")
+
+    next_page = selector.css("a.next.js-search-link::attr(href)").get()
+    return products, next_page, warnings
+
+
+def _timed(function, args):
+    """Run in a worker: result of `function` with its start and end time"""
+    started = time.time()
+    result = function(*args)
+    return started, time.time(), result
+
+
+MAX_RESTARTS = 3  # Broken pools replaced before parsing inline for the rest of the crawl
+
+
+class ParsePool:
+    """Process pool running extraction functions, with inline fallback for small pages"""
+
+    def __init__(self, workers, min_bytes, stats=None):
+        self.workers = workers
+        self.min_bytes = min_bytes
+        self.stats = stats
+        self.executor = None
+        self.started = None
+        self.pool_seconds = 0.0  # Workers x lifetime of the pools already shut down
+        self.restarts = 0
+        self.tasks = 0
+        self.inline = 0
+        self.busy_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self.queue_wait_max = 0.0
+
+    def _executor(self):
+        if self.executor is None:
+            # spawn: the reactor process runs threads (MongoDB client...) that must not be forked
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            self.started = time.monotonic()
+            logger.info(f"Started a parse pool of {self.workers} processes")
+        return self.executor
+
+    def _shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+        self.pool_seconds += self.workers * (time.monotonic() - self.started)
+
+    def _broken(self, executor, error):
+        """Replace the broken pool, or parse inline once MAX_RESTARTS is reached"""
+        if executor is not self.executor:
+            return  # Another task already handled this pool
+        self._shutdown()
+        if self.restarts < MAX_RESTARTS:
+            self.restarts += 1
+            logger.error(f"Parse pool broken, starting a new one ({self.restarts}/{MAX_RESTARTS}): {error}")
+        else:
+            logger.error(f"Parse pool broken, parsing inline from now on: {error}")
+            self.workers = 0
+
+    async def run(self, function, response):
+        """Result of function(body, encoding) for `response`, in a worker for large pages"""
+        args = (response.body, response.encoding)
+        if not self.workers or len(response.body) < self.min_bytes:
+            self.inline += 1
+            return function(*args)
+
+        submitted = time.time()
+        executor = self._executor()
+        try:
+            future = executor.submit(_timed, function, args)
+            started, finished, result = await asyncio.wrap_future(future)
+        except BrokenProcessPool as e:
+            self._broken(executor, e)
+            self.inline += 1
+            return function(*args)
+
+        self.tasks += 1
+        wait = max(started - submitted, 0.0)
+        self.queue_wait_seconds += wait
+        self.queue_wait_max = max(self.queue_wait_max, wait)
+        self.busy_seconds += finished - started
+        return result
+
+    def close(self):
+        if self.executor is not None:
+            self._shutdown()
+        utilization = 100 * self.busy_seconds / self.pool_seconds if self.pool_seconds > 0 else 0.0
+        summary = {
+            'parse_pool/tasks': self.tasks,
+            'parse_pool/inline': self.inline,
+            'parse_pool/queue_wait_avg_ms': round(1000 * self.queue_wait_seconds / self.tasks, 2) if self.tasks else 0.0,
+            'parse_pool/queue_wait_max_ms': round(1000 * self.queue_wait_max, 2),
+            'parse_pool/busy_seconds': round(self.busy_seconds, 3),
+            'parse_pool/utilization_pct': round(utilization, 1),
+            'parse_pool/restarts': self.restarts,
+        }
+        if self.stats is not None:
+            for key, value in summary.items():
+                self.stats.set_value(key, value)
+        if self.tasks:
+            logger.info(f"Parse pool: {self.tasks} pages in workers, {self.inline} inline, "
+                        f"average queue wait {summary['parse_pool/queue_wait_avg_ms']} ms, "
+                        f"utilization {summary['parse_pool/utilization_pct']}%")
+
+
+_parse_pools = weakref.WeakKeyDictionary()
+
+
+def parse_pool(crawler):
+    """The ParsePool of a crawler (inline parsing only unless PARSE_POOL_WORKERS is set)"""
+    if crawler not in _parse_pools:
+        from scrapy import signals
+
+        pool = ParsePool(
+            crawler.settings.getint('PARSE_POOL_WORKERS', 0),
+            crawler.settings.getint('PARSE_POOL_MIN_BYTES', 65536),
+            crawler.stats,
+        )
+        crawler.signals.connect(lambda spider, reason: pool.close(), signal=signals.spider_closed, weak=False)
+        _parse_pools[crawler] = pool
+    return _parse_pools[crawler]
@@ -1,11 +1,86 @@
 import pymongo
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from scrapy.utils.job import job_dir
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 import logging
+import os
+import threading
+import time
+
+from price_comparator.dataversion import bump_data_version
+from price_comparator.dupefilters import PRODUCTS_SEEN_FILE
+from price_comparator.extensions import crawl_profiler, pipeline_write_seconds
+from price_comparator.facets import rebuild_facet_catalog
+from price_comparator.rollups import RollupStore
+from price_comparator.signals import products_unchanged
+from price_comparator.trigram import TrigramIndex
 
 logger = logging.getLogger(__name__)
 
 
+def last_modification_fields(modification):
+    """
+    Materialized fields describing the latest modification of a product:
+    - LastModified: date of the latest modification
+    - LastPrice: price before the latest modification
+    - LastChangePct: price change of the latest modification, in percent
+    They are None for products that were never modified.
+    """
+    if not modification:
+        return {'LastModified': None, 'LastPrice': None, 'LastChangePct': None}
+
+    old_price = modification.get('oldPrice')
+    new_price = modification.get('newPrice')
+    change_pct = None
+    if isinstance(old_price, (int, float)) and isinstance(new_price, (int, float)) and old_price:
+        change_pct = round((new_price - old_price) / old_price * 100, 2)
+
+    return {
+        'LastModified': modification.get('dateModification'),
+        'LastPrice': old_price,
+        'LastChangePct': change_pct,
+    }
+
+
+class SharedClient:
+    """MongoClient shared by the pipelines of a process, with the collections already indexed"""
+
+    def __init__(self, uri):
+        self.client = pymongo.MongoClient(uri)
+        self.users = 0
+        self.indexed = set()
+
+
+# One client (connection pool) per URI: the spiders run concurrently by
+# price_comparator.runner share it, and create the indexes once
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def acquire_client(uri):
+    with _shared_clients_lock:
+        shared = _shared_clients.get(uri)
+        if shared is None:
+            shared = _shared_clients[uri] = SharedClient(uri)
+        shared.users += 1
+        return shared
+
+
+def release_client(uri):
+    """Close the shared client of `uri` once its last pipeline releases it"""
+    with _shared_clients_lock:
+        shared = _shared_clients.get(uri)
+        if shared is None:
+            return
+        shared.users -= 1
+        if shared.users <= 0:
+            del _shared_clients[uri]
+            shared.client.close()
+
+
 class ProductPipeline:
     """
     Unified pipeline for all stores that matches the Flask API database schema.
@@ -17,20 +92,82 @@ class ProductPipeline:
     DATABASE_NAME = "product_comparator"
     COLLECTION_NAME = "products"
 
+    # Bump the API data version at most this often (seconds) while a crawl writes changes,
+    # and once more when the spider closes
+    DATA_VERSION_INTERVAL = 300
+
+    # "single": read and write each product as it arrives.
+    # "bulk": buffer BATCH_SIZE products, read them with one query and write them
+    # with one bulk write (unchanged products are not rewritten).
+    # Set with the PIPELINE_WRITE_MODE / PIPELINE_BATCH_SIZE settings.
+    WRITE_MODE = "single"
+    BATCH_SIZE = 500
+
+    # CrawlProfiler sampling a share of the process_item calls (PROFILE_PERCENT setting)
+    profiler = None
+
     def __init__(self):
-        self.client = pymongo.MongoClient(self.MONGO_URI)
+        self.shared_client = acquire_client(self.MONGO_URI)
+        self.client = self.shared_client.client
         self.db = self.client[self.DATABASE_NAME]
         self.collection = self.db[self.COLLECTION_NAME]
 
-        # Create indexes for better performance
-        self.collection.create_index("Ref", unique=True)
-        self.collection.create_index("Brand")
-        self.collection.create_index("Category")
-        self.collection.create_index("DateAjout")
+        # Trigram index used by the API fuzzy search
+        self.trigram_index = TrigramIndex(self.db)
+
+        # Daily counters read by the API statistics endpoints
+        self.rollups = RollupStore(self.db)
+
+        indexes_key = (self.DATABASE_NAME, self.COLLECTION_NAME)
+        if indexes_key not in self.shared_client.indexed:
+            # Create indexes for better performance
+            self.collection.create_index("Ref", unique=True)
+            self.collection.create_index("Brand")
+            self.collection.create_index("Category")
+            self.collection.create_index("DateAjout")
+            self.collection.create_index("LastModified")
+            self.collection.create_index("LastChangePct")
+            self.collection.create_index("LastSeen")
+            self.trigram_index.ensure_indexes()
+            self.rollups.ensure_indexes()
+            self.shared_client.indexed.add(indexes_key)
+
+        # Products buffered by the bulk write mode
+        self.batch = []
+        self.batch_refs = set()
+        self.spider_name = None
+
+        # Refs of the products seen by the crawl, whose LastSeen is updated in bulk
+        self.seen_refs = []
+
+        # Pending changes not yet published through the data version
+        self.pending_changes = 0
+        self.crawl_changes = 0
+        self.last_version_bump = time.monotonic()
 
         logger.info(f"Connected to MongoDB: {self.DATABASE_NAME}.{self.COLLECTION_NAME}")
 
+    @classmethod
+    def from_crawler(cls, crawler):
+        pipeline = cls()
+        pipeline.profiler = crawl_profiler(crawler)
+        pipeline.WRITE_MODE = crawler.settings.get('PIPELINE_WRITE_MODE', cls.WRITE_MODE)
+        pipeline.BATCH_SIZE = crawler.settings.getint('PIPELINE_BATCH_SIZE', cls.BATCH_SIZE)
+        if pipeline.WRITE_MODE not in ('single', 'bulk'):
+            raise ValueError(f"Unknown PIPELINE_WRITE_MODE: {pipeline.WRITE_MODE}")
+        crawler.signals.connect(pipeline.products_unchanged, signal=products_unchanged)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.spider_name = spider.name
+
     def process_item(self, item, spider):
+        if self.profiler is not None and self.profiler.sampled():
+            with self.profiler.capture(f"{spider.name}.process_item"):
+                return self.store_item(item, spider)
+        return self.store_item(item, spider)
+
+    def store_item(self, item, spider):
         """Process and store item using upsert logic"""
         adapter = ItemAdapter(item)
 
@@ -40,13 +177,53 @@ class ProductPipeline:
 
             # Prepare product data matching Flask API schema
             product_data = self._prepare_product_data(adapter, store_name)
+            self.touch([product_data['Ref']])
+
+            if self.WRITE_MODE == 'bulk':
+                self.add_to_batch(product_data)
+                return item
 
             # Store or update in database
-            self.upsert_product(product_data, adapter)
+            started = time.perf_counter()
+            changed = self.upsert_product(product_data, adapter)
+            pipeline_write_seconds.labels(spider.name).observe(time.perf_counter() - started)
+            if changed:
+                self.pending_changes += 1
+                self.crawl_changes += 1
+                if time.monotonic() - self.last_version_bump >= self.DATA_VERSION_INTERVAL:
+                    self.publish_changes()
 
         return item
 
-    def _get_store_name(self, spider_name):
+    def products_unchanged(self, spider, refs):
+        """Products of pages unchanged since the previous crawl, not parsed (see RevalidationSpiderMiddleware)"""
+        self.touch(refs)
+
+    def touch(self, refs):
+        """Record that the crawl saw these products, LastSeen is updated BATCH_SIZE products at a time"""
+        self.seen_refs.extend(refs)
+        if len(self.seen_refs) >= self.BATCH_SIZE:
+            self.flush_last_seen()
+
+    def flush_last_seen(self):
+        """Set LastSeen of the products seen since the last call, with one update"""
+        if not self.seen_refs:
+            return
+        refs, self.seen_refs = self.seen_refs, []
+        # Not a data change: the data version is not bumped
+        result = self.collection.update_many({'Ref': {'$in': refs}}, {'$set': {'LastSeen': datetime.now()}})
+        logger.debug(f"Updated LastSeen of {result.modified_count} products")
+
+    def publish_changes(self):
+        """Bump the data version so API caches drop results computed before these writes"""
+        if self.pending_changes:
+            version = bump_data_version(self.db)
+            logger.info(f"Published {self.pending_changes} product changes (data version {version})")
+            self.pending_changes = 0
+        self.last_version_bump = time.monotonic()
+
+    @staticmethod
+    def _get_store_name(spider_name):
         """Get store name from spider name"""
         store_mapping = {
             'tunisianet': 'Tunisianet',
@@ -67,6 +244,7 @@ class ProductPipeline:
         - Stock: Stock status
         - DateAjout: Date added
         - Modifications: Array of modifications
+        - CategoryUrl: Category listing the product was found on (when the spider provides it)
         """
 
         # Parse price to float
@@ -96,7 +274,7 @@ class ProductPipeline:
         if description:
             description = description.strip()
 
-        return {
+        product_data = {
             'Ref': adapter.get('reference', '').strip(),
             'Designation': adapter.get('productname', '').strip(),
             'Description': description,
@@ -110,6 +288,12 @@ class ProductPipeline:
             'ImageUrl': adapter.get('imageUrl', ''),
         }
 
+        # Listing the product was found on, used by the recrawl scheduler for per-category change rates
+        if adapter.get('category_url'):
+            product_data['CategoryUrl'] = adapter.get('category_url')
+
+        return product_data
+
     def _parse_stock_status(self, availability):
         """Parse availability text to stock status"""
         if not availability:
@@ -155,6 +339,8 @@ class ProductPipeline:
             - Check if price or stock changed
             - If changed: Add modification entry to Modifications array
             - Update product fields
+
+        Returns True if the stored data changed.
         """
         ref = product_data['Ref']
 
@@ -166,46 +352,210 @@ class ProductPipeline:
             modifications = existing_product.get('Modifications', [])
 
             # Check if price or stock changed
-            price_changed = existing_product.get('Price') != product_data['Price']
-            stock_changed = existing_product.get('Stock') != product_data['Stock']
-
-            if price_changed or stock_changed:
-                # Create modification entry
-                modification = {
-                    'dateModification': datetime.now(),
-                    'oldPrice': existing_product.get('Price'),
-                    'newPrice': product_data['Price'],
-                    'oldStock': existing_product.get('Stock'),
-                    'newStock': product_data['Stock'],
-                }
+            modification = self._modification(existing_product, product_data)
 
+            if modification:
                 modifications.append(modification)
 
-                logger.info(f"Product {ref} modified - Price: {modification['oldPrice']} -> {modification['newPrice']}, "
-                          f"Stock: {modification['oldStock']} -> {modification['newStock']}")
+                # Scalar copy of the latest modification, used by the API for sorting and filtering
+                product_data.update(last_modification_fields(modification))
 
             # Update product with new data
             update_data = {
-                '$set': product_data,
-                '$set': {'Modifications': modifications}
+                '$set': {**product_data, 'Modifications': modifications}
             }
 
-            self.collection.update_one({'Ref': ref}, update_data)
+            result = self.collection.update_one({'Ref': ref}, update_data)
             logger.info(f"Updated product: {ref}")
 
+            if modification:
+                self.rollups.record_modification(existing_product, modification)
+
+            # Keep the fuzzy search index in sync when the name changes
+            if existing_product.get('Designation') != product_data['Designation']:
+                self.trigram_index.index_product(product_data)
+
+            return result.modified_count > 0
+
         else:
             # New product - insert with DateAjout
             product_data['DateAjout'] = datetime.now()
+            product_data['LastSeen'] = product_data['DateAjout']
             product_data['Modifications'] = []
+            product_data.update(last_modification_fields(None))
 
             self.collection.insert_one(product_data)
             logger.info(f"Inserted new product: {ref}")
 
+            self.trigram_index.index_product(product_data)
+            self.rollups.record_insert(product_data)
+
+            return True
+
+    def _modification(self, existing_product, product_data):
+        """Modification entry when the price or stock of a product changed, None otherwise"""
+        price_changed = existing_product.get('Price') != product_data['Price']
+        stock_changed = existing_product.get('Stock') != product_data['Stock']
+        if not (price_changed or stock_changed):
+            return None
+
+        modification = {
+            'dateModification': datetime.now(),
+            'oldPrice': existing_product.get('Price'),
+            'newPrice': product_data['Price'],
+            'oldStock': existing_product.get('Stock'),
+            'newStock': product_data['Stock'],
+        }
+        logger.info(f"Product {product_data['Ref']} modified - Price: {modification['oldPrice']} -> {modification['newPrice']}, "
+                    f"Stock: {modification['oldStock']} -> {modification['newStock']}")
+        return modification
+
+    def add_to_batch(self, product_data):
+        """Bulk write mode: buffer a product, writing the batch once full"""
+        if not product_data['Ref']:
+            return
+        if product_data['Ref'] in self.batch_refs:
+            # Same product twice in a batch: its second version must see the first one
+            self.flush()
+        self.batch.append(product_data)
+        self.batch_refs.add(product_data['Ref'])
+        if len(self.batch) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Bulk write mode: write the buffered products with the same logic as
+        upsert_product(), using one read and one bulk write per collection.
+        """
+        if not self.batch:
+            return
+        batch, self.batch, self.batch_refs = self.batch, [], set()
+        started = time.perf_counter()
+
+        existing_products = {
+            product['Ref']: product
+            for product in self.collection.find({'Ref': {'$in': [p['Ref'] for p in batch]}},
+                                                {'Modifications': 0})
+        }
+
+        operations = []
+        rollup_changes = []
+        reindexed = []
+        inserted = modified = 0
+        for product_data in batch:
+            existing_product = existing_products.get(product_data['Ref'])
+
+            if existing_product is None:
+                product_data['DateAjout'] = datetime.now()
+                product_data['LastSeen'] = product_data['DateAjout']
+                product_data['Modifications'] = []
+                product_data.update(last_modification_fields(None))
+                operations.append(InsertOne(product_data))
+                rollup_changes.extend(self.rollups.insert_increments(product_data))
+                reindexed.append(product_data)
+                inserted += 1
+                continue
+
+            modification = self._modification(existing_product, product_data)
+            if modification:
+                product_data.update(last_modification_fields(modification))
+                operations.append(UpdateOne({'Ref': product_data['Ref']},
+                                            {'$set': product_data, '$push': {'Modifications': modification}}))
+                rollup_changes.extend(self.rollups.modification_increments(existing_product, modification))
+                modified += 1
+            elif any(existing_product.get(field) != value for field, value in product_data.items()):
+                # Name, URL, description... changed without a price or stock change
+                operations.append(UpdateOne({'Ref': product_data['Ref']}, {'$set': product_data}))
+
+            if existing_product.get('Designation') != product_data['Designation']:
+                reindexed.append(product_data)
+
+        changed = 0
+        if operations:
+            try:
+                result = self.collection.bulk_write(operations, ordered=False)
+                changed = result.inserted_count + result.modified_count
+            except BulkWriteError as e:
+                details = e.details
+                changed = details.get('nInserted', 0) + details.get('nModified', 0)
+                logger.error(f"Bulk write failed for {len(details.get('writeErrors', []))} products: "
+                             f"{details.get('writeErrors', [])[:3]}")
+        self.rollups.apply_increments(rollup_changes)
+        self.trigram_index.index_products(reindexed)
+
+        pipeline_write_seconds.labels(self.spider_name).observe(time.perf_counter() - started)
+        logger.info(f"Wrote {len(batch)} products: {inserted} new, {modified} modified, "
+                    f"{len(batch) - len(operations)} unchanged")
+
+        if changed:
+            self.pending_changes += changed
+            self.crawl_changes += changed
+            if time.monotonic() - self.last_version_bump >= self.DATA_VERSION_INTERVAL:
+                self.publish_changes()
+
     def close_spider(self, spider):
-        """Close MongoDB connection when spider closes"""
-        self.client.close()
+        """Refresh derived data, publish remaining changes and close MongoDB connection when spider closes"""
+        self.flush()
+        self.flush_last_seen()
+        if self.crawl_changes:
+            # Facet values and counts are precomputed once per crawl for the /filter endpoint
+            rebuild_facet_catalog(self.db, self.COLLECTION_NAME)
+            # Make sure the API reloads the new catalog even if every change was already published
+            self.pending_changes = max(self.pending_changes, 1)
+        self.publish_changes()
+        self.close()
         logger.info(f"Closed MongoDB connection for spider: {spider.name}")
 
+    def close(self):
+        """Release the MongoDB client (closed once no other pipeline of the process uses it)"""
+        release_client(self.MONGO_URI)
+
+
+class DuplicateProduct(DropItem):
+    """A product already scraped during the crawl (logged at DEBUG, see price_comparator.logformatter)"""
+
+
+class DuplicateProductPipeline:
+    """
+    Drop the products already scraped during the crawl, keyed by (Company, Ref):
+    a product listed in several categories is written to MongoDB and exported
+    once. Runs before ProductPipeline; dropped duplicates are counted in the
+    dedup/duplicate_items stat. With a JOBDIR, the seen refs are saved when
+    the spider closes so that a resumed crawl keeps dropping them.
+    """
+
+    def __init__(self, stats, jobdir=None):
+        self.stats = stats
+        self.seen = set()
+        self.company = None
+        self.seen_path = os.path.join(jobdir, PRODUCTS_SEEN_FILE) if jobdir else None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.stats, job_dir(crawler.settings))
+
+    def open_spider(self, spider):
+        self.company = ProductPipeline._get_store_name(spider.name)
+        if self.seen_path and os.path.exists(self.seen_path):
+            with open(self.seen_path, encoding='utf-8') as f:
+                self.seen.update((self.company, line.rstrip('\n')) for line in f if line.strip())
+
+    def close_spider(self, spider):
+        if self.seen_path:
+            with open(self.seen_path, 'w', encoding='utf-8') as f:
+                f.writelines(f"{ref}\n" for company, ref in self.seen)
+
+    def process_item(self, item, spider):
+        ref = (ItemAdapter(item).get('reference') or '').strip()
+        if not ref:
+            return item
+        key = (self.company, ref)
+        if key in self.seen:
+            self.stats.inc_value('dedup/duplicate_items', spider=spider)
+            raise DuplicateProduct(f"Duplicate product {self.company} {ref}")
+        self.seen.add(key)
+        return item
+
 
 # Legacy pipelines for backward compatibility (can be removed if not needed)
 class TunisianetPipeline(ProductPipeline):
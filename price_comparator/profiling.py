@@ -0,0 +1,164 @@
+"""
+Sampling profiler shared by the API (profiling of a single request) and the
+crawler (profiling of a share of spider callbacks and pipeline calls).
+
+A background thread reads the stack of the profiled thread every `interval`
+seconds (sys._current_frames) while a capture is active; nothing is traced,
+so the profiled code runs at full speed and the cost outside captures is nil.
+Stacks are aggregated in the "folded" format read by flamegraph.pl, speedscope
+and inferno:
+
+    parse_category;parse_category (tunisianet.py:63);css (selector.py:120) 42
+
+    profiler = SamplingProfiler()
+    with profiler.capture('parse_category'):
+        ...
+    profiler.write('profiles/tunisianet.folded')
+
+Request tokens (sign_profile_token/verify_profile_token) allow profiling an
+API request on demand without exposing the profiler to every client.
+"""
+
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from price_comparator.metrics import write_textfile
+
+DEFAULT_INTERVAL = 0.001  # Seconds between two samples
+PROFILE_TOKEN_TTL = 3600  # Seconds a signed profiling token stays valid
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, root=None):
+    """
+    Labels of the frames from the outermost to `frame`; when `root` (a frame)
+    is on the stack, only the frames called by it are kept.
+    """
+    labels = []
+    while frame is not None and frame is not root:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+class _Capture:
+    def __init__(self, profiler, label):
+        self.profiler = profiler
+        self.label = label
+
+    def __enter__(self):
+        # Frames above the caller (reactor, WSGI server...) are the same in every sample
+        self.profiler._begin(threading.get_ident(), sys._getframe(1), self.label)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._end()
+        return False
+
+
+class SamplingProfiler:
+    """
+    Aggregated folded stacks of the code run inside `capture()` blocks. One
+    capture is active at a time (a request, a callback step); nested captures
+    are ignored.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._target = None  # (thread id, root frame, label)
+        self._active = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def capture(self, label='profile'):
+        return _Capture(self, label)
+
+    def _begin(self, thread_id, root, label):
+        with self._lock:
+            if self._target is not None:
+                return
+            self._target = (thread_id, root, label)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        self._active.set()
+
+    def _end(self):
+        with self._lock:
+            if self._target is not None and self._target[0] == threading.get_ident():
+                self._target = None
+                self._active.clear()
+
+    def _run(self):
+        while not self._closed:
+            self._active.wait()
+            time.sleep(self.interval)
+            target = self._target
+            if target is None:
+                continue
+            thread_id, root, label = target
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack = ';'.join([label] + collapse_stack(frame, root))
+            with self._lock:
+                if self._target is target:
+                    self.stacks[stack] += 1
+                    self.samples += 1
+
+    def folded(self):
+        """Profile in folded format, one "frame;frame;frame count" line per stack"""
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def write(self, path):
+        write_textfile(path, self.folded())
+
+    def close(self):
+        self._closed = True
+        self._active.set()
+
+
+def profile_file_name(prefix):
+    """Unique profile file name, e.g. products-20241218-143045-123456.folded"""
+    safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in prefix.strip('/')) or 'root'
+    return f"{safe}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() // 1000 % 1000000:06d}.folded"
+
+
+def sign_profile_token(secret, path, expires=None):
+    """Token allowing to profile requests to `path` until `expires` (epoch seconds)"""
+    expires = int(expires or time.time() + PROFILE_TOKEN_TTL)
+    signature = hmac.new(secret.encode('utf-8'), f"{path}|{expires}".encode('utf-8'), hashlib.sha256)
+    return f"{expires}.{signature.hexdigest()}"
+
+
+def verify_profile_token(secret, path, token):
+    try:
+        expires, _ = token.split('.', 1)
+        expires = int(expires)
+    except (AttributeError, ValueError):
+        return False
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign_profile_token(secret, path, expires), token)
+
+
+if __name__ == '__main__':
+    # python -m price_comparator.profiling <secret> /products  ->  profiling token
+    if len(sys.argv) != 3:
+        sys.exit('usage: python -m price_comparator.profiling SECRET PATH')
+    print(sign_profile_token(sys.argv[1], sys.argv[2]))
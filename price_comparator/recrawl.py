@@ -0,0 +1,456 @@
+"""
+Recrawl scheduler: crawl each category as often as its products change.
+
+A schedule unit is a (store, category URL) pair; every store also has a "full"
+unit (category URL "") crawling its whole catalog, which discovers new
+categories and products. Stores whose spider cannot crawl single categories
+(`categories: False` in RECRAWL_STORES) only have the full unit.
+
+Every RECRAWL_RATE_REFRESH seconds the change rate of each unit (changes per
+product per day) is measured from the Modifications of the last
+RECRAWL_RATE_WINDOW_DAYS days, and its recrawl interval set so that about
+RECRAWL_TARGET_CHANGE_FRACTION of its products changed since the last crawl:
+
+    interval = target fraction / change rate, within [min, max]
+
+Full units of stores with category crawls run every RECRAWL_FULL_INTERVAL.
+New units are staggered over their first interval and every next run gets a
++/- RECRAWL_JITTER offset, so categories do not all fall due at once.
+
+Due units of a store are crawled together by one runner process
+(python -m price_comparator.runner <store> -a categories=...), within budgets:
+- at most RECRAWL_MAX_CONCURRENT_CRAWLS processes, one per store;
+- requests per hour, globally and per domain, counted from the runs of the
+  last hour (the estimate of a run is the requests of the previous run of
+  its units).
+
+The schedule (crawl_schedule collection) and the run history (crawl_runs) are
+kept in MongoDB, so the service picks up where it stopped after a restart.
+
+    python -m price_comparator.recrawl            # run the scheduler service
+    python -m price_comparator.recrawl --once     # one scheduling pass
+    python -m price_comparator.recrawl --status   # print the schedule
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from bson import ObjectId
+from pymongo import MongoClient
+from scrapy.utils.log import configure_logging
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_COLLECTION = "crawl_schedule"
+RUNS_COLLECTION = "crawl_runs"
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_WINDOW = timedelta(hours=1)
+
+
+def unit_id(store, category_url):
+    return f"{store}|{category_url}"
+
+
+def stable_fraction(key):
+    """Pseudo-random number in [0, 1) derived from `key`"""
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32
+
+
+def jittered(unit, last_run, interval, jitter):
+    """
+    Next run of a unit: `interval` seconds after `last_run`, offset by up to
+    +/- `jitter` (a fraction), stable for a given unit and last run.
+    """
+    fraction = stable_fraction(f"{unit}|{last_run.isoformat()}")
+    return last_run + timedelta(seconds=interval * (1 + jitter * (2 * fraction - 1)))
+
+
+class RecrawlScheduler:
+    """Schedule state in MongoDB and the runner processes it launched"""
+
+    def __init__(self, db, settings):
+        self.schedule = db[SCHEDULE_COLLECTION]
+        self.runs = db[RUNS_COLLECTION]
+        self.products = db[settings.get('MONGO_COLLECTION', 'products')]
+        self.settings = settings
+        self.stores = settings.getdict('RECRAWL_STORES')
+        self.target_fraction = settings.getfloat('RECRAWL_TARGET_CHANGE_FRACTION')
+        self.min_interval = settings.getint('RECRAWL_MIN_INTERVAL')
+        self.max_interval = settings.getint('RECRAWL_MAX_INTERVAL')
+        self.default_interval = settings.getint('RECRAWL_DEFAULT_INTERVAL')
+        self.full_interval = settings.getint('RECRAWL_FULL_INTERVAL')
+        self.window_days = settings.getint('RECRAWL_RATE_WINDOW_DAYS')
+        self.rate_refresh = settings.getint('RECRAWL_RATE_REFRESH')
+        self.jitter = settings.getfloat('RECRAWL_JITTER')
+        self.retry_delay = settings.getint('RECRAWL_RETRY_DELAY')
+        self.max_concurrent = settings.getint('RECRAWL_MAX_CONCURRENT_CRAWLS')
+        self.max_categories = settings.getint('RECRAWL_MAX_CATEGORIES_PER_RUN')
+        self.requests_per_hour = settings.getint('RECRAWL_REQUESTS_PER_HOUR')
+        self.domain_requests_per_hour = settings.getint('RECRAWL_DOMAIN_REQUESTS_PER_HOUR')
+        self.run_dir = settings.get('RECRAWL_RUN_DIR')
+        self.domains = self._store_domains(settings)
+        self.processes = {}  # run id -> Popen
+        self.last_refresh = None
+
+    def _store_domains(self, settings):
+        """Domain of each store, from the start URL of its spider"""
+        spider_loader = load_object(settings['SPIDER_LOADER_CLASS']).from_settings(settings.frozencopy())
+        domains = {}
+        for store in self.stores:
+            start_urls = getattr(spider_loader.load(store), 'start_urls', None) or []
+            domains[store] = (urlparse(start_urls[0]).hostname if start_urls else None) or store
+        return domains
+
+    def ensure_indexes(self):
+        self.schedule.create_index([('store', 1), ('next_run', 1)])
+        self.runs.create_index("started")
+
+    # ==================== Change rates ====================
+
+    def interval(self, products, changes):
+        """Recrawl interval (seconds) of a unit from its recent changes"""
+        if not products:
+            return self.default_interval
+        rate = changes / products / self.window_days
+        if rate <= 0:
+            return self.max_interval
+        return int(min(max(self.target_fraction / rate * 86400, self.min_interval), self.max_interval))
+
+    def change_counts(self, company, now):
+        """CategoryUrl -> (products, changes in the rate window) for one Company"""
+        since = now - timedelta(days=self.window_days)
+        pipeline = [
+            {'$match': {'Company': company}},
+            {'$project': {
+                'CategoryUrl': 1,
+                'changes': {'$size': {'$filter': {
+                    'input': {'$ifNull': ['$Modifications', []]},
+                    'as': 'modification',
+                    'cond': {'$gte': ['$$modification.dateModification', since]},
+                }}},
+            }},
+            {'$group': {'_id': '$CategoryUrl', 'products': {'$sum': 1}, 'changes': {'$sum': '$changes'}}},
+        ]
+        return {row['_id']: (row['products'], row['changes']) for row in self.products.aggregate(pipeline)}
+
+    def refresh_units(self, now):
+        """Recompute the change rate and interval of every unit, adding new categories"""
+        for store, config in self.stores.items():
+            counts = self.change_counts(config['company'], now)
+            total_products = sum(products for products, _ in counts.values())
+            total_changes = sum(changes for _, changes in counts.values())
+
+            with_categories = config.get('categories', False)
+            units = {'': (total_products, total_changes,
+                          self.full_interval if with_categories else self.interval(total_products, total_changes))}
+            if with_categories:
+                for category_url, (products, changes) in counts.items():
+                    if category_url:
+                        units[category_url] = (products, changes, self.interval(products, changes))
+
+            for category_url, (products, changes, interval) in units.items():
+                self._update_unit(store, category_url, products, changes, interval, now)
+
+            # Categories no longer holding any product
+            self.schedule.delete_many({'store': store, 'category_url': {'$nin': list(units)}, 'running': None})
+
+        self.last_refresh = now
+        logger.info(f"Refreshed change rates of {self.schedule.count_documents({})} schedule units")
+
+    def _update_unit(self, store, category_url, products, changes, interval, now):
+        _id = unit_id(store, category_url)
+        unit = self.schedule.find_one({'_id': _id})
+        fields = {
+            'products': products,
+            'changes': changes,
+            'change_rate': round(changes / products / self.window_days, 5) if products else None,
+            'interval': interval,
+        }
+
+        if unit is None:
+            # Spread the first runs of new units over their interval (the full unit of an empty store runs now)
+            offset = 0 if not category_url and not products else interval * stable_fraction(_id)
+            self.schedule.insert_one({
+                '_id': _id,
+                'store': store,
+                'category_url': category_url,
+                'full': not category_url,
+                'next_run': now + timedelta(seconds=offset),
+                'last_run': None,
+                'last_status': None,
+                'last_requests': None,
+                'running': None,
+                **fields,
+            })
+            return
+
+        if unit.get('last_run') and unit.get('last_status') == 'ok' and unit.get('interval') != interval:
+            fields['next_run'] = jittered(_id, unit['last_run'], interval, self.jitter)
+        self.schedule.update_one({'_id': _id}, {'$set': fields})
+
+    # ==================== Budgets ====================
+
+    def requests_used(self, now):
+        """(requests of the last hour, {domain: requests}) of finished and running crawls"""
+        used = 0
+        per_domain = {}
+        for run in self.runs.find({'$or': [{'started': {'$gte': now - BUDGET_WINDOW}}, {'status': 'running'}]}):
+            requests = run.get('requests')
+            if requests is None:
+                requests = run.get('estimated_requests', 0)
+            used += requests
+            per_domain[run['domain']] = per_domain.get(run['domain'], 0) + requests
+        return used, per_domain
+
+    @staticmethod
+    def estimated_requests(unit):
+        """Requests of the previous crawl of a unit, or about one per product and listing page"""
+        if unit.get('last_requests'):
+            return unit['last_requests']
+        return int((unit.get('products') or 0) * 1.05) + 1
+
+    # ==================== Runs ====================
+
+    def due_runs(self, now):
+        """(store, units, estimated requests) to launch now, within concurrency and request budgets"""
+        running_stores = {run['store'] for run in self.runs.find({'status': 'running'}, {'store': 1})}
+        slots = self.max_concurrent - len(running_stores)
+        used, per_domain = self.requests_used(now)
+        launches = []
+
+        for store in self.stores:
+            if slots <= 0:
+                break
+            if store in running_stores:
+                continue
+            due = list(self.schedule.find({'store': store, 'next_run': {'$lte': now}, 'running': None})
+                       .sort('next_run', 1))
+            if not due:
+                continue
+
+            domain = self.domains[store]
+            remaining = min(self.requests_per_hour - used,
+                            self.domain_requests_per_hour - per_domain.get(domain, 0))
+            full = next((unit for unit in due if unit['full']), None)
+            candidates = [full] if full else due[:self.max_categories]
+
+            selected = []
+            estimated = 0
+            for unit in candidates:
+                cost = self.estimated_requests(unit)
+                if estimated + cost > remaining:
+                    break
+                selected.append(unit)
+                estimated += cost
+
+            if not selected:
+                logger.info(f"{store}: {len(due)} due units deferred, request budget exhausted "
+                            f"({remaining} requests left this hour for {domain})")
+                continue
+
+            launches.append((store, selected, estimated))
+            used += estimated
+            per_domain[domain] = per_domain.get(domain, 0) + estimated
+            slots -= 1
+        return launches
+
+    def launch(self, store, units, estimated, now, dry_run=False):
+        full = any(unit['full'] for unit in units)
+        categories = [] if full else [unit['category_url'] for unit in units]
+        run_id = ObjectId()
+        summary_path = os.path.join(self.run_dir, f"{run_id}.json")
+        command = [sys.executable, '-m', 'price_comparator.runner', store,
+                   '--summary-json', summary_path,
+                   '-s', f"LOG_FILE={os.path.join(self.run_dir, f'{run_id}.log')}"]
+        if categories:
+            command += ['-a', f"categories={','.join(categories)}"]
+
+        description = 'full catalog' if full else f"{len(categories)} categories"
+        if dry_run:
+            logger.info(f"[dry run] Would crawl {store} ({description}, ~{estimated} requests)")
+            return None
+
+        os.makedirs(self.run_dir, exist_ok=True)
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [PROJECT_DIR, env.get('PYTHONPATH')]))
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.processes[run_id] = process
+
+        self.runs.insert_one({
+            '_id': run_id,
+            'store': store,
+            'domain': self.domains[store],
+            'units': [unit['_id'] for unit in units],
+            'full': full,
+            'started': now,
+            'estimated_requests': estimated,
+            'requests': None,
+            'status': 'running',
+            'pid': process.pid,
+            'summary_path': summary_path,
+        })
+        self.schedule.update_many({'_id': {'$in': [unit['_id'] for unit in units]}}, {'$set': {'running': run_id}})
+        logger.info(f"Started crawl {run_id} of {store} ({description}, ~{estimated} requests, pid {process.pid})")
+        return run_id
+
+    def check_runs(self, now):
+        """Record the runs whose process exited"""
+        for run_id, process in list(self.processes.items()):
+            exit_code = process.poll()
+            if exit_code is None:
+                continue
+            del self.processes[run_id]
+            self.finish_run(run_id, exit_code, now)
+
+    def finish_run(self, run_id, exit_code, now, status=None):
+        run = self.runs.find_one({'_id': run_id})
+        summary = {}
+        try:
+            with open(run['summary_path'], encoding='utf-8') as f:
+                summary = json.load(f)['stores'][0]
+        except (OSError, ValueError, KeyError, IndexError):
+            pass
+
+        status = status or ('ok' if exit_code == 0 else 'failed')
+        requests = summary.get('requests', run['estimated_requests'])
+        self.runs.update_one({'_id': run_id}, {'$set': {
+            'status': status,
+            'exit_code': exit_code,
+            'finished': now,
+            'requests': requests,
+            'items': summary.get('items'),
+        }})
+
+        units = list(self.schedule.find({'running': run_id}))
+        for unit in units:
+            if status == 'ok':
+                update = {
+                    'last_run': run['started'],
+                    'last_status': 'ok',
+                    'last_requests': max(requests // len(units), 1),
+                    'next_run': jittered(unit['_id'], run['started'], unit['interval'], self.jitter),
+                }
+            else:
+                update = {'last_status': status, 'next_run': now + timedelta(seconds=self.retry_delay)}
+            self.schedule.update_one({'_id': unit['_id']}, {'$set': {**update, 'running': None}})
+
+        if status == 'ok' and run['full']:
+            # The full catalog crawl refreshed every category of the store
+            for unit in self.schedule.find({'store': run['store'], 'full': False, 'running': None}):
+                self.schedule.update_one({'_id': unit['_id']}, {'$set': {
+                    'last_run': run['started'],
+                    'last_status': 'ok',
+                    'next_run': jittered(unit['_id'], run['started'], unit['interval'], self.jitter),
+                }})
+
+        logger.info(f"Crawl {run_id} of {run['store']} {status} (exit code {exit_code}, "
+                    f"{requests} requests, {summary.get('items')} items)")
+
+    def recover(self, now):
+        """Runs left 'running' by a previous scheduler process cannot be followed: reschedule their units"""
+        for run in self.runs.find({'status': 'running', '_id': {'$nin': list(self.processes)}}):
+            logger.warning(f"Crawl {run['_id']} of {run['store']} was started by a previous scheduler, "
+                           f"marking it abandoned")
+            self.runs.update_one({'_id': run['_id']}, {'$set': {'status': 'abandoned', 'finished': now}})
+            self.schedule.update_many({'running': run['_id']}, {'$set': {'running': None}})
+
+    def run_once(self, now=None, dry_run=False):
+        """One scheduling pass: record finished runs, refresh change rates when due, launch due units"""
+        now = now or datetime.now()
+        self.check_runs(now)
+        if self.last_refresh is None or (now - self.last_refresh).total_seconds() >= self.rate_refresh:
+            self.refresh_units(now)
+        for store, units, estimated in self.due_runs(now):
+            self.launch(store, units, estimated, now, dry_run)
+
+    def stop(self, now=None):
+        """Terminate the running crawls (service shutdown); their units are rescheduled"""
+        now = now or datetime.now()
+        for run_id, process in list(self.processes.items()):
+            process.terminate()
+            try:
+                exit_code = process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                exit_code = process.wait()
+            del self.processes[run_id]
+            self.finish_run(run_id, exit_code, now, status='interrupted')
+
+    def serve(self, poll_interval):
+        stopping = []
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        self.ensure_indexes()
+        self.recover(datetime.now())
+        logger.info(f"Recrawl scheduler started for {', '.join(self.stores)}")
+        while not stopping:
+            try:
+                self.run_once()
+            except Exception as e:
+                # Keep the service alive through transient MongoDB errors
+                logger.exception(f"Scheduling pass failed: {e}")
+            for _ in range(int(poll_interval)):
+                if stopping:
+                    break
+                time.sleep(1)
+        logger.info("Stopping the recrawl scheduler")
+        self.stop()
+
+    def status_rows(self):
+        return list(self.schedule.find().sort([('store', 1), ('next_run', 1)]))
+
+
+def print_status(scheduler):
+    print(f"{'unit':<60}{'products':>9}{'chg/prod/day':>13}{'every':>8}  {'last run':<17}{'next run':<17}status")
+    for unit in scheduler.status_rows():
+        path = urlparse(unit['category_url']).path if unit['category_url'] else '(full catalog)'
+        label = f"{unit['store']} {path}"[:59]
+        rate = f"{unit['change_rate']:.4f}" if unit.get('change_rate') is not None else '-'
+        last_run = unit['last_run'].strftime('%Y-%m-%d %H:%M') if unit.get('last_run') else '-'
+        status = 'running' if unit.get('running') else (unit.get('last_status') or '-')
+        print(f"{label:<60}{unit['products']:>9}{rate:>13}{unit['interval'] / 3600:>7.1f}h  "
+              f"{last_run:<17}{unit['next_run'].strftime('%Y-%m-%d %H:%M'):<17}{status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Change-rate aware recrawl scheduler')
+    parser.add_argument('--once', action='store_true', help='Run one scheduling pass and exit')
+    parser.add_argument('--dry-run', action='store_true', help='Log the crawls that would start without starting them')
+    parser.add_argument('--status', action='store_true', help='Print the schedule and exit')
+    args = parser.parse_args(argv)
+
+    settings = get_project_settings()
+    configure_logging(settings)
+    client = MongoClient(settings.get('MONGO_URI'))
+    scheduler = RecrawlScheduler(client[settings.get('MONGO_DATABASE')], settings)
+
+    if args.status:
+        print_status(scheduler)
+    elif args.once or args.dry_run:
+        scheduler.ensure_indexes()
+        scheduler.recover(datetime.now())
+        scheduler.run_once(dry_run=args.dry_run)
+        # Wait for the crawls started by this pass
+        while scheduler.processes:
+            time.sleep(5)
+            scheduler.check_runs(datetime.now())
+    else:
+        scheduler.serve(settings.getint('RECRAWL_POLL_INTERVAL'))
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Revalidation of pages unchanged since the previous crawl.
+
+Most listing and detail pages are byte-identical between two daily crawls.
+For every page parsed successfully whose products were all scraped, PageStore
+keeps a compact record in a dbm file (<REVALIDATION_DIR>/<spider>): the ETag and Last-Modified validators of
+the response, a 16-byte hash of its body, the references of the products it
+yielded and the requests it followed that carry no product (pagination,
+category links). The next crawl sends conditional requests (If-None-Match /
+If-Modified-Since), and when the server answers 304 or the body hash did not
+change, RevalidationSpiderMiddleware skips the callback: it replays the
+recorded requests and sends the products_unchanged signal with the recorded
+references, which ProductPipeline turns into bulk LastSeen updates.
+
+Stats: revalidation/conditional_requests, revalidation/not_modified (304),
+revalidation/unchanged_body (same hash), revalidation/changed,
+revalidation/products_unchanged and revalidation/incomplete (pages not
+recorded for lack of some of their products). An empty REVALIDATION_DIR disables it.
+"""
+
+import dbm
+import hashlib
+import logging
+import os
+import pickle
+from collections import namedtuple
+
+from scrapy.utils.request import request_from_dict
+
+logger = logging.getLogger(__name__)
+
+# Request headers of the conditional requests, not recorded with the followed requests
+CONDITIONAL_HEADERS = (b'If-None-Match', b'If-Modified-Since')
+
+PageRecord = namedtuple('PageRecord', ['etag', 'last_modified', 'body_hash', 'refs', 'requests'])
+
+
+def body_hash(body):
+    """Hash of a response body stored instead of the body"""
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class PageStore:
+    """PageRecord of every parsed page of a spider, keyed by request fingerprint"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.db = dbm.open(path, 'c')
+
+    def get(self, fingerprint):
+        value = self.db.get(fingerprint)
+        if value is None:
+            return None
+        try:
+            return PageRecord(*pickle.loads(value))
+        except Exception as e:
+            logger.warning(f"Discarding unreadable revalidation record: {e}")
+            return None
+
+    def put(self, fingerprint, record):
+        self.db[fingerprint] = pickle.dumps(tuple(record), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return len(self.db)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def record_request(request, spider):
+        """A followed request in the form stored in a PageRecord"""
+        request_dict = request.to_dict(spider=spider)
+        request_dict['headers'] = {name: value for name, value in request_dict['headers'].items()
+                                   if name not in CONDITIONAL_HEADERS}
+        return request_dict
+
+    @staticmethod
+    def replay_requests(record, spider):
+        """Requests followed by the page of `record`"""
+        return [request_from_dict(request_dict, spider=spider) for request_dict in record.requests]
@@ -0,0 +1,302 @@
+"""
+Daily rollups of product activity, per day and per Company.
+
+The pipeline increments the counters as it writes, so /stats and
+/products/stats read about 30 small documents instead of unwinding every
+Modifications entry. Document layout (`daily_rollups` collection):
+
+    {
+        "_id": "2024-12-18|Tunisianet",
+        "day": "2024-12-18",
+        "Company": "Tunisianet",
+        "added": 12,              # products inserted that day
+        "modified": 40,           # distinct products modified that day
+        "modifications": 43,      # modification entries written that day
+        "price_up": 20,
+        "price_down": 18,
+        "new_stock": {"in_stock": 10, "on_order": 1, "out_of_stock": 1, "other": 0},
+        "modified_stock": {"in_stock": 30, "on_order": 2, "out_of_stock": 8, "other": 0}
+    }
+
+Stock splits follow the current stock of the products, like the queries they
+replace: when a product added or modified today changes stock again, it is
+moved from its old bucket to the new one.
+
+The catalog totals of each Company are kept up to date by the same writes, in
+one document without a day:
+
+    {
+        "_id": "catalog|Tunisianet",
+        "Company": "Tunisianet",
+        "products": 5230,
+        "stock": {"in_stock": 4100, "on_order": 230, "out_of_stock": 900, "other": 0}
+    }
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pymongo import ReplaceOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "daily_rollups"
+
+CATALOG_DAY = None  # "Day" of the catalog totals documents
+
+STOCK_BUCKETS = ['in_stock', 'on_order', 'out_of_stock', 'other']
+
+
+def day_key(date):
+    """Rollup day of a datetime, e.g. "2024-12-18" """
+    return date.strftime('%Y-%m-%d')
+
+
+def stock_bucket(stock):
+    """Map a Stock value to its rollup bucket (case-insensitive, like the API's ^in stock$ filters)"""
+    normalized = str(stock or '').strip().lower()
+    if normalized == 'in stock':
+        return 'in_stock'
+    if normalized == 'on order':
+        return 'on_order'
+    if normalized == 'out of stock':
+        return 'out_of_stock'
+    return 'other'
+
+
+def empty_stock_counts():
+    return {bucket: 0 for bucket in STOCK_BUCKETS}
+
+
+class RollupStore:
+    """Read and update the daily rollup counters"""
+
+    def __init__(self, db, collection_name=ROLLUP_COLLECTION):
+        self.collection = db[collection_name]
+
+    def ensure_indexes(self):
+        self.collection.create_index("day")
+
+    @staticmethod
+    def _update(day, company, increments):
+        if day is CATALOG_DAY:
+            return (
+                {'_id': f"catalog|{company}"},
+                {'$inc': increments, '$setOnInsert': {'Company': company}},
+            )
+        return (
+            {'_id': f"{day}|{company}"},
+            {'$inc': increments, '$setOnInsert': {'day': day, 'Company': company}},
+        )
+
+    def _increment(self, changes):
+        for day, company, increments in changes:
+            increments = {field: value for field, value in increments.items() if value}
+            if increments:
+                self.collection.update_one(*self._update(day, company, increments), upsert=True)
+
+    def record_insert(self, product):
+        """Count a newly inserted product"""
+        self._increment(self.insert_increments(product))
+
+    def record_modification(self, existing_product, modification):
+        """
+        Count a modification written for `existing_product` (the document
+        as it was before the update).
+        """
+        self._increment(self.modification_increments(existing_product, modification))
+
+    def apply_increments(self, changes):
+        """
+        Apply (day, company, increments) tuples, as listed by
+        insert_increments() and modification_increments(), in one bulk write.
+        """
+        merged = defaultdict(lambda: defaultdict(int))
+        for day, company, increments in changes:
+            for field, value in increments.items():
+                merged[(day, company)][field] += value
+
+        operations = []
+        for (day, company), increments in merged.items():
+            increments = {field: value for field, value in increments.items() if value}
+            if increments:
+                operations.append(UpdateOne(*self._update(day, company, increments), upsert=True))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def insert_increments(product):
+        """(day, company, increments) of the daily and catalog documents counting a new product"""
+        bucket = stock_bucket(product.get('Stock'))
+        return [
+            (day_key(product['DateAjout']), product.get('Company'), {'added': 1, f"new_stock.{bucket}": 1}),
+            (CATALOG_DAY, product.get('Company'), {'products': 1, f"stock.{bucket}": 1}),
+        ]
+
+    @staticmethod
+    def modification_increments(existing_product, modification):
+        """(day, company, increments) of the daily and catalog documents counting a modification"""
+        date = modification['dateModification']
+        day = day_key(date)
+        old_bucket = stock_bucket(modification.get('oldStock'))
+        new_bucket = stock_bucket(modification.get('newStock'))
+
+        increments = {'modifications': 1}
+
+        old_price = modification.get('oldPrice')
+        new_price = modification.get('newPrice')
+        if isinstance(old_price, (int, float)) and isinstance(new_price, (int, float)):
+            if new_price > old_price:
+                increments['price_up'] = 1
+            elif new_price < old_price:
+                increments['price_down'] = 1
+
+        last_modified = existing_product.get('LastModified')
+        if not isinstance(last_modified, datetime) or day_key(last_modified) != day:
+            # First modification of this product today
+            increments['modified'] = 1
+            increments[f"modified_stock.{new_bucket}"] = 1
+        elif old_bucket != new_bucket:
+            increments[f"modified_stock.{old_bucket}"] = -1
+            increments[f"modified_stock.{new_bucket}"] = 1
+
+        date_ajout = existing_product.get('DateAjout')
+        if isinstance(date_ajout, datetime) and day_key(date_ajout) == day and old_bucket != new_bucket:
+            # Added today and changed stock since: move it between the new-product buckets
+            increments[f"new_stock.{old_bucket}"] = -1
+            increments[f"new_stock.{new_bucket}"] = 1
+
+        changes = [(day, existing_product.get('Company'), increments)]
+        if old_bucket != new_bucket:
+            changes.append((CATALOG_DAY, existing_product.get('Company'),
+                            {f"stock.{old_bucket}": -1, f"stock.{new_bucket}": 1}))
+        return changes
+
+    def days(self, first_day, last_day=None):
+        """Rollup documents (every Company) from first_day to last_day included"""
+        day_query = {'$gte': first_day}
+        if last_day:
+            day_query['$lte'] = last_day
+        return list(self.collection.find({'day': day_query}))
+
+    def daily_totals(self, field, days=30):
+        """
+        Per-day totals of a counter over the last `days` days, summed over companies,
+        as [{'_id': 'YYYY-MM-DD', 'count': n}] sorted by day (days without activity omitted).
+        """
+        first_day = day_key(datetime.now() - timedelta(days=days))
+        totals = defaultdict(int)
+        for document in self.days(first_day):
+            totals[document['day']] += document.get(field, 0)
+        return [{'_id': day, 'count': count} for day, count in sorted(totals.items()) if count]
+
+    def day_summary(self, day):
+        """Counters of a single day summed over companies"""
+        summary = {
+            'added': 0,
+            'modified': 0,
+            'modifications': 0,
+            'price_up': 0,
+            'price_down': 0,
+            'new_stock': empty_stock_counts(),
+            'modified_stock': empty_stock_counts(),
+        }
+        for document in self.days(day, day):
+            for field in ['added', 'modified', 'modifications', 'price_up', 'price_down']:
+                summary[field] += document.get(field, 0)
+            for field in ['new_stock', 'modified_stock']:
+                for bucket, count in (document.get(field) or {}).items():
+                    summary[field][bucket] = summary[field].get(bucket, 0) + count
+        return summary
+
+    def catalog_summary(self):
+        """Catalog totals summed over companies: {'products': n, 'stock': {bucket: n}}"""
+        summary = {'products': 0, 'stock': empty_stock_counts()}
+        for document in self.collection.find({'_id': {'$regex': r'^catalog\|'}}):
+            summary['products'] += document.get('products', 0)
+            for bucket, count in (document.get('stock') or {}).items():
+                summary['stock'][bucket] = summary['stock'].get(bucket, 0) + count
+        return summary
+
+    def rebuild(self, products_collection):
+        """
+        Recompute every rollup document from the products collection.
+        Used to initialize the collection or after editing products outside the pipeline.
+        """
+        rollups = defaultdict(lambda: {
+            'added': 0,
+            'modified': 0,
+            'modifications': 0,
+            'price_up': 0,
+            'price_down': 0,
+            'new_stock': empty_stock_counts(),
+            'modified_stock': empty_stock_counts(),
+        })
+        catalogs = defaultdict(lambda: {'products': 0, 'stock': empty_stock_counts()})
+
+        cursor = products_collection.find(
+            {},
+            {'Company': 1, 'Stock': 1, 'DateAjout': 1, 'Modifications': 1}
+        )
+        for product in cursor:
+            company = product.get('Company')
+            catalogs[company]['products'] += 1
+            catalogs[company]['stock'][stock_bucket(product.get('Stock'))] += 1
+
+            date_ajout = product.get('DateAjout')
+            if isinstance(date_ajout, datetime):
+                rollup = rollups[(day_key(date_ajout), company)]
+                rollup['added'] += 1
+                rollup['new_stock'][stock_bucket(product.get('Stock'))] += 1
+
+            # Stock of the product at the end of each day it was modified
+            last_stock_per_day = {}
+            for modification in product.get('Modifications') or []:
+                date = modification.get('dateModification')
+                if not isinstance(date, datetime):
+                    continue
+                day = day_key(date)
+                rollup = rollups[(day, company)]
+                rollup['modifications'] += 1
+
+                old_price = modification.get('oldPrice')
+                new_price = modification.get('newPrice')
+                if isinstance(old_price, (int, float)) and isinstance(new_price, (int, float)):
+                    if new_price > old_price:
+                        rollup['price_up'] += 1
+                    elif new_price < old_price:
+                        rollup['price_down'] += 1
+
+                previous = last_stock_per_day.get(day)
+                if previous is None or previous[0] <= date:
+                    last_stock_per_day[day] = (date, modification.get('newStock'))
+
+            for day, (date, stock) in last_stock_per_day.items():
+                rollup = rollups[(day, company)]
+                rollup['modified'] += 1
+                rollup['modified_stock'][stock_bucket(stock)] += 1
+
+        self.collection.delete_many({})
+        self.ensure_indexes()
+        operations = [
+            ReplaceOne(
+                {'_id': f"{day}|{company}"},
+                {'_id': f"{day}|{company}", 'day': day, 'Company': company, **counters},
+                upsert=True
+            )
+            for (day, company), counters in rollups.items()
+        ]
+        operations.extend(
+            ReplaceOne(
+                {'_id': f"catalog|{company}"},
+                {'_id': f"catalog|{company}", 'Company': company, **counters},
+                upsert=True
+            )
+            for company, counters in catalogs.items()
+        )
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+        logger.info(f"Rebuilt {len(rollups)} daily rollup and {len(catalogs)} catalog documents")
+        return len(operations)
@@ -0,0 +1,207 @@
+"""
+Run the store spiders concurrently in one process.
+
+Every selected spider gets its own crawler in a single CrawlerProcess: the
+stores are different hosts, so their crawls overlap instead of running one
+after the other, and the pipelines share one MongoDB connection pool (see
+price_comparator.pipelines.acquire_client). STORE_SETTINGS (settings.py)
+override the settings of each store, e.g. its concurrency. With
+CRAWL_STATE_DIR set, each store crawls with the JOBDIR <CRAWL_STATE_DIR>/<store>
+(<store>-<hash> with spider arguments, see job_dir): a crawl that did not
+finish resumes where it stopped on the next run with the same arguments.
+
+    python -m price_comparator.runner                 # every store
+    python -m price_comparator.runner tunisianet      # selected stores
+    python -m price_comparator.runner --list
+    python -m price_comparator.runner -s LOG_LEVEL=WARNING --summary-json run.json
+    python -m price_comparator.runner tunisianet -a categories=<url>,<url>
+
+Exit codes: 0 when every store finished, 1 when a store failed (crashed,
+closed for another reason than "finished", or scraped no item and found no
+unchanged product), 2 on invalid
+arguments.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+logger = logging.getLogger(__name__)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+
+# Crawler stats reported in the run summary: summary key -> stats key
+SUMMARY_STATS = {
+    'items': 'item_scraped_count',
+    'dropped': 'item_dropped_count',
+    'unchanged': 'revalidation/products_unchanged',
+    'requests': 'downloader/request_count',
+    'responses': 'downloader/response_count',
+    'errors': 'log_count/ERROR',
+    'peak_pending': 'scheduler/peak_pending',
+    'peak_rss_bytes': 'memusage/peak_rss',
+}
+
+
+class StoreRun:
+    """Outcome of the crawl of one store"""
+
+    def __init__(self, store):
+        self.store = store
+        self.started = time.monotonic()
+        self.elapsed = None
+        self.finish_reason = None
+        self.stats = {}
+        self.error = None
+
+    def spider_closed(self, spider, reason):
+        self.finish_reason = reason
+        self.elapsed = time.monotonic() - self.started
+
+    def crawl_failed(self, failure):
+        self.error = failure.getErrorMessage()
+        if self.elapsed is None:
+            self.elapsed = time.monotonic() - self.started
+        logger.error(f"Crawl of {self.store} failed: {failure.getTraceback()}")
+
+    @property
+    def succeeded(self):
+        return self.error is None and self.finish_reason == 'finished' and (
+            self.stats.get('items', 0) + self.stats.get('unchanged', 0) > 0)
+
+    def summary(self):
+        return {
+            'store': self.store,
+            'status': 'ok' if self.succeeded else 'failed',
+            'finish_reason': self.finish_reason,
+            'error': self.error,
+            'elapsed_seconds': round(self.elapsed or 0, 1),
+            **self.stats,
+        }
+
+
+def store_spider(spidercls, store_settings):
+    """Subclass of a spider whose custom settings are overridden by its store settings"""
+    if not store_settings:
+        return spidercls
+    custom_settings = {**(spidercls.custom_settings or {}), **store_settings}
+    return type(spidercls.__name__, (spidercls,), {'custom_settings': custom_settings})
+
+
+def job_dir(state_dir, store, spider_args=None):
+    """
+    JOBDIR of a crawl: <state_dir>/<store> for a full crawl, suffixed with a
+    hash of the spider arguments otherwise (category subsets of the recrawl
+    scheduler, sitemap discovery), so that runs of a store with other
+    arguments never resume, skip completed categories from, or clear the
+    state of one another. The categories are a set: their order is ignored.
+    """
+    if not spider_args:
+        return os.path.join(state_dir, store)
+    arguments = dict(spider_args)
+    if 'categories' in arguments:
+        categories = {url.strip() for url in arguments['categories'].split(',') if url.strip()}
+        arguments['categories'] = ','.join(sorted(categories))
+    digest = hashlib.sha1(json.dumps(arguments, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(state_dir, f"{store}-{digest}")
+
+
+def parse_setting(value):
+    name, separator, setting = value.partition('=')
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Expected NAME=VALUE, got {value}")
+    return name, setting
+
+
+def run(stores, settings, spider_args=None):
+    """Crawl `stores` concurrently; returns their StoreRun in the same order"""
+    process = CrawlerProcess(settings)
+    store_settings = settings.getdict('STORE_SETTINGS')
+    state_dir = settings.get('CRAWL_STATE_DIR')
+    runs = []
+
+    for store in stores:
+        overrides = dict(store_settings.get(store) or {})
+        if state_dir:
+            overrides.setdefault('JOBDIR', job_dir(state_dir, store, spider_args))
+        spidercls = store_spider(process.spider_loader.load(store), overrides)
+        crawler = process.create_crawler(spidercls)
+        store_run = StoreRun(store)
+        crawler.signals.connect(store_run.spider_closed, signal=signals.spider_closed)
+        deferred = process.crawl(crawler, **(spider_args or {}))
+        deferred.addErrback(store_run.crawl_failed)
+        runs.append((store_run, crawler))
+
+    process.start()
+
+    for store_run, crawler in runs:
+        stats = crawler.stats.get_stats() if crawler.stats else {}
+        store_run.stats = {key: stats.get(stat, 0) for key, stat in SUMMARY_STATS.items()}
+    return [store_run for store_run, _ in runs]
+
+
+def print_summary(runs, elapsed):
+    print(f"Run summary ({elapsed:.1f}s):")
+    for store_run in runs:
+        summary = store_run.summary()
+        print(
+            f"  {summary['store']:<12} {summary['status']:<7} reason={summary['finish_reason']} "
+            f"items={summary['items']} unchanged={summary['unchanged']} dropped={summary['dropped']} requests={summary['requests']} "
+            f"errors={summary['errors']} time={summary['elapsed_seconds']}s "
+            f"peak_rss={summary['peak_rss_bytes'] / 2 ** 20:.0f}MB"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the store spiders concurrently in one process')
+    parser.add_argument('stores', nargs='*', help='Stores (spider names) to crawl, all by default')
+    parser.add_argument('--list', action='store_true', help='List the available stores and exit')
+    parser.add_argument('-s', '--set', dest='settings', action='append', type=parse_setting, default=[],
+                        metavar='NAME=VALUE', help='Override a setting for every store')
+    parser.add_argument('-a', dest='spider_args', action='append', type=parse_setting, default=[],
+                        metavar='NAME=VALUE', help='Spider argument, passed to every store')
+    parser.add_argument('--summary-json', help='Write the run summary to this file')
+    args = parser.parse_args(argv)
+
+    settings = get_project_settings()
+    for name, value in args.settings:
+        settings.set(name, value, priority='cmdline')
+
+    spider_loader = load_object(settings['SPIDER_LOADER_CLASS']).from_settings(settings.frozencopy())
+    available = spider_loader.list()
+    if args.list:
+        print('\n'.join(available))
+        return EXIT_OK
+
+    stores = args.stores or available
+    unknown = sorted(set(stores) - set(available))
+    if unknown:
+        parser.print_usage(sys.stderr)
+        print(f"Unknown stores: {', '.join(unknown)} (available: {', '.join(available)})", file=sys.stderr)
+        return EXIT_USAGE
+
+    started = time.monotonic()
+    runs = run(stores, settings, dict(args.spider_args))
+    elapsed = time.monotonic() - started
+    print_summary(runs, elapsed)
+
+    if args.summary_json:
+        with open(args.summary_json, 'w', encoding='utf-8') as f:
+            json.dump({'elapsed_seconds': round(elapsed, 1), 'stores': [r.summary() for r in runs]}, f, indent=2)
+
+    return EXIT_OK if all(store_run.succeeded for store_run in runs) else EXIT_FAILED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
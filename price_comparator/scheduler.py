@@ -0,0 +1,185 @@
+"""
+Memory-bounded request scheduler.
+
+With a high CONCURRENT_REQUESTS, listing pages fan out into thousands of
+product detail requests, each carrying its item in meta, faster than they are
+downloaded. BoundedScheduler keeps memory flat:
+- at most SCHEDULER_MEMORY_QUEUE_LIMIT requests are queued in memory, the
+  overflow is spilled to a disk queue (a temporary directory without JOBDIR;
+  with a JOBDIR every request is already queued on disk);
+- SCHEDULER_MAX_PENDING caps the queued plus in-flight requests: above it,
+  BackpressureSpiderMiddleware pauses the callbacks yielding new requests
+  (e.g. parse_category) until the pending requests drop below
+  SCHEDULER_RESUME_PENDING (80% of the cap by default).
+
+Requests with a not_before meta (epoch seconds, set by BackoffRetryMiddleware
+on retries) are held in memory until then instead of occupying a downloader
+slot, and put back in the queues if the spider closes first.
+
+Peak pending requests, spilled and delayed requests, backpressure waits and the peak
+resident set size of the process are recorded in the crawl stats. 0 disables a
+limit.
+
+    scrapy crawl tunisianet -s CONCURRENT_REQUESTS=10000 -s SCHEDULER_MAX_PENDING=20000
+"""
+
+import heapq
+import itertools
+import logging
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from scrapy.core.scheduler import Scheduler
+from scrapy.utils.job import job_dir
+from scrapy.utils.misc import create_instance, load_object
+from twisted.internet import defer, reactor, task
+
+logger = logging.getLogger(__name__)
+
+RELEASE_INTERVAL = 0.1  # Seconds between two checks of the paused callbacks
+
+
+def peak_rss_bytes():
+    """Peak resident set size of the process"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class BoundedScheduler(Scheduler):
+    """Scheduler with a bounded memory queue, spilling to disk, and callback backpressure"""
+
+    def __init__(self, dupefilter, jobdir=None, dqclass=None, mqclass=None, logunser=False, stats=None,
+                 pqclass=None, crawler=None, memory_limit=0, max_pending=0, resume_pending=0):
+        # Without a JOBDIR, the disk queue is only used for the overflow of the memory queue
+        self.spill_dir = tempfile.mkdtemp(prefix='scrapy-spill-') if memory_limit and not jobdir else None
+        super().__init__(dupefilter, jobdir or self.spill_dir, dqclass, mqclass, logunser, stats, pqclass, crawler)
+        self.memory_limit = memory_limit
+        self.max_pending = max_pending
+        self.resume_pending = resume_pending or int(max_pending * 0.8)
+        self.peak_pending = 0
+        self.waiters = []
+        self.release_task = None
+        self.delayed = []  # Heap of (not_before, sequence, request)
+        self.delayed_sequence = itertools.count()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        dupefilter_cls = load_object(settings['DUPEFILTER_CLASS'])
+        return cls(
+            dupefilter=create_instance(dupefilter_cls, settings, crawler),
+            jobdir=job_dir(settings),
+            dqclass=load_object(settings['SCHEDULER_DISK_QUEUE']),
+            mqclass=load_object(settings['SCHEDULER_MEMORY_QUEUE']),
+            logunser=settings.getbool('SCHEDULER_DEBUG'),
+            stats=crawler.stats,
+            pqclass=load_object(settings['SCHEDULER_PRIORITY_QUEUE']),
+            crawler=crawler,
+            memory_limit=settings.getint('SCHEDULER_MEMORY_QUEUE_LIMIT'),
+            max_pending=settings.getint('SCHEDULER_MAX_PENDING'),
+            resume_pending=settings.getint('SCHEDULER_RESUME_PENDING'),
+        )
+
+    def open(self, spider):
+        result = super().open(spider)
+        if self.max_pending:
+            self.release_task = task.LoopingCall(self._release_waiters)
+            self.release_task.start(RELEASE_INTERVAL, now=False)
+        return result
+
+    def close(self, reason):
+        if self.release_task and self.release_task.running:
+            self.release_task.stop()
+        self._release(len(self.waiters))
+        # Kept for the next run with a JOBDIR, the delay is over by then
+        for _, _, request in self.delayed:
+            if not self._dqpush(request):
+                self._mqpush(request)
+        self.delayed = []
+        result = super().close(reason)
+        if self.spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+        self.stats.set_value('scheduler/peak_pending', self.peak_pending, spider=self.spider)
+        self.stats.set_value('memusage/peak_rss', peak_rss_bytes(), spider=self.spider)
+        logger.info(f"Peak pending requests: {self.peak_pending}, peak RSS: {peak_rss_bytes() / 2 ** 20:.0f} MB")
+        return result
+
+    def _dqpush(self, request):
+        # Spill mode: memory first, the disk queue takes the overflow
+        if self.spill_dir and len(self.mqs) < self.memory_limit:
+            return False
+        pushed = super()._dqpush(request)
+        if pushed and self.spill_dir:
+            self.stats.inc_value('scheduler/spilled', spider=self.spider)
+        return pushed
+
+    def __len__(self):
+        return super().__len__() + len(self.delayed)
+
+    def enqueue_request(self, request):
+        delay = request.meta.get('not_before', 0) - time.time()
+        if delay > 0:
+            enqueued = self._delay(request, delay)
+        else:
+            enqueued = super().enqueue_request(request)
+        if enqueued:
+            self.peak_pending = max(self.peak_pending, self.pending())
+        return enqueued
+
+    def _delay(self, request, delay):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.df.log(request, self.spider)
+            return False
+        heapq.heappush(self.delayed, (request.meta['not_before'], next(self.delayed_sequence), request))
+        self.stats.inc_value('scheduler/enqueued/delayed', spider=self.spider)
+        # The engine only polls an idle scheduler every few seconds
+        reactor.callLater(delay, self._wake_engine)
+        return True
+
+    def _wake_engine(self):
+        slot = getattr(self.crawler.engine, 'slot', None)
+        if slot is not None:
+            slot.nextcall.schedule()
+
+    def next_request(self):
+        if self.delayed and self.delayed[0][0] <= time.time():
+            _, _, request = heapq.heappop(self.delayed)
+            self.stats.inc_value('scheduler/dequeued/delayed', spider=self.spider)
+            return request
+        return super().next_request()
+
+    def pending(self):
+        """Queued plus in-flight requests"""
+        downloader = getattr(self.crawler.engine, 'downloader', None)
+        return len(self) + (len(downloader.active) if downloader else 0)
+
+    def wait_for_capacity(self):
+        """
+        None when a new request can be scheduled, otherwise a Deferred fired
+        once the pending requests dropped below the resume threshold
+        """
+        if not self.max_pending or self.pending() < self.max_pending:
+            return None
+        waiter = defer.Deferred()
+        self.waiters.append(waiter)
+        self.stats.inc_value('scheduler/backpressure_waits', spider=self.spider)
+        return waiter
+
+    def _release_waiters(self):
+        if not self.waiters:
+            return
+        downloader = getattr(self.crawler.engine, 'downloader', None)
+        if downloader is not None and not downloader.active:
+            # Nothing in flight: the engine may be backing out because the paused
+            # callbacks hold their responses, release them all to avoid a deadlock
+            self._release(len(self.waiters))
+        elif self.pending() < self.resume_pending:
+            self._release(self.resume_pending - self.pending())
+
+    def _release(self, count):
+        released, self.waiters = self.waiters[:count], self.waiters[count:]
+        for waiter in released:
+            waiter.callback(None)
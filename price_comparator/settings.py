@@ -44,25 +44,43 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-#SPIDER_MIDDLEWARES = {
-#    "price_comparator.middlewares.PriceComparatorSpiderMiddleware": 543,
-#}
+SPIDER_MIDDLEWARES = {
+    # Samples PROFILE_PERCENT percent of the callbacks (disabled by default)
+    "price_comparator.middlewares.ProfilingSpiderMiddleware": 950,
+    # Conditional requests, unchanged pages not parsed (enabled by REVALIDATION_DIR)
+    "price_comparator.middlewares.RevalidationSpiderMiddleware": 940,
+    # Pauses callbacks while the scheduler is full (enabled by SCHEDULER_MAX_PENDING)
+    "price_comparator.middlewares.BackpressureSpiderMiddleware": 100,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "price_comparator.middlewares.PriceComparatorDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    # Retries after an exponential backoff with jitter (RETRY_BACKOFF_BASE / RETRY_BACKOFF_MAX)
+    "scrapy.downloadermiddlewares.retry.RetryMiddleware": None,
+    "price_comparator.middlewares.BackoffRetryMiddleware": 550,
+}
+
+# Downloads slower than the HEDGE_PERCENTILE latency of their domain are hedged
+# with a duplicate, the first to complete is kept (price_comparator/hedging.py)
+DOWNLOAD_HANDLERS = {
+    "http": "price_comparator.hedging.HedgingDownloadHandler",
+    "https": "price_comparator.hedging.HedgingDownloadHandler",
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    # Crawl metrics for the node_exporter textfile collector (enabled by METRICS_TEXTFILE_DIR)
+    "price_comparator.extensions.MetricsTextfile": 500,
+    # Crash recovery and completed categories of resumable crawls (enabled by JOBDIR)
+    "price_comparator.extensions.CrawlState": 510,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
+    "price_comparator.pipelines.DuplicateProductPipeline": 200,
     "price_comparator.pipelines.ProductPipeline": 300,
     # Legacy pipelines (uncomment if needed for specific spiders)
     # "price_comparator.pipelines.TunisianetPipeline": 301,
@@ -95,12 +113,113 @@ REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
 FEED_EXPORT_ENCODING = "utf-8"
 
+# Seen request fingerprints kept in a scalable Bloom filter, saved in JOBDIR on close
+# ("price_comparator.dupefilters.CompactRFPDupeFilter" for an exact set).
+# DUPEFILTER_BLOOM_ERROR_RATE: share of new requests wrongly filtered as duplicates
+DUPEFILTER_CLASS = "price_comparator.dupefilters.BloomDupeFilter"
+DUPEFILTER_BLOOM_CAPACITY = 100000  # Keys of the first filter, the next ones double
+DUPEFILTER_BLOOM_ERROR_RATE = 1e-6
+
+# Duplicate products (see DuplicateProductPipeline) are logged at DEBUG
+LOG_FORMATTER = "price_comparator.logformatter.PriceComparatorLogFormatter"
+
+# Memory-bounded scheduling (price_comparator/scheduler.py): requests queued in
+# memory beyond SCHEDULER_MEMORY_QUEUE_LIMIT spill to disk, and callbacks pause
+# while more than SCHEDULER_MAX_PENDING requests are queued or in flight
+# (until they drop below SCHEDULER_RESUME_PENDING, 0: 80% of the cap). 0 disables a limit.
+SCHEDULER = "price_comparator.scheduler.BoundedScheduler"
+SCHEDULER_MEMORY_QUEUE_LIMIT = 5000
+SCHEDULER_MAX_PENDING = 20000
+SCHEDULER_RESUME_PENDING = 0
+
+# Listing pages parsed in PARSE_POOL_WORKERS worker processes (price_comparator/parsing.py),
+# pages smaller than PARSE_POOL_MIN_BYTES inline. 0 workers: everything inline
+PARSE_POOL_WORKERS = 0
+PARSE_POOL_MIN_BYTES = 65536
+
+# Hedged downloads: at most HEDGE_MAX_RATIO of the downloads, once HEDGE_MIN_SAMPLES
+# latencies of the domain are known, never before HEDGE_MIN_DELAY seconds. 0 disables
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.5
+HEDGE_MAX_RATIO = 0.05
+HEDGE_WINDOW = 200  # Latencies kept per domain
+
+# Retry backoff: random delay up to RETRY_BACKOFF_BASE * 2 ** (retries - 1) seconds
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 30.0
+
 # MongoDB Configuration
 MONGO_URI = "mongodb://localhost:27017/"
 MONGO_DATABASE = "product_comparator"
 MONGO_COLLECTION = "products"
 
+# Per-store settings applied by price_comparator.runner (python -m price_comparator.runner),
+# overriding the custom_settings of each spider. The stores are crawled concurrently.
+STORE_SETTINGS = {
+    "tunisianet": {
+        "CONCURRENT_REQUESTS": 16,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 8,
+    },
+    "mytek": {
+        "CONCURRENT_REQUESTS": 8,
+        "DOWNLOAD_DELAY": 1.0,
+    },
+}
+
+# ProductPipeline write mode: "single" (one product at a time) or "bulk"
+# (batches of PIPELINE_BATCH_SIZE products), see benchmarks/pipeline_ingest.py
+PIPELINE_WRITE_MODE = "single"
+PIPELINE_BATCH_SIZE = 500
+
+# Resumable crawls: price_comparator.runner gives each store the JOBDIR
+# <CRAWL_STATE_DIR>/<store> (<store>-<hash> with spider arguments: pending requests,
+# seen fingerprints, completed categories); a crawl that did not finish resumes
+# on the next run with the same arguments, at category granularity after a crash
+CRAWL_STATE_DIR = "crawl_state"
+CRAWL_STATE_FLUSH_INTERVAL = 5  # Seconds between two flushes of the completed categories log
+
+# Revalidation (price_comparator/revalidation.py): validators, body hash and products of
+# every parsed page, kept in <REVALIDATION_DIR>/<store>. Pages unchanged since the
+# previous crawl (304 or same body) are not parsed, their products only get a new
+# LastSeen. Empty to disable
+REVALIDATION_DIR = "revalidation"
+
 # Logging
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s [%(name)s] %(levelname)s: %(message)s"
 LOG_DATEFORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Crawl metrics (price_comparator.extensions.MetricsTextfile)
+METRICS_TEXTFILE_DIR = None  # e.g. "/var/lib/node_exporter/textfile_collector"
+METRICS_TEXTFILE_INTERVAL = 15  # Seconds between two writes of the .prom file
+
+# Profiling: sample PROFILE_PERCENT percent of the spider callbacks and pipeline
+# calls, folded stacks (flamegraph.pl / speedscope) written to PROFILE_DIR
+PROFILE_PERCENT = 0
+PROFILE_DIR = "profiles"
+PROFILE_INTERVAL = 0.001  # Seconds between two samples
+
+# Recrawl scheduler (python -m price_comparator.recrawl): each category is
+# recrawled so that about RECRAWL_TARGET_CHANGE_FRACTION of its products changed
+# since its last crawl. "categories": the spider accepts -a categories=<urls>
+# (otherwise the store is always crawled whole). Durations in seconds.
+RECRAWL_STORES = {
+    "tunisianet": {"company": "Tunisianet", "categories": True},
+    "mytek": {"company": "MyTek", "categories": False},
+}
+RECRAWL_TARGET_CHANGE_FRACTION = 0.05
+RECRAWL_RATE_WINDOW_DAYS = 14  # Price history used for the change rates
+RECRAWL_RATE_REFRESH = 3600
+RECRAWL_MIN_INTERVAL = 3600
+RECRAWL_MAX_INTERVAL = 7 * 86400
+RECRAWL_DEFAULT_INTERVAL = 86400  # Units without products yet
+RECRAWL_FULL_INTERVAL = 7 * 86400  # Full catalog crawl of stores with category crawls
+RECRAWL_JITTER = 0.1
+RECRAWL_RETRY_DELAY = 1800
+RECRAWL_MAX_CONCURRENT_CRAWLS = 2
+RECRAWL_MAX_CATEGORIES_PER_RUN = 50
+RECRAWL_REQUESTS_PER_HOUR = 20000
+RECRAWL_DOMAIN_REQUESTS_PER_HOUR = 10000
+RECRAWL_POLL_INTERVAL = 30
+RECRAWL_RUN_DIR = "recrawl_runs"  # Summaries and logs of the scheduled crawls
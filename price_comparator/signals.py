@@ -0,0 +1,16 @@
+"""
+Custom signals of the price comparator project, sent by the spiders with
+crawler.signals.send_catch_log (see https://docs.scrapy.org/en/latest/topics/signals.html).
+"""
+
+# The last listing page of a category was parsed, or found unchanged by
+# RevalidationSpiderMiddleware. Arguments: spider, category_url
+category_listed = object()
+
+# A category was crawled completely: its listing up to the last page and the
+# detail pages of its products. Arguments: spider, category_url
+category_completed = object()
+
+# Pages unchanged since the previous crawl were not parsed. Arguments: spider,
+# refs (references of the products they listed)
+products_unchanged = object()
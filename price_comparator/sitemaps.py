@@ -0,0 +1,88 @@
+"""
+XML sitemap discovery (spider argument discovery=sitemap).
+
+Instead of walking every category listing, the spider reads the sitemaps
+listed in robots.txt (sitemap indexes and gzipped sitemaps included) and only
+requests the product pages whose <lastmod> changed since they were last
+scraped. LastmodStore keeps the lastmod and product reference of every
+product URL whose item was stored (item_scraped signal) in a dbm file next to the revalidation records
+(<REVALIDATION_DIR>/<spider>-sitemap); the products skipped are sent with the
+products_unchanged signal, like the pages found unchanged by
+RevalidationSpiderMiddleware. Without REVALIDATION_DIR every product URL of
+the sitemaps is requested.
+
+Stats: sitemap/urls (product URLs listed), sitemap/unchanged (skipped on
+lastmod, also counted in revalidation/products_unchanged) and sitemap/products
+(requested).
+"""
+
+import dbm
+import logging
+import os
+
+from scrapy.http import XmlResponse
+from scrapy.utils.gz import gunzip, gzip_magic_number
+from scrapy.utils.sitemap import Sitemap, sitemap_urls_from_robots
+
+logger = logging.getLogger(__name__)
+
+
+def sitemap_body(response):
+    """XML of a sitemap response (gzipped or not), None if it is not a sitemap"""
+    if isinstance(response, XmlResponse):
+        return response.body
+    if gzip_magic_number(response):
+        return gunzip(response.body)
+    # A .xml.gz served with "Content-Encoding: gzip" was already decompressed by HttpCompressionMiddleware
+    if response.url.endswith(".xml") or response.url.endswith(".xml.gz"):
+        return response.body
+    return None
+
+
+def sitemap_links(response):
+    """
+    ('sitemap', url, None) for the sitemaps listed by a robots.txt or sitemap
+    index response, ('url', url, lastmod) for the pages of a sitemap
+    """
+    if response.url.endswith("/robots.txt"):
+        for url in sitemap_urls_from_robots(response.text, base_url=response.url):
+            yield 'sitemap', url, None
+        return
+
+    body = sitemap_body(response)
+    if body is None:
+        logger.warning(f"Ignoring invalid sitemap: {response.url}")
+        return
+    sitemap = Sitemap(body)
+    kind = 'sitemap' if sitemap.type == 'sitemapindex' else 'url'
+    for entry in sitemap:
+        yield kind, entry['loc'], entry.get('lastmod') or None
+
+
+class LastmodStore:
+    """Sitemap lastmod of the product URLs scraped by previous crawls"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.db = dbm.open(path, 'c')
+
+    def unchanged_ref(self, url, lastmod):
+        """
+        Reference of the product scraped from `url` when its lastmod did not
+        change since, None when it must be scraped (always without lastmod)
+        """
+        if not lastmod:
+            return None
+        value = self.db.get(url.encode('utf-8'))
+        if value is None:
+            return None
+        previous, _, ref = value.decode('utf-8').partition('\0')
+        return ref if previous == lastmod else None
+
+    def put(self, url, lastmod, ref):
+        if lastmod and ref:
+            self.db[url.encode('utf-8')] = f"{lastmod}\0{ref}".encode('utf-8')
+
+    def close(self):
+        self.db.close()
@@ -1,7 +1,7 @@
 import random
 import scrapy
 from datetime import datetime
-from price_comparator.items import MytekItem
+from price_comparator.items import ProductItem
 
 
 class MytekSpider(scrapy.Spider):
@@ -27,6 +27,7 @@ class MytekSpider(scrapy.Spider):
         "COOKIES_DEBUG": True,
         # Use the unified ProductPipeline
         "ITEM_PIPELINES": {
+            'price_comparator.pipelines.DuplicateProductPipeline': 200,
             'price_comparator.pipelines.ProductPipeline': 300,
         },
         "CONCURRENT_REQUESTS": 8,
@@ -75,63 +76,62 @@ class MytekSpider(scrapy.Spider):
         self.logger.info(f"Found {len(products)} products on {response.url}")
 
         for product in products:
-            item = MytekItem()
+            item = ProductItem()
 
             try:
                 # Extract product URL
                 url = product.css('a.product-item-link::attr(href)').get()
                 if url:
-                    item['Url'] = url.strip()
+                    item.Url = url.strip()
                 else:
                     continue  # Skip if no URL
 
                 # Extract product name/designation
                 productname = product.css('a.product-item-link::text').get()
-                item['productname'] = productname.strip() if productname else ''
+                item.productname = productname.strip() if productname else ''
 
                 # Extract product reference (remove brackets if present)
                 reference = product.css('div.skuDesktop::text').get()
                 if reference:
-                    item['reference'] = reference.replace('[', '').replace(']', '').strip()
+                    item.reference = reference.replace('[', '').replace(']', '').strip()
                 else:
-                    item['reference'] = ''
+                    item.reference = ''
 
                 # Extract short description (if available on listing page)
                 description = product.css('div.product-item-description::text, div.product-description::text').get()
-                item['description'] = description.strip() if description else ''
+                item.description = description.strip() if description else ''
 
                 # Extract price
                 price_selector = product.css('span[data-price-type="finalPrice"]::attr(data-price-amount)').get()
                 if price_selector:
                     try:
-                        item['price'] = float(price_selector)
+                        item.price = float(price_selector)
                     except ValueError:
                         self.logger.warning(f"Could not parse price: {price_selector}")
-                        item['price'] = 0.0
+                        item.price = 0.0
                 else:
-                    item['price'] = 0.0
+                    item.price = 0.0
 
                 # Extract brand from image alt attribute
                 brand_img = product.css('div.prdtBILCta a img::attr(alt)').get()
-                item['brand'] = brand_img.strip() if brand_img else 'Unknown'
+                item.brand = brand_img.strip() if brand_img else 'Unknown'
 
                 # Extract availability/stock status
                 availability = product.css('div.stock.available span::text').get()
                 if not availability:
                     availability = product.css('div.stock span::text').get()
-                item['availability'] = availability.strip() if availability else 'Unknown'
+                item.availability = availability.strip() if availability else 'Unknown'
 
                 # Extract image URL
                 image_url = product.css('span.product-image-wrapper img::attr(src)').get()
-                item['imageUrl'] = image_url.strip() if image_url else ''
+                item.imageUrl = image_url.strip() if image_url else ''
 
                 # Extract category from URL
-                item['category'] = self._extract_category_from_url(url)
-                item['subcategory'] = ''  # Can be enhanced later if needed
+                item.category = self._extract_category_from_url(url)
+                item.subcategory = ''  # Can be enhanced later if needed
 
-                # Link and name fields (for compatibility)
-                item['link'] = url
-                item['name'] = productname.strip() if productname else ''
+                # The whole catalog is one listing (recrawled as a single unit)
+                item.category_url = self.start_urls[0]
 
                 yield item
 
@@ -1,6 +1,13 @@
+import os
 import scrapy
+from collections import Counter
 from datetime import datetime
-from price_comparator.items import TunisianetItem
+from scrapy import signals
+from price_comparator.items import ProductItem
+from price_comparator.parsing import LISTING_FIELDS, parse_pool, tunisianet_listing
+from price_comparator.signals import category_completed, category_listed, products_unchanged
+from price_comparator.sitemaps import LastmodStore, sitemap_links
+from price_comparator.structured_data import structured_product
 import re
 
 
@@ -27,6 +34,7 @@ class TunisianetSpider(scrapy.Spider):
         "COOKIES_DEBUG": True,
         # Use the unified ProductPipeline
         "ITEM_PIPELINES": {
+            "price_comparator.pipelines.DuplicateProductPipeline": 200,
             "price_comparator.pipelines.ProductPipeline": 300,
         },
         "CONCURRENT_REQUESTS": 10000,
@@ -36,6 +44,59 @@ class TunisianetSpider(scrapy.Spider):
     # Start from sitemap to get all categories
     start_urls = ["https://www.tunisianet.com.tn/sitemap"]
 
+    # discovery=sitemap: XML sitemaps listed in robots.txt, product pages matching product_url_pattern
+    sitemap_urls = ["https://www.tunisianet.com.tn/robots.txt"]
+    product_url_pattern = re.compile(r"/\d+-[^/]+\.html$")
+
+    # Categories completed by an interrupted run of the same job, and whether this
+    # run resumes its saved request queue (set by the CrawlState extension)
+    completed_categories = frozenset()
+    resumed_crawl = False
+
+    def __init__(self, categories=None, discovery="listings", *args, **kwargs):
+        """
+        `categories`: comma-separated category URLs to crawl instead of the
+        whole sitemap (used by the recrawl scheduler, price_comparator/recrawl.py)
+        `discovery`: "listings" (category pages of the HTML sitemap) or "sitemap"
+        (product pages of the XML sitemaps changed since the last crawl, see
+        price_comparator/sitemaps.py)
+        """
+        super().__init__(*args, **kwargs)
+        self.categories = [url.strip() for url in (categories or '').split(",") if url.strip()]
+        if discovery not in ("listings", "sitemap"):
+            raise ValueError(f"Unknown discovery mode: {discovery}")
+        self.discovery = discovery
+        self.sitemap_lastmods = None
+        # Product pages not handled yet per category_url: a category is completed
+        # once its last listing page was parsed and none is left (see _complete)
+        self.pending_details = Counter()
+        self.listed_categories = set()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.category_listed, signal=category_listed)
+        crawler.signals.connect(spider.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(spider.item_scraped, signal=signals.item_scraped)
+        return spider
+
+    def start_requests(self):
+        if self.discovery == "sitemap" and not self.categories:
+            revalidation_dir = self.settings.get("REVALIDATION_DIR")
+            if revalidation_dir:
+                self.sitemap_lastmods = LastmodStore(os.path.join(revalidation_dir, f"{self.name}-sitemap"))
+            for url in self.sitemap_urls:
+                yield self._sitemap_request(url)
+            return
+        if not self.categories:
+            yield from super().start_requests()
+            return
+        self.logger.info(f"Crawling {len(self.categories)} categories")
+        for url in self.categories:
+            if url in self.completed_categories:
+                continue
+            yield scrapy.Request(url, callback=self.parse_category, meta={"category_url": url})
+
     def parse(self, response):
         """Parse sitemap to extract category links"""
         categorys = response.xpath('//a[contains(@id,"category-page")]')
@@ -49,127 +110,177 @@ class TunisianetSpider(scrapy.Spider):
 
                 link = category.attrib.get("href", "")
 
-                if link:
+                if link in self.completed_categories:
+                    self.logger.debug(f"Skipping completed category: {category_name}")
+                elif link:
                     # You can filter specific categories here if needed
                     # For now, scraping all categories
                     # Uncomment the line below to scrape only "Accueil" category
                     # if category_name == 'Accueil':
                     self.logger.info(f"Scraping category: {category_name}")
-                    yield scrapy.Request(link, callback=self.parse_category)
+                    yield scrapy.Request(link, callback=self.parse_category, meta={"category_url": link})
 
             except Exception as e:
                 self.logger.error(f"Error parsing category: {e}")
 
-    def parse_category(self, response):
-        """Parse category page to extract product listings"""
-        articles = response.css("article.product-miniature.js-product-miniature")
-        self.logger.info(f"Found {len(articles)} products on {response.url}")
+    async def parse_category(self, response):
+        """Parse category page to extract product listings (in the parse pool for large pages)"""
+        products, next_page, warnings = await parse_pool(self.crawler).run(tunisianet_listing, response)
+        self.logger.info(f"Found {len(products)} products on {response.url}")
+        for warning in warnings:
+            self.logger.warning(warning)
+        category_url = response.meta.get("category_url", response.url)
 
-        for article in articles:
-            item = TunisianetItem()
+        for fields in products:
+            item = ProductItem(**dict(zip(LISTING_FIELDS, fields)))
 
-            try:
-                # Extract product URL
-                url = article.css("h2.product-title a::attr(href)").get()
-                if url:
-                    item["Url"] = url.strip()
-                else:
-                    continue  # Skip if no URL
-
-                # Extract product name/designation
-                productname = article.css("h2.product-title a::text").get()
-                item["productname"] = productname.strip() if productname else ""
-
-                # Extract product reference (remove brackets)
-                reference = article.css("span.product-reference::text").get()
-                if reference:
-                    item["reference"] = (
-                        reference.replace("[", "").replace("]", "").strip()
-                    )
-                else:
-                    item["reference"] = ""
-
-                # Extract short description
-                description = article.css('div[itemprop="description"]').get()
-                item["description"] = description.strip() if description else ""
-
-                # Extract price
-                price_text = article.css("span.price::text").get()
-                if price_text:
-                    # Remove currency and convert to float
-                    # Format: "0,450 DT" or "1 234,567 DT"
-                    price_cleaned = (
-                        price_text.replace("DT", "")
-                        .replace("\xa0", "")
-                        .replace(" ", "")
-                        .replace(",", ".")
-                        .strip()
-                    )
-                    try:
-                        item["price"] = float(price_cleaned)
-                    except ValueError:
-                        self.logger.warning(f"Could not parse price: {price_text}")
-                        item["price"] = 0.0
-                else:
-                    item["price"] = 0.0
-
-                # Extract brand from manufacturer logo
-                brand_img = article.css("img.manufacturer-logo::attr(alt)").get()
-                item["brand"] = brand_img.strip() if brand_img else "Unknown"
-
-                # Extract availability/stock status
-                # Try multiple selectors for stock availability
-                availability = (
-                    article.css("div#stock_availability span::text").get()
-                    or article.css("span.in-stock::text").get()
-                    or article.css("span.out-of-stock::text").get()
-                    or ""
-                )
-                item["availability"] = (
-                    availability.strip() if availability else "Unknown"
-                )
+            # Extract basic category from URL (will be improved by visiting product page)
+            item.category = self._extract_category_from_url(item.Url)
 
-                # Extract image URL
-                image_url = (
-                    article.css(
-                        "img.center-block.img-responsive::attr(data-full-size-image-url)"
-                    ).get()
-                    or article.css("img.center-block.img-responsive::attr(src)").get()
-                    or ""
-                )
-                item["imageUrl"] = image_url.strip() if image_url else ""
-
-                # Extract basic category from URL (will be improved by visiting product page)
-                basic_category = self._extract_category_from_url(url)
-                item["category"] = basic_category
-                item["subcategory"] = ""
-
-                # Link field (for compatibility)
-                item["link"] = url
-                item["name"] = productname.strip() if productname else ""
-
-                # Follow to product detail page to get proper category/subcategory from breadcrumb
-                # Pass the item as meta to continue processing after breadcrumb extraction
-                yield scrapy.Request(
-                    url,
-                    callback=self.parse_product_detail,
-                    meta={"item": item},
-                    priority=1,
-                )
+            # Category listing the product was found on
+            item.category_url = category_url
 
-            except Exception as e:
-                self.logger.error(f"Error parsing product in article: {e}")
-                continue
+            # Follow to product detail page to get proper category/subcategory from breadcrumb
+            # Pass the item as meta to continue processing after breadcrumb extraction
+            yield self._detail_request(item)
 
         # Follow pagination
         try:
-            next_page = response.css("a.next.js-search-link::attr(href)").get()
             if next_page:
                 self.logger.info(f"Following pagination: {next_page}")
-                yield response.follow(next_page, callback=self.parse_category)
+                yield response.follow(next_page, callback=self.parse_category,
+                                      meta={"category_url": category_url})
+            else:
+                # Last listing page: completed once its product pages are handled too
+                self.crawler.signals.send_catch_log(category_listed, spider=self, category_url=category_url)
         except Exception as e:
             self.logger.info(f"No more pages or error in pagination: {e}")
 
+    def _detail_request(self, item):
+        """Product detail page, pending for its category until handled"""
+        self.pending_details[item.category_url] += 1
+        return scrapy.Request(
+            item.Url,
+            callback=self.parse_product_detail,
+            errback=self.detail_failed,
+            meta={"item": item},
+            priority=1,
+        )
+
+    def _detail_handled(self, request):
+        category_url = request.meta["item"].category_url
+        self.pending_details[category_url] -= 1
+        self._complete(category_url)
+
+    def _complete(self, category_url):
+        """
+        Signal a listed category as completed once none of its product pages is
+        pending: a crawl restarted after a crash skips it. Not in a crawl resumed
+        from a saved queue, whose restored product pages were not counted.
+        """
+        if (category_url in self.listed_categories and self.pending_details[category_url] <= 0
+                and not self.resumed_crawl):
+            del self.pending_details[category_url]
+            self.listed_categories.discard(category_url)
+            self.crawler.signals.send_catch_log(category_completed, spider=self, category_url=category_url)
+
+    def category_listed(self, spider, category_url):
+        if spider is self:
+            self.listed_categories.add(category_url)
+            self._complete(category_url)
+
+    def request_dropped(self, request, spider):
+        # Product page already requested from another listing (dupefilter)
+        if request.callback == self.parse_product_detail:
+            self._detail_handled(request)
+
+    def detail_failed(self, failure):
+        self.logger.error(f"Could not fetch product page {failure.request.url}: {failure.value!r}")
+        self._detail_handled(failure.request)
+
+    def parse_sitemap(self, response):
+        """Follow the sitemaps of robots.txt and sitemap indexes, request the changed product pages"""
+        stats = self.crawler.stats
+        unchanged_refs = []
+        for kind, url, lastmod in sitemap_links(response):
+            if kind == "sitemap":
+                yield self._sitemap_request(url)
+            elif self.product_url_pattern.search(url):
+                stats.inc_value("sitemap/urls", spider=self)
+                ref = self.sitemap_lastmods.unchanged_ref(url, lastmod) if self.sitemap_lastmods is not None else None
+                if ref is not None:
+                    unchanged_refs.append(ref)
+                    continue
+                stats.inc_value("sitemap/products", spider=self)
+                yield scrapy.Request(url, callback=self.parse_product, priority=1,
+                                     meta={"sitemap_loc": url, "lastmod": lastmod})
+
+        if unchanged_refs:
+            stats.inc_value("sitemap/unchanged", len(unchanged_refs), spider=self)
+            stats.inc_value("revalidation/products_unchanged", len(unchanged_refs), spider=self)
+            self.crawler.signals.send_catch_log(products_unchanged, spider=self, refs=unchanged_refs)
+
+    def _sitemap_request(self, url):
+        # Always parsed: replaying the requests of an unchanged sitemap would bypass the lastmod filter
+        return scrapy.Request(url, callback=self.parse_sitemap, meta={"dont_revalidate": True})
+
+    def parse_product(self, response):
+        """Product page found in a sitemap: fields from its JSON-LD/microdata"""
+        product = structured_product(response)
+        if product is None:
+            self.crawler.stats.inc_value("structured_data/missing", spider=self)
+            self.logger.warning(f"No structured product data on {response.url}")
+            return
+        self.crawler.stats.inc_value(f"structured_data/{product['source']}", spider=self)
+
+        item = ProductItem(
+            Url=product.get("Url", response.url),
+            productname=product.get("productname", ""),
+            reference=product.get("reference", ""),
+            description=product.get("description", ""),
+            imageUrl=product.get("imageUrl", ""),
+        )
+        if product.get("price") is None:
+            self.logger.warning(f"Could not parse price on {response.url}")
+        item.price = product.get("price") or 0.0
+        # Not in the Tunisianet microdata: manufacturer logo as on the listings
+        brand = product.get("brand") or response.css("img.manufacturer-logo::attr(alt)").get()
+        item.brand = brand.strip() if brand else "Unknown"
+        # Displayed stock first: the offer availability of Tunisianet is not kept up to date
+        availability = (
+            response.css("div#stock_availability span::text").get()
+            or product.get("availability")
+        )
+        item.availability = availability.strip() if availability else "Unknown"
+
+        # Breadcrumb without the product itself, deepest category listing as recrawl unit
+        crumbs = product["breadcrumb"][:-1]
+        category, subcategory = self._breadcrumb_categories([name for name, url in crumbs])
+        item.category = category or self._extract_category_from_url(item.Url)
+        item.subcategory = subcategory
+        item.category_url = crumbs[-1][1] if crumbs and crumbs[-1][1] else ""
+
+        yield item
+
+    def item_scraped(self, item, response, spider):
+        """Lastmod of a sitemap product, recorded once the pipelines stored its item"""
+        if self.sitemap_lastmods is not None and "sitemap_loc" in response.meta:
+            self.sitemap_lastmods.put(response.meta["sitemap_loc"], response.meta.get("lastmod"), item.reference)
+
+    def closed(self, reason):
+        if self.sitemap_lastmods is not None:
+            self.sitemap_lastmods.close()
+
+    def _breadcrumb_categories(self, breadcrumb_items):
+        """(category, subcategory) of breadcrumb names without the product name"""
+        # Remove 'Accueil' (Home) if present
+        if breadcrumb_items and breadcrumb_items[0].strip().lower() == "accueil":
+            breadcrumb_items = breadcrumb_items[1:]
+        category = breadcrumb_items[0].strip() if breadcrumb_items else ""
+        # Use the last category level as subcategory
+        subcategory = breadcrumb_items[-1].strip() if len(breadcrumb_items) >= 2 else ""
+        return category, subcategory
+
     def parse_product_detail(self, response):
         """Parse product detail page to extract category/subcategory from breadcrumb"""
         item = response.meta["item"]
@@ -180,21 +291,15 @@ class TunisianetSpider(scrapy.Spider):
                 'nav.breadcrumb ol li[itemprop="itemListElement"] span[itemprop="name"]::text'
             ).getall()
 
-            # Remove 'Accueil' (Home) if present
-            if breadcrumb_items and breadcrumb_items[0].strip().lower() == "accueil":
-                breadcrumb_items = breadcrumb_items[1:]
-
             # Remove the last item (product name)
-            if breadcrumb_items and len(breadcrumb_items) > 0:
-                breadcrumb_items = breadcrumb_items[:-1]
+            breadcrumb_items = breadcrumb_items[:-1]
 
             # Extract category and subcategory from breadcrumb
-            if len(breadcrumb_items) >= 1:
-                item["category"] = breadcrumb_items[0].strip()
-
-            if len(breadcrumb_items) >= 2:
-                # Use the last category level as subcategory
-                item["subcategory"] = breadcrumb_items[-1].strip()
+            category, subcategory = self._breadcrumb_categories(breadcrumb_items)
+            if category:
+                item.category = category
+            if subcategory:
+                item.subcategory = subcategory
 
             self.logger.debug(f"Extracted breadcrumb: {breadcrumb_items}")
 
@@ -203,6 +308,7 @@ class TunisianetSpider(scrapy.Spider):
             # Keep the URL-based category if breadcrumb fails
 
         yield item
+        self._detail_handled(response.request)
 
     def _extract_category_from_url(self, url):
         """
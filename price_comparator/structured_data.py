@@ -0,0 +1,192 @@
+"""
+Product data embedded in pages as schema.org JSON-LD or microdata.
+
+Structured data is published for search engines and is more stable than the
+page layout: the product name, SKU, price and breadcrumb are read from it
+instead of CSS selectors when a page provides it. Tunisianet product pages
+carry microdata (Product, Offer, BreadcrumbList), other PrestaShop or Magento
+themes often JSON-LD; both are handled.
+
+    >>> product = structured_product(Selector(text=html))
+    {'productname': ..., 'reference': ..., 'price': 0.45, ..., 'breadcrumb': [(name, url), ...]}
+"""
+
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# schema.org ItemAvailability values, in the wording ProductPipeline._parse_stock_status understands
+SCHEMA_AVAILABILITY = {
+    'InStock': 'In stock',
+    'InStoreOnly': 'In stock',
+    'LimitedAvailability': 'In stock',
+    'OnlineOnly': 'In stock',
+    'OutOfStock': 'Out of stock',
+    'SoldOut': 'Out of stock',
+    'Discontinued': 'Out of stock',
+    'PreOrder': 'Pre-order',
+    'PreSale': 'Pre-order',
+    'BackOrder': 'Pre-order',
+}
+
+
+def _first(value):
+    """First value of a property, which may be repeated (list) in both formats"""
+    while isinstance(value, list):
+        value = value[0] if value else None
+    return value
+
+
+def _text(value):
+    """Text of a property that may be a nested item (e.g. a Brand with a name)"""
+    value = _first(value)
+    if isinstance(value, dict):
+        value = _first(value.get('name'))
+    return value.strip() if isinstance(value, str) else None
+
+
+def _is_type(node, schema_type):
+    types = node.get('@type', [])
+    if not isinstance(types, list):
+        types = [types]
+    return any(isinstance(t, str) and t.rstrip('/').rsplit('/', 1)[-1] == schema_type for t in types)
+
+
+def _parse_price(value):
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace('\xa0', '').replace(' ', '').replace(',', '.'))
+    except ValueError:
+        return None
+
+
+# JSON-LD
+
+def json_ld_nodes(selector):
+    """Every node of the JSON-LD scripts of a page, @graph lists flattened"""
+    nodes = []
+    for script in selector.xpath('//script[@type="application/ld+json"]/text()').getall():
+        try:
+            data = json.loads(script)
+        except ValueError as e:
+            logger.debug(f"Ignoring invalid JSON-LD: {e}")
+            continue
+        pending = data if isinstance(data, list) else [data]
+        while pending:
+            node = pending.pop(0)
+            if not isinstance(node, dict):
+                continue
+            if '@graph' in node:
+                pending.extend(node['@graph'] if isinstance(node['@graph'], list) else [node['@graph']])
+            nodes.append(node)
+    return nodes
+
+
+# Microdata
+
+def _microdata_value(element):
+    if 'itemscope' in element.attrib:
+        return microdata_item(element)
+    tag = element.tag.lower() if isinstance(element.tag, str) else ''
+    if 'content' in element.attrib:
+        return element.get('content')
+    if tag in ('a', 'link', 'area'):
+        return element.get('href')
+    if tag in ('img', 'audio', 'video', 'source', 'embed', 'iframe'):
+        return element.get('src')
+    if tag in ('data', 'meter'):
+        return element.get('value')
+    return ' '.join(element.text_content().split())
+
+
+def _collect_properties(element, item):
+    for child in element.iterchildren():
+        if not isinstance(child.tag, str):
+            continue  # Comments, processing instructions
+        names = child.get('itemprop')
+        if names:
+            value = _microdata_value(child)
+            for name in names.split():
+                item.setdefault(name, []).append(value)
+        if 'itemscope' not in child.attrib:
+            # The properties of a nested item belong to it
+            _collect_properties(child, item)
+
+
+def microdata_item(element):
+    """Properties of an itemscope element as a dict of lists (nested items as dicts)"""
+    item = {'@type': (element.get('itemtype') or '').split()}
+    _collect_properties(element, item)
+    return item
+
+
+def microdata_nodes(selector):
+    """Top-level microdata items of a page"""
+    return [microdata_item(element.root) for element in selector.xpath('//*[@itemscope and not(@itemprop)]')]
+
+
+# Products
+
+def breadcrumb(nodes):
+    """(name, url) of the BreadcrumbList elements, in position order"""
+    for node in nodes:
+        if not _is_type(node, 'BreadcrumbList'):
+            continue
+        elements = node.get('itemListElement') or []
+        if not isinstance(elements, list):
+            elements = [elements]
+        crumbs = []
+        for index, element in enumerate(elements):
+            if not isinstance(element, dict):
+                continue
+            target = _first(element.get('item'))
+            url = _first(target.get('@id') or target.get('url')) if isinstance(target, dict) else target
+            name = _text(element.get('name')) or _text(target)
+            try:
+                position = int(_first(element.get('position')))
+            except (TypeError, ValueError):
+                position = index
+            crumbs.append((position, name or '', url or ''))
+        return [(name, url) for position, name, url in sorted(crumbs, key=lambda crumb: crumb[0])]
+    return []
+
+
+def product_fields(node):
+    """ProductItem fields found in a schema.org Product node, missing ones omitted"""
+    fields = {
+        'productname': _text(node.get('name')),
+        'reference': _text(node.get('sku')) or _text(node.get('mpn')) or _text(node.get('productID')),
+        'description': _text(node.get('description')),
+        'brand': _text(node.get('brand')),
+        'Url': _text(node.get('url')),
+    }
+
+    image = _first(node.get('image'))
+    fields['imageUrl'] = _first(image.get('url') or image.get('contentUrl')) if isinstance(image, dict) else image
+
+    offer = _first(node.get('offers'))
+    if isinstance(offer, dict):
+        # AggregateOffer: lowest price
+        fields['price'] = _parse_price(_first(offer.get('price')) or _first(offer.get('lowPrice')))
+        availability = _first(offer.get('availability'))
+        if isinstance(availability, str):
+            availability = availability.rstrip('/').rsplit('/', 1)[-1]
+            fields['availability'] = SCHEMA_AVAILABILITY.get(availability, availability)
+
+    return {field: value for field, value in fields.items() if value not in (None, '')}
+
+
+def structured_product(selector):
+    """
+    Fields of the product described by the JSON-LD or, failing that, the
+    microdata of a page, with its 'breadcrumb' and the 'source' format.
+    None when the page describes no product.
+    """
+    for source, extract in (('json-ld', json_ld_nodes), ('microdata', microdata_nodes)):
+        nodes = extract(selector)
+        product = next((node for node in nodes if _is_type(node, 'Product')), None)
+        if product is not None:
+            return {**product_fields(product), 'breadcrumb': breadcrumb(nodes), 'source': source}
+    return None
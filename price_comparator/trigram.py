@@ -0,0 +1,182 @@
+"""
+Trigram index for typo-tolerant product search.
+
+Every product gets one document in the `product_trigrams` collection holding
+the trigrams of its normalized Designation and Ref. A multikey index on the
+trigram array lets a fuzzy lookup fetch only the candidates sharing one of the
+selective trigrams of the search term, which are then ranked by similarity
+inside the aggregation instead of regex-scanning the products collection.
+"""
+
+import logging
+import math
+import re
+import unicodedata
+
+from pymongo import ReplaceOne
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_COLLECTION = "product_trigrams"
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_text(text):
+    """
+    Normalize text for trigram matching:
+    lowercase, strip accents and replace punctuation with spaces.
+    Example: "Ordinateur Portable Lenovo IdeaPad (Gén 11)" -> "ordinateur portable lenovo ideapad gen 11"
+    """
+    if not text:
+        return ''
+
+    decomposed = unicodedata.normalize('NFKD', str(text).lower())
+    without_accents = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(' ', without_accents).strip()
+
+
+def make_trigrams(text):
+    """
+    Split normalized text into the sorted list of its distinct trigrams.
+    Each word is padded (two spaces before, one after) so that short words
+    and word boundaries still produce trigrams, like PostgreSQL's pg_trgm.
+    """
+    trigrams = set()
+    for word in normalize_text(text).split():
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            trigrams.add(padded[i:i + 3])
+    return sorted(trigrams)
+
+
+def selective_trigrams(trigrams):
+    """
+    Trigrams of a search term used to find candidates. The padded word-start
+    trigrams ("  o", " or"...) are shared by most products and would select
+    nearly the whole index: word-interior trigrams are used when the term has
+    some, otherwise all but the single-letter "  x" ones (e.g. "hp", "pc").
+    """
+    interior = [trigram for trigram in trigrams if ' ' not in trigram]
+    if interior:
+        return interior
+    return [trigram for trigram in trigrams if not trigram.startswith('  ')] or trigrams
+
+
+class TrigramIndex:
+    """
+    Trigram index over product Designation and Ref, keyed by Ref.
+    """
+
+    def __init__(self, db, collection_name=TRIGRAM_COLLECTION):
+        self.collection = db[collection_name]
+
+    def ensure_indexes(self):
+        """Create the multikey index used to find candidates"""
+        self.collection.create_index("Trigrams")
+
+    @staticmethod
+    def build_document(product):
+        """Build the index document of a product"""
+        text = f"{product.get('Designation', '')} {product.get('Ref', '')}"
+        return {
+            '_id': product['Ref'],
+            'Trigrams': make_trigrams(text),
+        }
+
+    def index_product(self, product):
+        """Insert or refresh the trigrams of a single product"""
+        if not product.get('Ref'):
+            return
+        document = self.build_document(product)
+        self.collection.replace_one({'_id': document['_id']}, document, upsert=True)
+
+    def index_products(self, products):
+        """Insert or refresh the trigrams of several products in one bulk write"""
+        operations = []
+        for product in products:
+            if product.get('Ref'):
+                document = self.build_document(product)
+                operations.append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    @staticmethod
+    def search_pipeline(text, limit=200, min_similarity=0.3):
+        """
+        Aggregation pipeline ranking the products of the index against `text`,
+        or None when the text has no trigram. Each result is
+        {'_id': ref, 'similarity': ..., 'overlap': ...}.
+
+        Similarity is the share of the search term's trigrams found in the
+        product, so a short query still matches a long designation. Ties are
+        broken by the overall overlap (Jaccard), which favours closer names.
+
+        Candidates are fetched through the index on the selective trigrams
+        only, and those sharing fewer trigrams than `min_similarity` requires
+        are dropped before scoring; all the trigrams count in the scores.
+        """
+        query_trigrams = make_trigrams(text)
+        if not query_trigrams:
+            return None
+
+        query_size = len(query_trigrams)
+        # Tolerance: 0.3 * 10 is 3.0000000000000004
+        min_shared = max(math.ceil(min_similarity * query_size - 1e-9), 1)
+        return [
+            {'$match': {'Trigrams': {'$in': selective_trigrams(query_trigrams)}}},
+            {
+                '$project': {
+                    'shared': {'$size': {'$setIntersection': ['$Trigrams', query_trigrams]}},
+                    'total': {'$size': '$Trigrams'}
+                }
+            },
+            {'$match': {'shared': {'$gte': min_shared}}},
+            {
+                '$project': {
+                    'similarity': {'$divide': ['$shared', query_size]},
+                    'overlap': {
+                        '$divide': [
+                            '$shared',
+                            {'$subtract': [{'$add': ['$total', query_size]}, '$shared']}
+                        ]
+                    }
+                }
+            },
+            {'$match': {'similarity': {'$gte': min_similarity}}},
+            {'$sort': {'similarity': -1, 'overlap': -1}},
+            {'$limit': limit}
+        ]
+
+    def search(self, text, limit=200, min_similarity=0.3):
+        """Return up to `limit` (ref, similarity) tuples ranked by similarity"""
+        pipeline = self.search_pipeline(text, limit, min_similarity)
+        if pipeline is None:
+            return []
+        return [(doc['_id'], doc['similarity']) for doc in self.collection.aggregate(pipeline)]
+
+    def rebuild(self, products_collection, batch_size=1000):
+        """Rebuild the whole index from the products collection"""
+        self.collection.delete_many({})
+        self.ensure_indexes()
+
+        operations = []
+        total = 0
+        cursor = products_collection.find(
+            {'Ref': {'$exists': True, '$ne': ''}},
+            {'Ref': 1, 'Designation': 1}
+        )
+        for product in cursor:
+            document = self.build_document(product)
+            operations.append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+            if len(operations) >= batch_size:
+                self.collection.bulk_write(operations, ordered=False)
+                total += len(operations)
+                operations = []
+
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+            total += len(operations)
+
+        logger.info(f"Rebuilt trigram index for {total} products")
+        return total
@@ -2,7 +2,8 @@
 
 ###############################################################################
 # Run All Scrapers Script
-# This script runs both TunisiaNet and MyTek scrapers sequentially
+# This script runs the TunisiaNet and MyTek scrapers concurrently
+# (price_comparator/runner.py)
 ###############################################################################
 
 # Get script directory
@@ -24,29 +25,17 @@ echo "Started at: $(date)" | tee -a "$LOG_FILE"
 # Activate virtual environment
 source venv/bin/activate
 
-# Run TunisiaNet scraper
-echo -e "\n${YELLOW}[1/2] Running TunisiaNet scraper...${NC}" | tee -a "$LOG_FILE"
-scrapy crawl tunisianet 2>&1 | tee -a "$LOG_FILE"
-TUNISIANET_STATUS=${PIPESTATUS[0]}
+# Run every store concurrently in one process (or only the stores given as arguments,
+# e.g. ./run_all_scrapers.sh mytek). Per-store settings: STORE_SETTINGS in settings.py
+echo -e "\n${YELLOW}Running store scrapers: ${*:-all}...${NC}" | tee -a "$LOG_FILE"
+PYTHONPATH="$SCRIPT_DIR" python -m price_comparator.runner "$@" \
+    --summary-json "$SCRIPT_DIR/scraper_summary.json" 2>&1 | tee -a "$LOG_FILE"
+RUN_STATUS=${PIPESTATUS[0]}
 
-if [ $TUNISIANET_STATUS -eq 0 ]; then
-    echo -e "${GREEN}✓ TunisiaNet scraper completed successfully${NC}" | tee -a "$LOG_FILE"
+if [ $RUN_STATUS -eq 0 ]; then
+    echo -e "${GREEN}✓ All scrapers completed successfully${NC}" | tee -a "$LOG_FILE"
 else
-    echo -e "${RED}✗ TunisiaNet scraper failed with exit code $TUNISIANET_STATUS${NC}" | tee -a "$LOG_FILE"
-fi
-
-# Small delay between scrapers
-sleep 5
-
-# Run MyTek scraper
-echo -e "\n${YELLOW}[2/2] Running MyTek scraper...${NC}" | tee -a "$LOG_FILE"
-scrapy crawl mytek 2>&1 | tee -a "$LOG_FILE"
-MYTEK_STATUS=${PIPESTATUS[0]}
-
-if [ $MYTEK_STATUS -eq 0 ]; then
-    echo -e "${GREEN}✓ MyTek scraper completed successfully${NC}" | tee -a "$LOG_FILE"
-else
-    echo -e "${RED}✗ MyTek scraper failed with exit code $MYTEK_STATUS${NC}" | tee -a "$LOG_FILE"
+    echo -e "${RED}✗ Scrapers failed with exit code $RUN_STATUS (see the run summary above)${NC}" | tee -a "$LOG_FILE"
 fi
 
 # Deactivate virtual environment
@@ -64,9 +53,5 @@ if command -v mongosh &> /dev/null; then
     fi
 fi
 
-# Exit with error if any scraper failed
-if [ $TUNISIANET_STATUS -ne 0 ] || [ $MYTEK_STATUS -ne 0 ]; then
-    exit 1
-fi
-
-exit 0
+# Exit with the runner status (1: a store failed, 2: invalid arguments)
+exit $RUN_STATUS
@@ -0,0 +1,45 @@
+"""
+Production launcher of the asynchronous API (asgi_app.py).
+
+Starts uvicorn with several worker processes; each one runs its own event
+loop and MongoDB connection pool, and serves many requests concurrently.
+
+Usage:
+    python serve_async.py [--workers 4] [--host 0.0.0.0] [--port 5000]
+
+Requires the optional packages quart, motor and uvicorn
+(uvloop and httptools are used automatically when installed).
+"""
+
+import argparse
+import os
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the price comparator API with ASGI workers")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument('--backlog', type=int, default=2048,
+                        help="Pending connections queued by the listening socket")
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    # The application is given as an import string so each worker process imports it itself
+    uvicorn.run(
+        'asgi_app:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        backlog=args.backlog,
+        log_level=args.log_level,
+        proxy_headers=True,
+        timeout_keep_alive=5,
+    )
+
+
+if __name__ == '__main__':
+    main()
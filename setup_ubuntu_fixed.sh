@@ -189,42 +189,44 @@ echo "Flask API service status:"
 sudo systemctl status price-comparator-api.service --no-pager | head -n 15
 
 ###############################################################################
-# 9. Setup Cron Job for TunisiaNet Scraper (Every 12 Hours)
+# 9. Create Systemd Service for the Recrawl Scheduler
 ###############################################################################
-echo -e "\n${YELLOW}[7/8] Setting up automated scraping (every 12 hours)...${NC}"
+echo -e "\n${YELLOW}[7/8] Creating systemd service for the recrawl scheduler...${NC}"
 
-# Create scraper run script
-cat > "$PROJECT_DIR/run_tunisianet_scraper.sh" <<'EOF'
-#!/bin/bash
-
-# Get script directory
-SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
-cd "$SCRIPT_DIR/price_comparator"
+# The scheduler replaces the fixed 12-hour cron crawl: each category is recrawled
+# according to its price change rate (see price_comparator/recrawl.py)
+(crontab -l 2>/dev/null | grep -v "run_tunisianet_scraper.sh") | crontab -
 
-# Activate virtual environment
-source venv/bin/activate
+sudo tee /etc/systemd/system/price-comparator-recrawl.service > /dev/null <<EOF
+[Unit]
+Description=Price Comparator Recrawl Scheduler
+After=network.target ${MONGO_SERVICE}.service
+Requires=${MONGO_SERVICE}.service
 
-# Run the spider
-echo "=== Starting TunisiaNet scraper at $(date) ===" >> "$SCRIPT_DIR/scraper.log"
-scrapy crawl tunisianet 2>&1 | tee -a "$SCRIPT_DIR/scraper.log"
-echo "=== Finished TunisiaNet scraper at $(date) ===" >> "$SCRIPT_DIR/scraper.log"
+[Service]
+Type=simple
+User=$CURRENT_USER
+WorkingDirectory=$PROJECT_DIR/price_comparator
+Environment="PATH=$PROJECT_DIR/price_comparator/venv/bin"
+Environment="PYTHONPATH=$PROJECT_DIR"
+ExecStart=$PROJECT_DIR/price_comparator/venv/bin/python -m price_comparator.recrawl
+Restart=always
+RestartSec=30
+KillMode=mixed
+TimeoutStopSec=60
 
-# Deactivate virtual environment
-deactivate
+[Install]
+WantedBy=multi-user.target
 EOF
 
-# Make the script executable
-chmod +x "$PROJECT_DIR/run_tunisianet_scraper.sh"
-
-# Add cron job (runs at midnight and noon every day)
-CRON_JOB="0 */12 * * * $PROJECT_DIR/run_tunisianet_scraper.sh"
+sudo systemctl daemon-reload
+sudo systemctl enable price-comparator-recrawl.service
+sudo systemctl start price-comparator-recrawl.service
 
-# Check if cron job already exists
-(crontab -l 2>/dev/null | grep -v "run_tunisianet_scraper.sh"; echo "$CRON_JOB") | crontab -
+sleep 3
 
-echo "Cron job added successfully!"
-echo "The TunisiaNet scraper will run every 12 hours (at midnight and noon)"
-crontab -l | grep "run_tunisianet_scraper.sh"
+echo "Recrawl scheduler service status:"
+sudo systemctl status price-comparator-recrawl.service --no-pager | head -n 15
 
 ###############################################################################
 # 10. Setup Next.js Frontend (Optional)
@@ -255,21 +257,21 @@ echo -e "\n${GREEN}=== Setup Complete! ===${NC}"
 echo -e "\n${GREEN}✓ MongoDB:${NC} Running as '$MONGO_SERVICE' service"
 echo -e "${GREEN}✓ Flask API:${NC} Running on http://localhost:5000"
 echo -e "${GREEN}✓ Scrapy:${NC} Environment ready"
-echo -e "${GREEN}✓ TunisiaNet Scraper:${NC} Scheduled to run every 12 hours"
+echo -e "${GREEN}✓ Recrawl Scheduler:${NC} Running as 'price-comparator-recrawl' service"
 
 echo -e "\n${YELLOW}Useful Commands:${NC}"
 echo "  View API logs:        sudo journalctl -u price-comparator-api.service -f"
 echo "  Restart API:          sudo systemctl restart price-comparator-api.service"
 echo "  Stop API:             sudo systemctl stop price-comparator-api.service"
-echo "  View scraper logs:    tail -f $PROJECT_DIR/scraper.log"
-echo "  Run scraper manually: $PROJECT_DIR/run_tunisianet_scraper.sh"
-echo "  View cron jobs:       crontab -l"
+echo "  View scheduler logs:  sudo journalctl -u price-comparator-recrawl.service -f"
+echo "  View crawl schedule:  cd $PROJECT_DIR/price_comparator && PYTHONPATH=$PROJECT_DIR venv/bin/python -m price_comparator.recrawl --status"
+echo "  Run scrapers now:     $PROJECT_DIR/run_all_scrapers.sh [store ...]"
 echo "  MongoDB shell:        mongosh"
 echo "  MongoDB status:       sudo systemctl status $MONGO_SERVICE"
 
 echo -e "\n${YELLOW}Next Steps:${NC}"
 echo "  1. Check API is running: curl http://localhost:5000/products"
-echo "  2. Run initial scrape:   $PROJECT_DIR/run_tunisianet_scraper.sh"
+echo "  2. Run initial scrape:   $PROJECT_DIR/run_all_scrapers.sh"
 echo "  3. Monitor the logs to ensure everything works correctly"
 
 echo -e "\n${GREEN}Setup completed successfully!${NC}"